@@ -1,12 +1,12 @@
 from .base_agent import BaseAgent
 from .file_categorizer_agent import FileCategorizerAgent
 from .file_summarizer_agent import FileSummarizerAgent
-from .method_name_searcher_agent import MethodNameSearcherAgent
+from .method_name_searcher import MethodNameSearcher
 from .method_documenter_agent import MethodDocumenterAgent
 
 __all__ = ["BaseAgent",
            "FileCategorizerAgent",
            "FileSummarizerAgent",
-           "MethodNameSearcherAgent",
+           "MethodNameSearcher",
            "MethodDocumenterAgent"
            ]
@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 
 from langchain.schema import AIMessage
 from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph.graph import CompiledGraph
 from langgraph.graph.state import Command
 from langgraph.prebuilt import create_react_agent
@@ -28,10 +29,15 @@ class BaseAgent(ABC):
     def tools(self) -> list:
         pass
 
+    def respond(self, state, config: RunnableConfig | None = None) -> AIMessage:
+        """
+        Runs the agent and returns its last message, without routing to another node.
+        """
+        response = self.agent.invoke(state, config)
+        return AIMessage(content=response["messages"][-1].content, name=self.name)
+
     def invoke(self, state) -> dict:
-        response = self.agent.invoke(state)
         return Command(
             goto="supervisor",
-            update={"messages": [AIMessage(
-                content=response["messages"][-1].content, name=self.name)]}
+            update={"messages": [self.respond(state)]}
         )
@@ -2,10 +2,25 @@
 
 from typing import LiteralString
 
+from langchain.schema import AIMessage, HumanMessage
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
+
 from server.agents import BaseAgent
+from server.file_classifier import CONFIDENCE_THRESHOLD, classify_file
 
 
 class FileCategorizerAgent(BaseAgent):
+    """
+    Categorizes content as source_code, configuration_file or something_else. The content is classified with
+    heuristics first (see file_classifier.py), the LLM is only asked when they are not confident.
+    """
+
+    def __init__(self, name: str, model: BaseChatModel, confidence_threshold: float = CONFIDENCE_THRESHOLD) -> None:
+        super().__init__(name, model)
+        self.confidence_threshold = confidence_threshold
+        self.classified_locally = 0
+        self.classified_by_llm = 0
 
     @property
     def system_prompt(self) -> LiteralString:
@@ -19,3 +34,13 @@ class FileCategorizerAgent(BaseAgent):
     @property
     def tools(self) -> list:
         return []
+
+    def respond(self, state, config: RunnableConfig | None = None) -> AIMessage:
+        content = next((message.content for message in reversed(state["messages"])
+                        if isinstance(message, HumanMessage)), "")
+        classification = classify_file(None, str(content))
+        if classification["confidence"] >= self.confidence_threshold:
+            self.classified_locally += 1
+            return AIMessage(content=classification["category"], name=self.name)
+        self.classified_by_llm += 1
+        return super().respond(state, config)
@@ -0,0 +1,27 @@
+from langchain.schema import AIMessage, HumanMessage
+from langgraph.graph import MessagesState
+from langgraph.graph.state import Command
+
+from server.symbols import extract_symbols, format_symbols
+
+
+class MethodNameSearcher:
+    """
+    Lists the functions, methods and classes of the content with their signatures and line spans.
+    Unlike the other workers it is not an agent: the symbols are extracted by a parser (see symbols.py),
+    so it needs no LLM call.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def invoke(self, state: MessagesState) -> Command:
+        content = next((message.content for message in reversed(state["messages"])
+                        if isinstance(message, HumanMessage)), "")
+        symbols = extract_symbols(None, str(content))
+        response = format_symbols(symbols) if len(
+            symbols) > 0 else "No methods or functions found."
+        return Command(
+            goto="supervisor",
+            update={"messages": [AIMessage(content=response, name=self.name)]}
+        )
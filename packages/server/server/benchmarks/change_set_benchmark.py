@@ -0,0 +1,52 @@
+import argparse
+import hashlib
+import time
+from typing import List
+
+from server.change_set import compute_change_set
+
+# Run with:
+# python -m server.benchmarks.change_set_benchmark --max-ids 1000000
+
+
+def make_ids(count: int, offset: int = 0) -> List[str]:
+    return [hashlib.md5(str(index + offset).encode()).hexdigest() for index in range(count)]
+
+
+def legacy_change_set(stored_ids: List[str], repo_ids: List[str]) -> int:
+    """
+    The previous list based diff, kept here for comparison only.
+    """
+    new_ids = [id for id in repo_ids if id not in stored_ids]
+    removed_ids = [id for id in stored_ids if id not in repo_ids]
+    non_unique_ids = set([id for id in new_ids if new_ids.count(id) > 1])
+    return len(new_ids) + len(removed_ids) + len(non_unique_ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the change set computation")
+    parser.add_argument("--max-ids", type=int, default=1000000)
+    parser.add_argument("--max-legacy-ids", type=int, default=10000)
+    args = parser.parse_args()
+
+    count = 1000
+    while count <= args.max_ids:
+        # 10% of the stored ids are removed, 10% of the repo ids are new
+        stored_ids = make_ids(count)
+        repo_ids = make_ids(count, offset=count // 10)
+
+        start = time.perf_counter()
+        changes = compute_change_set(stored_ids, repo_ids, key=lambda id: id)
+        duration = time.perf_counter() - start
+        line = f"{count:>9} ids: change set {duration * 1000:9.1f} ms ({len(changes.added)} added, {len(changes.removed_ids)} removed)"
+
+        if count <= args.max_legacy_ids:
+            start = time.perf_counter()
+            legacy_change_set(stored_ids, repo_ids)
+            line += f", legacy {(time.perf_counter() - start) * 1000:9.1f} ms"
+        print(line)
+        count *= 10
+
+
+if __name__ == '__main__':
+    main()
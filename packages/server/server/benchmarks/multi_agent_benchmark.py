@@ -0,0 +1,67 @@
+import argparse
+import glob
+import time
+from typing import Callable, List
+
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+from langgraph.errors import GraphRecursionError
+from langgraph.graph.state import CompiledStateGraph
+
+from server.file_summary_graphs import build_pipeline_graph, build_supervisor_graph
+from server.progress import ReportingCallbackHandler, ThroughputReport
+
+# Compares the LLM calls, tokens and wall time of the supervisor graph and the deterministic pipeline
+# of file-summarizer-multi-agent-v2.py. Run with:
+# python -m server.benchmarks.multi_agent_benchmark --files "server/*.py" --limit 5
+
+
+def run(name: str, build_graph: Callable[[BaseChatModel], CompiledStateGraph], model: BaseChatModel,
+        files: List[str], max_concurrency: int, recursion_limit: int) -> ThroughputReport:
+    graph = build_graph(model)
+    # The report counts LLM calls, not files
+    report = ThroughputReport(name, 0)
+    handler = ReportingCallbackHandler(report)
+    for index, file_path in enumerate(files):
+        with open(file_path, encoding="utf-8") as file:
+            content = file.read()
+        start = time.perf_counter()
+        try:
+            graph.invoke({"messages": [("user", content)]},
+                         {"configurable": {"thread_id": f"{name}-{index}"}, "callbacks": [handler],
+                          "max_concurrency": max_concurrency, "recursion_limit": recursion_limit})
+        except GraphRecursionError:
+            print(f"{name}: {file_path} did not finish within {recursion_limit} steps")
+            report.record_failure()
+        print(f"{name}: {file_path} in {time.perf_counter() - start:.1f}s, {report.completed} LLM calls so far")
+    return report
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the supervisor graph against the deterministic pipeline")
+    parser.add_argument("--files", default="server/*.py",
+                        help="A glob of the files to summarize")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--ollama", action="store_true",
+                        help="Use llama3.2 on Ollama instead of OpenAI")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--recursion-limit", type=int, default=100)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.files))[:args.limit]
+    model: BaseChatModel = ChatOllama(model="llama3.2", num_ctx=5000) if args.ollama else ChatOpenAI()
+    reports = [run(name, build_graph, model, files, args.max_concurrency, args.recursion_limit)
+               for name, build_graph in [("supervisor", build_supervisor_graph), ("pipeline", build_pipeline_graph)]]
+
+    print(f"\n{len(files)} files")
+    for report in reports:
+        print(f"{report.name:>10}: {report.completed:4} LLM calls, {report.input_tokens:8} input tokens, "
+              f"{report.output_tokens:7} output tokens, {report.elapsed():7.1f}s, {report.failed} unfinished")
+
+
+if __name__ == '__main__':
+    main()
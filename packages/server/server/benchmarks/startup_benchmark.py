@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+# Measures the cold start of the server in fresh interpreters: the time to import server.main and the time
+# to answer the first request, and lists the heavy dependencies imported on startup. The regression
+# thresholds are checked by tests/test_startup.py. Run with:
+# python -m server.benchmarks.startup_benchmark --runs 5
+
+# These are only imported on first use, by the chat and the jobs
+LAZY_MODULES = ["chromadb", "langchain", "langchain_community", "langchain_ollama", "langchain_openai",
+                "langgraph", "server.chat", "server.indexer", "server.single_file_summarizer"]
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import server.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(server.main.app)
+response = client.get("/")
+answered = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_request": answered - start,
+                  "status": response.status_code, "modules": sorted(sys.modules)}))
+"""
+
+
+# The folder containing the server package, so the script imports it from anywhere
+SERVER_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure_startup() -> Dict:
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=SERVER_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the cold start of the server")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [measure_startup() for _ in range(args.runs)]
+    import_time = statistics.median(result["import"] for result in results)
+    first_request_time = statistics.median(result["first_request"] for result in results)
+    print(f"{args.runs} runs, median import of server.main {import_time:.3f}s, "
+          f"first request answered after {first_request_time:.3f}s")
+    if any(result["status"] != 200 for result in results):
+        print("The first request failed")
+    eager_modules = [module for module in LAZY_MODULES if module in results[0]["modules"]]
+    print(f"Imported on startup: {', '.join(eager_modules) if len(eager_modules) > 0 else 'none of the lazy modules'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import List
+
+from server.file_utilities import IGNORED_EXTENSIONS, generate_gitignore_spec, get_files_to_process, is_binary_file
+
+# Run with:
+# python -m server.benchmarks.walk_benchmark --files 100000
+
+
+def create_tree(base_folder: str, number_of_files: int) -> None:
+    """
+    Creates a synthetic repository where roughly a third of the files live in ignored folders
+    (node_modules, .git and a nested build folder), like in a typical JavaScript monorepo.
+    """
+    with open(os.path.join(base_folder, ".gitignore"), "w") as gitignore_file:
+        gitignore_file.write("node_modules/\n*.log\n")
+    files_per_folder = 50
+    for index in range(number_of_files):
+        folder_index = index // files_per_folder
+        kind = folder_index % 6
+        if kind == 0:
+            folder = os.path.join(base_folder, "node_modules", f"pkg{folder_index}")
+        elif kind == 1:
+            folder = os.path.join(base_folder, ".git", "objects", f"{folder_index:04x}")
+        else:
+            folder = os.path.join(base_folder, "packages", f"pkg{folder_index % 40}", "src", f"module{folder_index}")
+            if kind == 2 and not os.path.exists(os.path.join(folder, ".gitignore")):
+                os.makedirs(folder, exist_ok=True)
+                with open(os.path.join(folder, ".gitignore"), "w") as gitignore_file:
+                    gitignore_file.write("build/\n")
+            if kind == 3:
+                folder = os.path.join(folder, "build")
+        os.makedirs(folder, exist_ok=True)
+        extension = [".py", ".ts", ".log", ".bin", ".md"][index % 5]
+        with open(os.path.join(folder, f"file{index}{extension}"), "w") as file:
+            file.write(f"print({index})\n")
+
+
+def legacy_get_files_to_process(base_folder: str) -> List[str]:
+    """
+    The previous os.walk based implementation, kept here for comparison only.
+    """
+    spec = generate_gitignore_spec(base_folder)
+    files_and_dirs = []
+    for root, dirs, files in os.walk(base_folder):
+        for name in files:
+            file_path = os.path.join(root, name)
+            relative_path = os.path.relpath(file_path, base_folder)
+            if not spec.match_file(relative_path) and not is_binary_file(file_path):
+                files_and_dirs.append(file_path)
+
+    def is_ignored(path) -> bool:
+        relative_path = os.path.relpath(path, base_folder)
+        if spec.match_file(relative_path):
+            return True
+        if ".git" in path.split(os.sep):
+            return True
+        if any(path.endswith(ext) for ext in IGNORED_EXTENSIONS):
+            return True
+        return False
+
+    return [f for f in files_and_dirs if not is_ignored(f)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the directory walker")
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base_folder = tempfile.mkdtemp(prefix="walk-benchmark-")
+    try:
+        print(f"Creating {args.files} files in {base_folder}")
+        create_tree(base_folder, args.files)
+
+        for name, walk in [("legacy os.walk", legacy_get_files_to_process),
+                           ("scandir walker", lambda folder: get_files_to_process(folder, check_binary=True)["files"])]:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                files = walk(base_folder)
+                timings.append(time.perf_counter() - start)
+            print(f"{name}: {len(files)} files, best of {args.repeat}: {min(timings):.2f}s")
+    finally:
+        shutil.rmtree(base_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+from typing import Callable, Dict, Generic, Iterable, List, Set, TypeVar
+
+T = TypeVar("T")
+
+
+class ChangeSet(Generic[T]):
+    """
+    Diffs the ids of the items in the repo against the ids stored in a collection, in O(n) using hash sets.
+
+    Items are added one at a time, so the change set can be built while the items are streamed.
+    Every item ends up in either added (id not stored), unchanged (id stored) or duplicates
+    (id already seen, the first item with the id is listed first).
+    """
+
+    def __init__(self, stored_ids: Iterable[str]) -> None:
+        self.stored_ids: Set[str] = set(stored_ids)
+        self.added: List[T] = []
+        self.unchanged: List[T] = []
+        self.duplicates: Dict[str, List[T]] = {}
+        self._seen: Dict[str, T] = {}
+
+    def add(self, id: str, item: T) -> bool:
+        """
+        Records an item of the repo and returns True if it is new, i.e. needs to be stored.
+        """
+        if id in self._seen:
+            self.duplicates.setdefault(id, [self._seen[id]]).append(item)
+            return False
+        self._seen[id] = item
+        if id in self.stored_ids:
+            self.unchanged.append(item)
+            return False
+        self.added.append(item)
+        return True
+
+    @property
+    def removed_ids(self) -> List[str]:
+        return [id for id in self.stored_ids if id not in self._seen]
+
+    def log(self, name: str) -> None:
+        print(f"{name}: {len(self.added)} added, {len(self.unchanged)} unchanged, "
+              f"{len(self.removed_ids)} removed, {len(self.duplicates)} duplicate ids")
+
+    def log_duplicates(self, describe: Callable[[T], str]) -> None:
+        if len(self.duplicates) == 0:
+            return
+        print('Non-unique ids:', set(self.duplicates.keys()))
+        for id, items in self.duplicates.items():
+            print('Items with id:', id)
+            for item in items:
+                print(describe(item))
+            print()
+
+
+def compute_change_set(stored_ids: Iterable[str], items: Iterable[T], key: Callable[[T], str]) -> ChangeSet[T]:
+    changes: ChangeSet[T] = ChangeSet(stored_ids)
+    for item in items:
+        changes.add(key(item), item)
+    return changes
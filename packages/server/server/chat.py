@@ -1,61 +1,44 @@
+import json
 import os
+from functools import cache
 from random import randint
-from chromadb import HttpClient
 from dotenv import load_dotenv
 from langchain.agents import tool
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages.base import BaseMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI
 from langchain_community.tools import DuckDuckGoSearchRun
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.graph.message import add_messages
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph.state import CompiledStateGraph
 from typing_extensions import TypedDict
-from typing import Annotated, List
+from typing import Annotated, Any, AsyncIterator, Callable, List
 
+from server.checkpointer import SqliteCheckpointer
+from server.history import HISTORY_TOKEN_BUDGET, compact_history
+from server.context_packer import CONTEXT_TOKEN_BUDGET, pack_search_results
 from server.repositories import CodeRepository, DocumentationRepository
 
-load_dotenv()
+
+# Tool results are streamed to the client shortened to this many characters
+MAX_STREAMED_TOOL_OUTPUT = 1000
+# The searches of the tools leave out near duplicates (see BaseRepository.search_many)
+SEARCH_MMR_LAMBDA = 0.7
 
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 
-memory = MemorySaver()
-
-# Tools
-searchTool = DuckDuckGoSearchRun()
-http_client = HttpClient(host="localhost", port=8000)
-code_repo = CodeRepository(http_client=http_client)
-documentation_repo = DocumentationRepository(http_client=http_client)
-
-
-@tool
-def code_searcher(query: str) -> List[List[str]] | None:
-    """ Searches the source code repository for the given query. """
-    return code_repo.search(query)
-
-
-@tool
-def documentation_searcher(query: str) -> List[List[str]] | None:
-    """ Searches the documentation repository for the given query. """
-    return documentation_repo.search(query)
-
-
-tools = [searchTool, code_searcher, documentation_searcher]
-tool_node = ToolNode(tools=tools)
-
-# LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo")
-llm_with_tools = llm.bind_tools(tools)
 prompt_template = ChatPromptTemplate.from_messages(
     [
         (
             "system",
-            """You are an AI assistant that knows a lot about the DIMS code repository. 
+            """You are an AI assistant that knows a lot about the DIMS code repository.
                 To answer the user's questions you will first look up the documentation and then follow up with a code search if needed.
                 You will base your answers strictly on the information you find.
                 You can help with all code-related questions.
@@ -66,57 +49,153 @@ prompt_template = ChatPromptTemplate.from_messages(
 )
 
 
-def chatbot(state: State) -> dict[str, BaseMessage]:
-    prompt = prompt_template.invoke(state)
-    response = llm_with_tools.invoke(prompt)
-    return {"messages": response}
-
-
-# Graph
-graph_builder = StateGraph(State)
-
-# Add nodes
-graph_builder.add_node("chatbot", chatbot)
-graph_builder.add_node("tools", tool_node)
-
-# Add edges
-# graph_builder.add_edge(START, "chatbot")
-graph_builder.set_entry_point("chatbot")
-graph_builder.add_conditional_edges(
-    "chatbot",
-    tools_condition,
-)
-graph_builder.add_edge("tools", "chatbot")
-graph_builder.add_edge("chatbot", END)
-
-graph = graph_builder.compile(checkpointer=memory)
-
-config: RunnableConfig = {"configurable":  {
-    "thread_id": str(randint(0, 10000000000))}}
-
-
-def stream_graph_updates(user_input: str) -> None:
-    for event in graph.stream({"messages": [("user", user_input)]}, config, stream_mode="values"):
-        for value in event["messages"]:
-            if isinstance(value, list):
-                message = value[-1]
-            else:
-                message = value
-            # print("Assistant:", message)
-            message.pretty_print()
-
-
-while True:
+def create_tools(get_code_repo: Callable[[], CodeRepository],
+                 get_documentation_repo: Callable[[], DocumentationRepository],
+                 context_token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[BaseTool]:
+    """
+    Creates the tools of the chat agent. The repositories are only created on the first search, so the chat
+    starts without Chroma running. The hits of a search are packed into context_token_budget tokens (see
+    context_packer.py).
+    """
+    searchTool = DuckDuckGoSearchRun()
+
+    @tool
+    def code_searcher(queries: List[str]) -> str:
+        """ Searches the source code repository for one or more queries at once. Exact names of functions, classes and variables are found best. The results are the matching lines with path:start_line-end_line. """
+        hits = get_code_repo().hybrid_search_many(queries, mmr_lambda=SEARCH_MMR_LAMBDA)
+        return pack_search_results(zip(queries, hits), context_token_budget)
+
+    @tool
+    def documentation_searcher(queries: List[str]) -> str:
+        """ Searches the documentation repository for one or more queries at once. """
+        hits = get_documentation_repo().search_many(queries, mmr_lambda=SEARCH_MMR_LAMBDA)
+        return pack_search_results(zip(queries, hits), context_token_budget)
+
+    return [searchTool, code_searcher, documentation_searcher]
+
+
+def build_chat_graph(checkpointer: BaseCheckpointSaver | None = None,
+                     token_budget: int = HISTORY_TOKEN_BUDGET,
+                     context_token_budget: int = CONTEXT_TOKEN_BUDGET) -> CompiledStateGraph:
+    """
+    Builds the chat agent. The conversation of every thread_id in the config of a run is kept by the
+    checkpointer, so one graph serves many sessions concurrently. Long conversations are compacted to
+    token_budget before they are sent to the LLM, the results of every search to context_token_budget.
+    """
+    load_dotenv()
+
+    # Tools
+    @cache
+    def get_code_repo() -> CodeRepository:
+        return CodeRepository()
+
+    @cache
+    def get_documentation_repo() -> DocumentationRepository:
+        return DocumentationRepository()
+
+    tools = create_tools(get_code_repo, get_documentation_repo, context_token_budget)
+    tool_node = ToolNode(tools=tools)
+
+    # LLM
+    llm = ChatOpenAI(model="gpt-3.5-turbo")
+    llm_with_tools = llm.bind_tools(tools)
+
+    def chatbot(state: State) -> dict[str, List[BaseMessage]]:
+        messages, updates = compact_history(state["messages"], token_budget)
+        prompt = prompt_template.invoke({"messages": messages})
+        response = llm_with_tools.invoke(prompt)
+        return {"messages": updates + [response]}
+
+    async def achatbot(state: State) -> dict[str, List[BaseMessage]]:
+        # Used by the streaming endpoint, so concurrent sessions do not hold a thread while waiting for the LLM
+        messages, updates = compact_history(state["messages"], token_budget)
+        prompt = await prompt_template.ainvoke({"messages": messages})
+        response = await llm_with_tools.ainvoke(prompt)
+        return {"messages": updates + [response]}
+
+    # Graph
+    graph_builder = StateGraph(State)
+
+    # Add nodes
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
+    graph_builder.add_node("tools", tool_node)
+
+    # Add edges
+    # graph_builder.add_edge(START, "chatbot")
+    graph_builder.set_entry_point("chatbot")
+    graph_builder.add_conditional_edges(
+        "chatbot",
+        tools_condition,
+    )
+    graph_builder.add_edge("tools", "chatbot")
+    graph_builder.add_edge("chatbot", END)
+
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+def format_event(event: str, data: Any) -> str:
+    """
+    Formats a server-sent event with JSON data.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_chat(graph: CompiledStateGraph, message: str, session_id: str) -> AsyncIterator[str]:
+    """
+    Runs the chat agent on a message of the user in the thread of the session and yields server-sent events:
+    session (the session id to send with the next message), token (every token of the answer as soon as the
+    LLM generates it), tool_start and tool_end (the tool calls and their results), and done or error.
+    """
+    yield format_event("session", {"session_id": session_id})
+    config: RunnableConfig = {"configurable": {"thread_id": session_id}}
     try:
-        user_input = input("User: ")
-        if user_input.lower() in ["exit", "quit", "q", "bye"]:
-            print("Goodbye!")
+        async for event in graph.astream_events({"messages": [("user", message)]}, config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    yield format_event("token", {"content": content})
+            elif kind == "on_tool_start":
+                yield format_event("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end":
+                output = event["data"].get("output")
+                yield format_event("tool_end", {"name": event["name"], "output": str(
+                    getattr(output, "content", output))[:MAX_STREAMED_TOOL_OUTPUT]})
+    except Exception as error:
+        print(f"Chat of session {session_id} failed: {error}")
+        yield format_event("error", {"message": str(error)})
+        return
+    yield format_event("done", {})
+
+
+if __name__ == '__main__':
+    # The conversations are kept like those of the server, see SqliteCheckpointer
+    graph = build_chat_graph(SqliteCheckpointer())
+
+    config: RunnableConfig = {"configurable":  {
+        "thread_id": str(randint(0, 10000000000))}}
+
+    def stream_graph_updates(user_input: str) -> None:
+        for event in graph.stream({"messages": [("user", user_input)]}, config, stream_mode="values"):
+            for value in event["messages"]:
+                if isinstance(value, list):
+                    message = value[-1]
+                else:
+                    message = value
+                # print("Assistant:", message)
+                message.pretty_print()
+
+    while True:
+        try:
+            user_input = input("User: ")
+            if user_input.lower() in ["exit", "quit", "q", "bye"]:
+                print("Goodbye!")
+                break
+
+            stream_graph_updates(user_input)
+        except:
+            user_input = "What do you know about Denmark?"
+            print("User:", user_input)
+            stream_graph_updates(user_input)
             break
-
-        stream_graph_updates(user_input)
-    except:
-        user_input = "What do you know about Denmark?"
-        print("User:", user_input)
-        stream_graph_updates(user_input)
-        break
-os._exit(0)
+    os._exit(0)
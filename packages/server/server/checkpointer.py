@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Dict, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple,
+                                       SerializerProtocol)
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from server.file_utilities import get_cache_folder
+
+# Conversations that have not been used for this many seconds are deleted
+THREAD_TTL = 7 * 24 * 60 * 60
+# Only the latest checkpoints of a thread are kept, the chat only continues from the last one
+MAX_CHECKPOINTS_PER_THREAD = 10
+# How often expired threads are looked for, in seconds
+EXPIRY_INTERVAL = 60
+
+
+class SqliteCheckpointer(SqliteSaver):
+    """
+    Keeps the state of the LangGraph threads (e.g. the chat sessions) in SQLite, so conversations survive
+    restarts and do not grow the memory of the process. The checkpoints are stored by the SqliteSaver of
+    langgraph-checkpoint-sqlite.
+
+    Storage is bounded: only the latest max_checkpoints_per_thread checkpoints of every thread are kept,
+    and threads that have not been used for thread_ttl seconds are deleted. SqliteSaver is synchronous, the
+    async methods used by the server run it in a worker thread.
+    """
+
+    def __init__(self,
+                 checkpoint_path: str | None = None,
+                 thread_ttl: float = THREAD_TTL,
+                 max_checkpoints_per_thread: int = MAX_CHECKPOINTS_PER_THREAD,
+                 serde: SerializerProtocol | None = None) -> None:
+        self.checkpoint_path = checkpoint_path or os.path.join(
+            get_cache_folder(), "chat_threads.sqlite3")
+        # Graphs run their nodes in worker threads, SqliteSaver serializes the use of the connection
+        super().__init__(sqlite3.connect(self.checkpoint_path, check_same_thread=False), serde=serde)
+        self.thread_ttl = thread_ttl
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self._last_expiry = 0.0
+        with self.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS thread_activity (
+                    thread_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )""")
+        self.expire()
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = str(next_config["configurable"]["thread_id"])
+        checkpoint_ns = next_config["configurable"]["checkpoint_ns"]
+        with self.cursor() as cursor:
+            cursor.execute("INSERT OR REPLACE INTO thread_activity VALUES (?, ?)", (thread_id, time.time()))
+            old_ids = [(thread_id, checkpoint_ns, row[0]) for row in cursor.execute(
+                """SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                   ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?""",
+                (thread_id, checkpoint_ns, self.max_checkpoints_per_thread)).fetchall()]
+            cursor.executemany(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", old_ids)
+            cursor.executemany(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", old_ids)
+        if time.monotonic() - self._last_expiry > EXPIRY_INTERVAL:
+            self.expire()
+        return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.cursor() as cursor:
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cursor.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def expire(self) -> int:
+        """
+        Deletes the threads that have not been used for thread_ttl seconds.
+
+        Returns:
+            int: The number of deleted threads.
+        """
+        self._last_expiry = time.monotonic()
+        with self.cursor(transaction=False) as cursor:
+            thread_ids = [row[0] for row in cursor.execute(
+                "SELECT thread_id FROM thread_activity WHERE updated_at < ?",
+                (time.time() - self.thread_ttl,)).fetchall()]
+        for thread_id in thread_ids:
+            self.delete_thread(thread_id)
+        if len(thread_ids) > 0:
+            print(f"Deleted {len(thread_ids)} expired conversations")
+        return len(thread_ids)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self,
+                    config: RunnableConfig | None,
+                    *,
+                    filter: Dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None,
+                    limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        tuples = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[Tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple, TypeVar
+from typing import TypedDict
+
+import httpx
+from chromadb import HttpClient
+from chromadb.api import ClientAPI
+from chromadb.errors import ChromaError, error_types
+
+from server.retry import is_transient_error, retry
+
+T = TypeVar("T")
+
+# Attempts of a Chroma request on transient errors, with exponential backoff from CHROMA_RETRY_DELAY seconds
+CHROMA_ATTEMPTS = 4
+CHROMA_RETRY_DELAY = 0.5
+CHROMA_MAX_RETRY_DELAY = 5.0
+
+
+def get_chroma_host() -> str:
+    return os.getenv("CHROMA_HOST") or "localhost"
+
+
+def get_chroma_port() -> int:
+    return int(os.getenv("CHROMA_PORT") or 8000)
+
+
+def is_transient_chroma_error(error: BaseException) -> bool:
+    if is_transient_error(error):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    # Creating a client raises a ValueError when the server does not answer
+    if isinstance(error, ValueError) and "Could not connect" in str(error):
+        return True
+    # E.g. RateLimitError, whose code is 429
+    return isinstance(error, ChromaError) and (error.code() == 429 or error.code() >= 500)
+
+
+def raise_transient_status(response: httpx.Response) -> None:
+    """
+    Response hook of the HTTP session of a Chroma client. For a 429 or 5xx answer that is not a Chroma error
+    (e.g. the error page of a proxy or gateway), the client raises a bare Exception with the body only, which
+    can not be told apart from a permanent error. Raising httpx.HTTPStatusError here keeps the status code,
+    so the request is retried.
+    """
+    if response.status_code != 429 and response.status_code < 500:
+        return
+    response.read()
+    try:
+        body = json.loads(response.text)
+        # Raised as a ChromaError by the client, with its own code
+        if isinstance(body, dict) and body.get("error") in error_types:
+            return
+    except ValueError:
+        pass
+    response.raise_for_status()
+
+
+def keep_transient_status(client: ClientAPI) -> None:
+    """
+    Installs raise_transient_status on the HTTP session of the client. The session is not part of the public
+    API of chromadb, which is pinned in pyproject.toml for that reason.
+
+    Raises:
+        RuntimeError: When the client has no HTTP session, e.g. after an upgrade of chromadb, as the 429 and
+            5xx answers of proxies would no longer be retried.
+    """
+    session = getattr(getattr(client, "_server", None), "_session", None)
+    if not isinstance(session, httpx.Client):
+        raise RuntimeError(f"The Chroma client {type(client).__name__} has no HTTP session to install the "
+                           "transient status hook on, check the version of chromadb")
+    if raise_transient_status not in session.event_hooks["response"]:
+        session.event_hooks["response"].append(raise_transient_status)
+
+
+class OperationMetrics(TypedDict):
+    calls: int
+    errors: int
+    retries: int
+    total_seconds: float
+    max_seconds: float
+    average_seconds: float
+
+
+class ChromaMetrics:
+    """
+    Counts the Chroma requests per operation (e.g. upsert, query), with their failures, retries and latency.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Dict[str, OperationMetrics] = {}
+
+    def record(self, operation: str, seconds: float, failed: bool = False, retry: bool = False) -> None:
+        with self._lock:
+            metrics = self._operations.setdefault(operation, OperationMetrics(
+                calls=0, errors=0, retries=0, total_seconds=0.0, max_seconds=0.0, average_seconds=0.0))
+            metrics["calls"] += 1
+            metrics["errors"] += 1 if failed else 0
+            metrics["retries"] += 1 if retry else 0
+            metrics["total_seconds"] += seconds
+            metrics["max_seconds"] = max(metrics["max_seconds"], seconds)
+            metrics["average_seconds"] = metrics["total_seconds"] / metrics["calls"]
+
+    def snapshot(self) -> Dict[str, OperationMetrics]:
+        with self._lock:
+            return {operation: OperationMetrics(**metrics) for operation, metrics in self._operations.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations.clear()
+
+
+# Shared by all repositories of the process
+chroma_metrics = ChromaMetrics()
+
+
+def call_chroma(operation: str, function: Callable[[], T], attempts: int = CHROMA_ATTEMPTS) -> T:
+    """
+    Calls function(), a request to Chroma, retrying transient errors with backoff. The latency of every
+    attempt is recorded under the operation name.
+    """
+    attempt = 0
+
+    def timed() -> T:
+        nonlocal attempt
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            result = function()
+        except Exception:
+            chroma_metrics.record(operation, time.perf_counter() - start, failed=True, retry=attempt > 1)
+            raise
+        chroma_metrics.record(operation, time.perf_counter() - start, retry=attempt > 1)
+        return result
+
+    return retry(timed, attempts=attempts, base_delay=CHROMA_RETRY_DELAY, max_delay=CHROMA_MAX_RETRY_DELAY,
+                 is_retryable=is_transient_chroma_error)
+
+
+_clients: Dict[Tuple[str, int], ClientAPI] = {}
+_clients_lock = threading.Lock()
+
+
+def get_chroma_client(host: str | None = None, port: int | None = None, attempts: int = CHROMA_ATTEMPTS) -> ClientAPI:
+    """
+    Returns the Chroma client of the process for the host and port (by default CHROMA_HOST and CHROMA_PORT,
+    or localhost:8000). The client keeps its HTTP connections alive, so repositories and runs of the jobs
+    share them instead of connecting again. Other threads wait while the client is created, with up to
+    attempts attempts.
+    """
+    key = (host or get_chroma_host(), port or get_chroma_port())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Creating the client already checks the tenant and database on the server
+            client = call_chroma("connect", lambda: HttpClient(host=key[0], port=key[1]), attempts=attempts)
+            keep_transient_status(client)
+            _clients[key] = client
+        return client
+
+
+def is_chroma_ready(client: ClientAPI | None = None) -> bool:
+    """
+    Returns whether Chroma answers a heartbeat. A failed heartbeat (or connection) is not retried, so polling
+    does not hold the lock of the client registry through the backoff of get_chroma_client.
+
+    Raises:
+        Exception: Errors that are not transient, e.g. when the client can not be set up, are raised instead
+            of waiting for them to pass.
+    """
+    try:
+        call_chroma("heartbeat", lambda: (client or get_chroma_client(attempts=1)).heartbeat(), attempts=1)
+        return True
+    except Exception as error:
+        if not is_transient_chroma_error(error):
+            raise
+        print(f"Chroma is not ready: {type(error).__name__}: {error}")
+        return False
+
+
+def wait_until_chroma_ready(timeout: float = 30.0, interval: float = 1.0) -> None:
+    """
+    Waits until Chroma answers a heartbeat, e.g. while its container is starting.
+
+    Raises:
+        TimeoutError: When Chroma is not ready within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while not is_chroma_ready():
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Chroma at {get_chroma_host()}:{get_chroma_port()} is not ready after {timeout:.0f}s")
+        time.sleep(interval)
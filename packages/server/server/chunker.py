@@ -0,0 +1,164 @@
+import ast
+import hashlib
+from typing import Dict, List, Tuple
+from typing import TypedDict
+
+# Line windows used for non-Python files and for Python code that is too large for a single chunk
+WINDOW_LINES = 60
+WINDOW_OVERLAP = 10
+MAX_CHUNK_LINES = 120
+# Chunks with very long lines (minified code, data files) are split further by characters
+MAX_CHUNK_CHARS = 6000
+
+Span = Tuple[int, int]
+
+
+class Chunk(TypedDict):
+    id: str
+    relative_file_path: str
+    start_line: int
+    end_line: int
+    content: str
+    content_hash: str
+
+
+def chunk_file(relative_file_path: str, content: str) -> List[Chunk]:
+    """
+    Splits the content of a file into chunks. Python files are split by their structure (module level code,
+    classes and functions), everything else by overlapping line windows.
+
+    Args:
+        relative_file_path (str): The path of the file, used for the chunk ids.
+        content (str): The full content of the file.
+
+    Returns:
+        List[Chunk]: The chunks, with 1-based inclusive line spans. The id of a chunk is derived from the path
+        and the hash of the chunk content, not from the span, so a chunk that only moved (e.g. after a line was
+        inserted above it) keeps its id. Identical chunks in one file are told apart by their occurrence.
+    """
+    lines = content.splitlines(keepends=True)
+    if len(lines) == 0:
+        return []
+
+    spans: List[Span] | None = None
+    if relative_file_path.endswith(".py"):
+        spans = python_spans(content, len(lines))
+    if spans is None:
+        spans = line_window_spans(1, len(lines))
+
+    chunks: List[Chunk] = []
+    occurrences: Dict[str, int] = {}
+    for start, end in spans:
+        # Leading and trailing blank lines are not part of the chunk
+        while start < end and lines[start - 1].strip() == "":
+            start += 1
+        while end > start and lines[end - 1].strip() == "":
+            end -= 1
+        text = "".join(lines[start - 1:end])
+        if text.strip() == "":
+            continue
+        for offset in range(0, len(text), MAX_CHUNK_CHARS):
+            part = text[offset:offset + MAX_CHUNK_CHARS]
+            content_hash = hashlib.md5(part.encode()).hexdigest()
+            occurrence = occurrences.get(content_hash, 0)
+            occurrences[content_hash] = occurrence + 1
+            chunks.append(create_chunk(relative_file_path, start, end, part, occurrence))
+    return chunks
+
+
+def create_chunk(relative_file_path: str, start_line: int, end_line: int, content: str, occurrence: int = 0) -> Chunk:
+    content_hash = hashlib.md5(content.encode()).hexdigest()
+    return Chunk(
+        id=hashlib.md5(f"{relative_file_path}:{content_hash}:{occurrence}".encode()).hexdigest(),
+        relative_file_path=relative_file_path,
+        start_line=start_line,
+        end_line=end_line,
+        content=content,
+        content_hash=content_hash
+    )
+
+
+def line_window_spans(start: int, end: int) -> List[Span]:
+    """
+    Returns overlapping windows of WINDOW_LINES lines covering the lines from start to end (inclusive).
+    """
+    if end - start + 1 <= MAX_CHUNK_LINES:
+        return [(start, end)]
+    spans: List[Span] = []
+    window_start = start
+    while True:
+        window_end = min(window_start + WINDOW_LINES - 1, end)
+        spans.append((window_start, window_end))
+        if window_end == end:
+            return spans
+        window_start = window_end - WINDOW_OVERLAP + 1
+
+
+def python_spans(content: str, number_of_lines: int) -> List[Span] | None:
+    """
+    Splits Python code into module level blocks, functions and classes. Classes that are too large are split
+    into one chunk per method and chunks of the code around them (the class header, attributes and other
+    statements). Returns None if the code can't be parsed.
+    """
+    try:
+        module = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+
+    spans: List[Span] = []
+    # Consecutive module level statements (imports, constants etc.) are collected in one block
+    block_start: int | None = None
+    block_end = 0
+    previous_end = 0
+    for index, node in enumerate(module.body):
+        start, end = node_span(node)
+        # Comments and blank lines belong to the following statement, trailing ones to the last statement
+        start = previous_end + 1
+        if index == len(module.body) - 1:
+            end = number_of_lines
+        previous_end = end
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if block_start is not None:
+                spans.extend(line_window_spans(block_start, block_end))
+                block_start = None
+            if isinstance(node, ast.ClassDef):
+                spans.extend(class_spans(node, start, end))
+            else:
+                spans.extend(line_window_spans(start, end))
+        else:
+            if block_start is None:
+                block_start = start
+            block_end = end
+    if block_start is not None:
+        spans.extend(line_window_spans(block_start, block_end))
+
+    if len(spans) == 0:
+        return line_window_spans(1, number_of_lines)
+    return spans
+
+
+def class_spans(node: ast.ClassDef, start: int, end: int) -> List[Span]:
+    if end - start + 1 <= MAX_CHUNK_LINES:
+        return [(start, end)]
+    spans: List[Span] = []
+    # The lines before, between and after the members (the class header, attributes, comments and other
+    # statements) are chunked as well, so nothing of the class is missing from the index
+    gap_start = start
+    for child in node.body:
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            member_start, member_end = node_span(child)
+            if member_start > gap_start:
+                spans.extend(line_window_spans(gap_start, member_start - 1))
+            spans.extend(line_window_spans(member_start, member_end))
+            gap_start = member_end + 1
+    if end >= gap_start:
+        spans.extend(line_window_spans(gap_start, end))
+    return spans
+
+
+def node_span(node: ast.stmt) -> Span:
+    # Decorators belong to the function or class they decorate
+    decorators = getattr(node, "decorator_list", [])
+    start = min([node.lineno] + [decorator.lineno for decorator in decorators])
+    end = node.end_lineno or node.lineno
+    return start, end
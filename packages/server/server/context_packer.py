@@ -0,0 +1,147 @@
+import math
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+from server.lexical_index import tokenize_document
+from server.search_hit import SearchHit
+from server.tokens import CHARACTERS_PER_TOKEN, estimate_tokens
+
+# The search results of one tool call are packed into this many tokens
+CONTEXT_TOKEN_BUDGET = 1500
+# Lines shown before and after a line that matches the query
+WINDOW_RADIUS = 3
+# The best windows of a hit that are shown, the rest of the hit is left out
+MAX_WINDOWS_PER_HIT = 2
+# Code chunks start with path:start_line-end_line, documentation summaries with the path only
+REFERENCE_PATTERN = re.compile(r"^(.+):(\d+)-(\d+)$")
+
+Window = Tuple[int, int]
+
+
+def score_lines(lines: List[str], terms: Set[str]) -> List[float]:
+    """
+    Scores every line by the terms of the query it contains. Terms that occur in few lines of the document
+    (e.g. a function name) count more than terms that occur everywhere (e.g. self or return).
+    """
+    line_terms = [set(tokenize_document(line)) & terms for line in lines]
+    lines_with_term: Dict[str, int] = {}
+    for matched in line_terms:
+        for term in matched:
+            lines_with_term[term] = lines_with_term.get(term, 0) + 1
+    return [sum(math.log(1 + len(lines) / lines_with_term[term]) for term in matched) for matched in line_terms]
+
+
+def select_windows(lines: List[str], terms: Set[str], radius: int = WINDOW_RADIUS,
+                   max_windows: int = MAX_WINDOWS_PER_HIT) -> List[Window]:
+    """
+    Selects the line windows (0-based, inclusive) around the lines that match the query best. Overlapping
+    windows are merged. Without a match, the start of the document (e.g. the signature) is selected.
+    """
+    if len(lines) == 0:
+        return []
+    scores = score_lines(lines, terms)
+    windows: List[Tuple[float, Window]] = []
+    for index in sorted(range(len(lines)), key=lambda index: scores[index], reverse=True):
+        if scores[index] <= 0 or len(windows) >= max_windows:
+            break
+        if any(start <= index <= end for _, (start, end) in windows):
+            continue
+        windows.append((scores[index], (max(0, index - radius), min(len(lines) - 1, index + radius))))
+    if len(windows) == 0:
+        return [(0, min(len(lines) - 1, 2 * radius))]
+    merged: List[Window] = []
+    for start, end in sorted(window for _, window in windows):
+        if len(merged) > 0 and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def contiguous_ranges(numbers: List[int]) -> List[Window]:
+    """
+    Splits sorted line numbers into ranges of consecutive numbers (inclusive).
+    """
+    ranges: List[Window] = []
+    for number in numbers:
+        if len(ranges) > 0 and number == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+
+def interleave_hits(results: Iterable[Tuple[str, List[SearchHit]]]) -> List[Tuple[str, SearchHit]]:
+    """
+    Orders the hits of several queries by rank, taking the best hit of every query first, and leaves out
+    hits that were found by an earlier query.
+    """
+    queries = list(results)
+    ordered: List[Tuple[str, SearchHit]] = []
+    seen: Set[str] = set()
+    for rank in range(max((len(hits) for _, hits in queries), default=0)):
+        for query, hits in queries:
+            if rank < len(hits) and hits[rank]["id"] not in seen:
+                seen.add(hits[rank]["id"])
+                ordered.append((query, hits[rank]))
+    return ordered
+
+
+def pack_search_results(results: Iterable[Tuple[str, List[SearchHit]]],
+                        token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Packs the hits of one or more queries into a context for the LLM that fits the token budget.
+
+    The hits are taken in rank order. Of every code chunk, only the line windows around the lines that match
+    the query are kept, each with a path:start_line-end_line reference. Lines that were already included
+    from an overlapping chunk are left out, splitting the window around them. Documentation summaries are kept
+    whole, with their path. Sections that do not fit the remaining budget are left out (later, smaller ones
+    may still fit), the first one is shortened instead.
+
+    Args:
+        results (Iterable[Tuple[str, List[SearchHit]]]): The query and the ranked hits of every query.
+        token_budget (int): The maximum number of tokens of the packed context.
+
+    Returns:
+        str: The sections of the hits, separated by empty lines.
+    """
+    sections: List[str] = []
+    used_tokens = 0
+    included_lines: Dict[str, Set[int]] = {}
+    for query, hit in interleave_hits(results):
+        header, _, body = (hit["document"] or "").partition("\n")
+        terms = set(tokenize_document(query))
+        reference = REFERENCE_PATTERN.match(header)
+        # The sections of the hit, with the path and the lines they include (if the lines are numbered)
+        hit_sections: List[Tuple[str, str, Window | None]] = []
+        if reference is None:
+            hit_sections.append((f"{header}\n{body.strip()}", header, None))
+        else:
+            path, start_line, end_line = reference.group(1), int(reference.group(2)), int(reference.group(3))
+            lines = body.splitlines()
+            # Chunks of very long lines are split by characters, their lines can not be numbered
+            if len(lines) != end_line - start_line + 1:
+                hit_sections.append((f"{header}\n{body}", path, None))
+            else:
+                seen = included_lines.get(path, set())
+                for window_start, window_end in select_windows(lines, terms):
+                    numbers = [number for number in range(start_line + window_start, start_line + window_end + 1)
+                               if number not in seen]
+                    # Only the new lines, split where lines were already included, so every reference is exact
+                    for first, last in contiguous_ranges(numbers):
+                        text = "\n".join(lines[first - start_line:last - start_line + 1])
+                        hit_sections.append((f"{path}:{first}-{last}\n{text}", path, (first, last)))
+
+        for section, path, included in hit_sections:
+            tokens = estimate_tokens(section)
+            if used_tokens + tokens > token_budget:
+                if len(sections) == 0:
+                    sections.append(section[:token_budget * CHARACTERS_PER_TOKEN] + " [shortened]")
+                    used_tokens = token_budget
+                # A later, smaller section may still fit
+                continue
+            if included is not None:
+                included_lines.setdefault(path, set()).update(range(included[0], included[1] + 1))
+            sections.append(section)
+            used_tokens += tokens
+    return "\n\n".join(sections) if len(sections) > 0 else "Nothing found"
@@ -0,0 +1,123 @@
+import hashlib
+import os
+from typing import Dict, Iterable, Iterator, List, Set
+
+from server.file_manifest import FileManifest
+from server.file_utilities import FileResult, list_folder_to_process
+
+
+class DirectoryNode:
+    """
+    A folder of the repo with its files and subfolders. The hash of a folder is a Merkle hash that combines
+    the ids of its files and the hashes of its subfolders, so a change anywhere below a folder changes the
+    hash of the folder and of all its ancestors, while the hashes of all other folders stay the same.
+    """
+
+    def __init__(self, folder_path: str, relative_folder_path: str, stored_hash: str | None = None) -> None:
+        self.folder_path = folder_path
+        self.relative_folder_path = relative_folder_path
+        self.folder_depth = 0 if relative_folder_path == "." else relative_folder_path.count(
+            os.sep) + 1
+        self.file_results: List[FileResult] = []
+        self.children: List[DirectoryNode] = []
+        # A folder that is known to be unchanged keeps the hash it was summarized with, its content is not listed
+        self.stored_hash = stored_hash
+        self.hash = stored_hash or ""
+
+    def compute_hash(self) -> str:
+        if self.stored_hash is not None:
+            return self.hash
+        # Children first, so every hash is only computed once
+        for child in self.children:
+            child.compute_hash()
+        parts = sorted("f" + result["id"] for result in self.file_results) + \
+            sorted("d" + child.hash for child in self.children)
+        self.hash = hashlib.md5("".join(parts).encode()).hexdigest()
+        return self.hash
+
+    def iter_nodes(self) -> Iterator["DirectoryNode"]:
+        """
+        Yields all folders in the tree, subfolders before their parents.
+        """
+        for child in self.children:
+            yield from child.iter_nodes()
+        yield self
+
+
+def build_directory_tree(base_folder: str, file_paths: Iterable[str], manifest: FileManifest) -> DirectoryNode:
+    """
+    Builds the folder tree in a single pass over the file paths (which can be streamed from the walker)
+    and computes the Merkle hashes. The file ids come from the manifest, so unchanged files are not read.
+    """
+    root = DirectoryNode(os.path.normpath(base_folder), ".")
+    nodes: Dict[str, DirectoryNode] = {".": root}
+
+    def get_node(relative_folder_path: str) -> DirectoryNode:
+        node = nodes.get(relative_folder_path)
+        if node is None:
+            node = DirectoryNode(os.path.normpath(os.path.join(
+                base_folder, relative_folder_path)), relative_folder_path)
+            nodes[relative_folder_path] = node
+            get_node(os.path.dirname(relative_folder_path) or ".").children.append(node)
+        return node
+
+    for file_path in file_paths:
+        result = manifest.read_file(file_path, skip_content=True)
+        # Binary files are only detected here, the walker does not open the files
+        if result is None:
+            continue
+        relative_folder_path = os.path.relpath(
+            os.path.dirname(file_path), base_folder)
+        get_node(relative_folder_path).file_results.append(result)
+
+    root.compute_hash()
+    return root
+
+
+def get_changed_folders(base_folder: str, file_paths: Iterable[str]) -> Set[str]:
+    """
+    Returns the relative paths of the folders on the way from the given (changed or removed) files to the root
+    ("."), the only folders whose hashes can have changed.
+    """
+    folders = {"."}
+    for file_path in file_paths:
+        folder = os.path.relpath(os.path.dirname(file_path), base_folder)
+        while folder not in folders:
+            folders.add(folder)
+            folder = os.path.dirname(folder) or "."
+    return folders
+
+
+def build_changed_directory_tree(base_folder: str, changed_folders: Set[str], manifest: FileManifest,
+                                 stored_hashes: Dict[str, str]) -> DirectoryNode:
+    """
+    Builds the tree of the changed folders only (see get_changed_folders), with the same hashes as
+    build_directory_tree. The files of a changed folder are listed again (the file ids come from the manifest).
+    Its other subfolders are unchanged: they are added with the hash of their stored summary (stored_hashes,
+    by relative folder path) and without their content, or left out when they have no summary.
+    """
+    def build(relative_folder_path: str) -> DirectoryNode | None:
+        folder_path = os.path.normpath(os.path.join(base_folder, relative_folder_path))
+        node = DirectoryNode(folder_path, relative_folder_path)
+        file_paths, subfolder_paths = list_folder_to_process(base_folder, folder_path)
+        for subfolder_path in subfolder_paths:
+            relative_subfolder_path = os.path.relpath(subfolder_path, base_folder)
+            if relative_subfolder_path in changed_folders:
+                child = build(relative_subfolder_path)
+            elif relative_subfolder_path in stored_hashes:
+                child = DirectoryNode(os.path.normpath(subfolder_path), relative_subfolder_path,
+                                      stored_hashes[relative_subfolder_path])
+            else:
+                # A folder without files to summarize, like in build_directory_tree
+                child = None
+            if child is not None:
+                node.children.append(child)
+        for file_path in file_paths:
+            result = manifest.read_file(file_path, skip_content=True)
+            if result is not None:
+                node.file_results.append(result)
+        return node if len(node.file_results) > 0 or len(node.children) > 0 else None
+
+    root = build(".") or DirectoryNode(os.path.normpath(base_folder), ".")
+    root.compute_hash()
+    return root
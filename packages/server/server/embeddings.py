@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+from server.file_utilities import get_cache_folder
+
+# The model of Chroma's default embedding function
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 256
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of embeddings in SQLite, keyed by the model name and the hash of the embedded text.
+    The embeddings are stored as float32 blobs.
+    """
+
+    def __init__(self, cache_path: str | None = None) -> None:
+        self.cache_path = cache_path or os.path.join(
+            get_cache_folder(), "embeddings.sqlite3")
+        # The cache is used from the upsert threads of the ingestion pipeline
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.cache_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    PRIMARY KEY (model, content_hash)
+                )""")
+
+    def get_many(self, model: str, content_hashes: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(content_hashes), 500):
+            batch = content_hashes[start:start + 500]
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT content_hash, embedding FROM embeddings WHERE model = ? AND content_hash IN ({','.join('?' * len(batch))})",
+                    [model] + batch).fetchall()
+            for content_hash, embedding in rows:
+                found[content_hash] = np.frombuffer(embedding, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, embeddings: Dict[str, np.ndarray]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(model, content_hash, np.asarray(embedding, dtype=np.float32).tobytes())
+                 for content_hash, embedding in embeddings.items()])
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Wraps a local embedding function (Chroma's default ONNX model unless another one is given), embeds in
+    batches of batch_size and caches the embeddings by content hash and model. Duplicate texts in a call and
+    texts that were embedded before (e.g. vendored copies or renamed files) are never embedded again.
+    """
+
+    def __init__(self,
+                 embedding_function: EmbeddingFunction[Documents] | None = None,
+                 model_name: str | None = None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE,
+                 cache: EmbeddingCache | None = None) -> None:
+        """
+        Args:
+            embedding_function (EmbeddingFunction[Documents] | None): The function that computes the embeddings.
+            model_name (str | None): The name the embeddings are cached under. Only optional for the default
+                function, or for a function with a model_name (or _model_name) attribute.
+            batch_size (int): The number of texts embedded in one call of the embedding function.
+            cache (EmbeddingCache | None): The cache, by default the one in the cache folder.
+
+        Raises:
+            ValueError: When another embedding function is given and its model name can not be derived, so its
+                embeddings would be mixed up with the ones of another model in the shared cache.
+        """
+        self._embedding_function = embedding_function or DefaultEmbeddingFunction()
+        if model_name is None:
+            model_name = DEFAULT_MODEL_NAME if embedding_function is None else (
+                getattr(embedding_function, "model_name", None) or getattr(embedding_function, "_model_name", None))
+        if not isinstance(model_name, str) or model_name == "":
+            raise ValueError(f"The model name of {type(embedding_function).__name__} can not be derived, "
+                             "pass model_name to cache its embeddings")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._cache = cache or EmbeddingCache()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, input: Documents) -> Embeddings:
+        content_hashes = [hashlib.md5(text.encode()).hexdigest()
+                          for text in input]
+        embeddings = self._cache.get_many(
+            self.model_name, list(set(content_hashes)))
+
+        # Embed each missing text once, even if it occurs several times in the input
+        missing: Dict[str, str] = {}
+        for content_hash, text in zip(content_hashes, input):
+            if content_hash not in embeddings:
+                missing[content_hash] = text
+        self.hits += len(input) - len(missing)
+        self.misses += len(missing)
+
+        missing_hashes = list(missing.keys())
+        for start in range(0, len(missing_hashes), self.batch_size):
+            batch = missing_hashes[start:start + self.batch_size]
+            batch_embeddings = self._embedding_function(
+                [missing[content_hash] for content_hash in batch])
+            new_embeddings = {content_hash: np.asarray(embedding, dtype=np.float32)
+                              for content_hash, embedding in zip(batch, batch_embeddings)}
+            self._cache.put_many(self.model_name, new_embeddings)
+            embeddings.update(new_embeddings)
+
+        return [embeddings[content_hash] for content_hash in content_hashes]
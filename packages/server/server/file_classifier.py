@@ -0,0 +1,162 @@
+import json
+import os
+import re
+from collections import Counter
+from typing import List
+from typing import TypedDict
+
+from server.file_utilities import iter_files_to_process, read_text_file
+from server.symbols import extract_python_symbols, extract_typescript_symbols
+
+# The same categories as the FileCategorizerAgent
+SOURCE_CODE = "source_code"
+CONFIGURATION_FILE = "configuration_file"
+SOMETHING_ELSE = "something_else"
+
+# Below this confidence the FileCategorizerAgent asks the LLM
+CONFIDENCE_THRESHOLD = 0.75
+
+SOURCE_CODE_EXTENSIONS = {
+    ".py", ".pyi", ".ts", ".tsx", ".mts", ".cts", ".js", ".jsx", ".mjs", ".cjs", ".go", ".rs", ".java", ".kt",
+    ".kts", ".scala", ".c", ".h", ".cc", ".cpp", ".hpp", ".cs", ".fs", ".swift", ".m", ".rb", ".php", ".pl",
+    ".lua", ".r", ".dart", ".ex", ".exs", ".erl", ".hs", ".clj", ".sh", ".bash", ".zsh", ".ps1", ".bat",
+    ".sql", ".vue", ".svelte", ".html", ".css", ".scss", ".sass", ".less"}
+CONFIGURATION_EXTENSIONS = {
+    ".json", ".jsonc", ".json5", ".yml", ".yaml", ".toml", ".ini", ".cfg", ".conf", ".config", ".env",
+    ".properties", ".lock", ".plist", ".xml", ".editorconfig", ".gitattributes", ".gitignore", ".npmrc"}
+CONFIGURATION_FILE_NAMES = {
+    "dockerfile", "makefile", "procfile", "gemfile", "rakefile", "vagrantfile", "jenkinsfile", ".gitignore",
+    ".gitattributes", ".dockerignore", ".prettierrc", ".prettierignore", ".eslintrc", ".eslintignore",
+    ".editorconfig", ".npmrc", ".nvmrc", ".python-version", ".env", "codeowners", "license", "requirements.txt"}
+OTHER_EXTENSIONS = {".md", ".mdx", ".txt", ".rst", ".adoc", ".csv", ".tsv", ".svg", ".log"}
+
+CONFIGURATION_LINE_PATTERN = re.compile(
+    r"""^\s*(?:[\w.\-"'/@]+\s*[:=]|\[[\w.\-" ]+\]\s*$)""")
+MARKUP_LINE_PATTERN = re.compile(r"^\s*(?:#{1,6} \w|```|>)")
+# List items occur in YAML as much as in Markdown, so they are not counted
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+\.)\s")
+CODE_LINE_PATTERN = re.compile(
+    r"^\s*(?:import|from|export|return|if|else|elif|for|while|def|class|function|const|let|var|public|private|"
+    r"package|func|fn|use|#include)\b|[;{}]\s*$|\)\s*(?:=>|:)\s*$")
+
+
+class Classification(TypedDict):
+    # source_code, configuration_file or something_else
+    category: str
+    # Between 0 and 1
+    confidence: float
+    reason: str
+
+
+def classify_file(relative_file_path: str | None, content: str) -> Classification:
+    """
+    Classifies a file as source_code, configuration_file or something_else without an LLM, by the name and
+    extension of the file, a shebang, and by sniffing the content.
+
+    Args:
+        relative_file_path (str | None): The path of the file, if known.
+        content (str): The content of the file.
+
+    Returns:
+        Classification: The category with a confidence. Files with a confidence below CONFIDENCE_THRESHOLD
+        should be categorized by the LLM.
+    """
+    if relative_file_path is not None:
+        file_name = os.path.basename(relative_file_path).lower()
+        extension = os.path.splitext(file_name)[1]
+        if file_name in CONFIGURATION_FILE_NAMES:
+            return Classification(category=CONFIGURATION_FILE, confidence=0.95, reason=f"file name {file_name}")
+        if extension in SOURCE_CODE_EXTENSIONS:
+            return Classification(category=SOURCE_CODE, confidence=0.95, reason=f"extension {extension}")
+        if extension in CONFIGURATION_EXTENSIONS:
+            return Classification(category=CONFIGURATION_FILE, confidence=0.95, reason=f"extension {extension}")
+        if extension in OTHER_EXTENSIONS:
+            return Classification(category=SOMETHING_ELSE, confidence=0.9, reason=f"extension {extension}")
+    return sniff_content(content)
+
+
+def sniff_content(content: str) -> Classification:
+    """
+    Classifies content by its first line, by parsing it, and by the share of lines that look like code,
+    like configuration or like prose.
+    """
+    stripped = content.strip()
+    if stripped == "":
+        return Classification(category=SOMETHING_ELSE, confidence=0.9, reason="empty")
+    if stripped.startswith("#!"):
+        return Classification(category=SOURCE_CODE, confidence=0.9, reason="shebang")
+    if stripped[0] in "{[":
+        if is_json(stripped):
+            return Classification(category=CONFIGURATION_FILE, confidence=0.85, reason="json")
+        if all(is_json(line) for line in stripped.splitlines() if line.strip() != ""):
+            return Classification(category=SOMETHING_ELSE, confidence=0.85, reason="json lines")
+    python_symbols = extract_python_symbols(content)
+    if python_symbols is not None and len(python_symbols) > 0:
+        return Classification(category=SOURCE_CODE, confidence=0.9, reason="python definitions")
+    # Modules that only import and re-export (e.g. __init__.py). YAML also parses as Python, but never imports
+    if python_symbols is not None and re.search(r"^(?:from \S+ )?import \S", content, re.MULTILINE):
+        return Classification(category=SOURCE_CODE, confidence=0.85, reason="python imports")
+    if python_symbols is None and len(extract_typescript_symbols(content)) > 0:
+        return Classification(category=SOURCE_CODE, confidence=0.85, reason="typescript definitions")
+
+    lines: List[str] = [line for line in content.splitlines()
+                        if line.strip() != "" and not LIST_ITEM_PATTERN.match(line)]
+    if len(lines) == 0:
+        return Classification(category=SOMETHING_ELSE, confidence=0.6, reason="list")
+    code_share = sum(1 for line in lines if CODE_LINE_PATTERN.search(line)) / len(lines)
+    configuration_share = sum(
+        1 for line in lines if CONFIGURATION_LINE_PATTERN.match(line)) / len(lines)
+    prose_share = sum(1 for line in lines if is_prose(line)
+                      or MARKUP_LINE_PATTERN.match(line)) / len(lines)
+    category, share = max([(SOURCE_CODE, code_share), (CONFIGURATION_FILE, configuration_share),
+                           (SOMETHING_ELSE, prose_share)], key=lambda item: item[1])
+    # A clear majority of the lines is as good as a parse, otherwise the LLM decides
+    confidence = 0.8 if share >= 0.7 else 0.6 if share >= 0.5 else 0.3
+    return Classification(category=category, confidence=confidence, reason=f"{share:.0%} of the lines")
+
+
+def is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+def is_prose(line: str) -> bool:
+    words = line.split()
+    letters = sum(1 for character in line if character.isalpha() or character == " ")
+    return len(words) >= 5 and letters / len(line) > 0.85
+
+
+if __name__ == '__main__':
+    # Reports how many calls to the FileCategorizerAgent the classifier saves on the files of BASE_FOLDER
+    base_folder = os.getenv('BASE_FOLDER') or './../../'
+    print(f"Classifying files in {base_folder} ({os.path.abspath(base_folder)})")
+    categories: Counter[str] = Counter()
+    reasons: Counter[str] = Counter()
+    uncertain: List[str] = []
+    total = 0
+    for file_path in iter_files_to_process(base_folder):
+        result = read_text_file(base_folder, file_path)
+        if result is None:
+            continue
+        total += 1
+        classification = classify_file(
+            result["relative_file_path"], result["content"])
+        if classification["confidence"] >= CONFIDENCE_THRESHOLD:
+            categories[classification["category"]] += 1
+            reasons[classification["reason"]] += 1
+        else:
+            uncertain.append(
+                f"{result['relative_file_path']} ({classification['category']}, {classification['reason']})")
+
+    saved = total - len(uncertain)
+    print(f"{total} files, {saved} classified locally ({saved / max(total, 1):.0%} of the LLM calls saved), "
+          f"{len(uncertain)} left for the LLM")
+    for category, count in categories.most_common():
+        print(f"  {category}: {count}")
+    print("Most common reasons: " + ", ".join(f"{reason} ({count})" for reason, count in reasons.most_common(10)))
+    for file in uncertain:
+        print(f"  Uncertain: {file}")
+    os._exit(0)
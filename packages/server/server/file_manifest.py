@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List
+from typing import TypedDict
+
+from server.file_utilities import MAX_FILE_SIZE, FileResult, get_cache_folder, read_text_file
+
+# Bumped whenever the way ids are computed or the entries change, so old manifests are discarded
+MANIFEST_VERSION = 3
+
+
+_manifest_locks: Dict[str, threading.Lock] = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def manifest_lock(base_folder: str) -> threading.Lock:
+    """
+    Returns the lock of the manifest of a base folder. FileManifest.save holds it while it merges its changes
+    into the saved manifest, so concurrent runs (the indexer and document jobs, the batches of the watcher)
+    never lose each other's entries. It is only held for the merge, never for a whole run.
+    """
+    key = os.path.realpath(base_folder)
+    with _manifest_locks_lock:
+        return _manifest_locks.setdefault(key, threading.Lock())
+
+
+class ManifestEntry(TypedDict):
+    size: int
+    mtime_ns: int
+    inode: int
+    content_hash: str
+    id: str
+    # Binary files are recorded too, so they are not opened again until they change
+    binary: bool
+
+
+class FileManifest:
+    """
+    Persisted record of the files seen in a base folder, keyed by their path relative to the base folder.
+
+    Each entry stores the stat signature (size, mtime_ns, inode) of the file together with the hash of its
+    content and the id it was indexed with. As long as the stat signature is unchanged, the id can be
+    returned without opening the file.
+    """
+
+    def __init__(self, base_folder: str, manifest_path: str | None = None) -> None:
+        self.base_folder = base_folder
+        self.manifest_path = manifest_path or os.path.join(
+            get_cache_folder(),
+            f"manifest-{hashlib.md5(os.path.abspath(base_folder).encode()).hexdigest()}.json")
+        self._entries: Dict[str, ManifestEntry] = {}
+        # The manifest is shared by the reader threads of the ingestion pipeline
+        self._lock = threading.Lock()
+        # Keys of the files returned since the manifest was loaded, see prune_untouched
+        self._touched: set[str] = set()
+        # Keys recorded and removed since the manifest was loaded, merged into the saved manifest by save
+        self._updated: set[str] = set()
+        self._removed: set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self) -> None:
+        self._entries = self._read_entries()
+
+    def _read_entries(self) -> Dict[str, ManifestEntry]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("version") != MANIFEST_VERSION:
+                print(f"Discarding manifest {self.manifest_path} from an older version")
+                return {}
+            return manifest["entries"]
+        except (OSError, ValueError) as error:
+            print(f"Could not load manifest {self.manifest_path}: {error}")
+            return {}
+
+    def save(self) -> None:
+        """
+        Merges the entries recorded and removed since the manifest was loaded into the saved manifest, so the
+        entries other runs saved in the meantime are kept.
+        """
+        with manifest_lock(self.base_folder):
+            with self._lock:
+                entries = self._read_entries()
+                for key in self._removed:
+                    entries.pop(key, None)
+                for key in self._updated:
+                    entries[key] = self._entries[key]
+                self._entries = entries
+                self._updated, self._removed = set(), set()
+            # Write to a temporary file first, so a crash never leaves a half written manifest behind. The name
+            # is unique, so concurrent saves (e.g. from another process) never replace each other's temporary file
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(self.manifest_path) or ".",
+                                             prefix=os.path.basename(self.manifest_path) + ".", suffix=".tmp",
+                                             delete=False) as manifest_file:
+                json.dump({"version": MANIFEST_VERSION,
+                          "entries": entries}, manifest_file)
+            os.replace(manifest_file.name, self.manifest_path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.base_folder)
+
+    def get(self, file_path: str) -> ManifestEntry | None:
+        """
+        Returns the manifest entry of the file if its stat signature is unchanged, otherwise None.
+        """
+        entry = self._entries.get(self._key(file_path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if (entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns
+                or entry["inode"] != stat.st_ino):
+            return None
+        return entry
+
+    def read_file(self, file_path: str, skip_content: bool = False, max_size: int | None = MAX_FILE_SIZE) -> FileResult | None:
+        """
+        Same as read_text_file, but only opens the file if skip_content is False or the file has changed
+        since it was last recorded in the manifest. Returns None for binary files.
+        """
+        if skip_content:
+            entry = self.get(file_path)
+            if entry is not None:
+                return self.unchanged_file_result(file_path, entry)
+
+        result = self.read_text_file(file_path, max_size)
+        if result is not None and skip_content:
+            result["content"] = ""
+        return result
+
+    def read_text_file(self, file_path: str, max_size: int | None = MAX_FILE_SIZE) -> FileResult | None:
+        """
+        Same as read_text_file in file_utilities (a single open for the binary check and the content),
+        recording the result in the manifest. Returns None for binary files.
+        """
+        # Stat before reading, so a write during the read is detected on the next run
+        stat = os.stat(file_path)
+        result = read_text_file(self.base_folder, file_path, max_size)
+        self._record(file_path, stat, result)
+        return result
+
+    def unchanged_file_result(self, file_path: str, entry: ManifestEntry) -> FileResult | None:
+        """
+        Returns the result of a file whose stat signature is unchanged, without its content, or None if the
+        file was binary.
+        """
+        with self._lock:
+            self.hits += 1
+            self._touched.add(self._key(file_path))
+        if entry["binary"]:
+            return None
+        return FileResult(
+            file_path=file_path,
+            relative_file_path=os.path.relpath(
+                file_path, os.path.dirname(self.base_folder)),
+            content="",
+            content_hash=entry["content_hash"],
+            id=entry["id"]
+        )
+
+    def _record(self, file_path: str, stat: os.stat_result, result: FileResult | None) -> None:
+        entry = ManifestEntry(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            inode=stat.st_ino,
+            content_hash=result["content_hash"] if result is not None else "",
+            id=result["id"] if result is not None else "",
+            binary=result is None
+        )
+        with self._lock:
+            self.misses += 1
+            self._entries[self._key(file_path)] = entry
+            self._touched.add(self._key(file_path))
+            self._updated.add(self._key(file_path))
+            self._removed.discard(self._key(file_path))
+
+    def remove(self, file_path: str) -> ManifestEntry | None:
+        """
+        Removes the entry of a deleted file and returns it.
+        """
+        with self._lock:
+            self._updated.discard(self._key(file_path))
+            self._removed.add(self._key(file_path))
+            return self._entries.pop(self._key(file_path), None)
+
+    def file_paths_in(self, folder_path: str) -> List[str]:
+        """
+        Returns the paths of the recorded files inside a folder, e.g. of a folder that was deleted or moved.
+        """
+        prefix = self._key(folder_path) + os.sep
+        with self._lock:
+            return [os.path.join(self.base_folder, key) for key in self._entries if key.startswith(prefix)]
+
+    def prune(self, file_paths: Iterable[str]) -> None:
+        """
+        Removes all entries for files that are not in the given list of file paths.
+        """
+        keep = set(self._key(file_path) for file_path in file_paths)
+        with self._lock:
+            self._remove_keys(keep)
+
+    def prune_untouched(self) -> None:
+        """
+        Removes all entries for files that have not been returned since the manifest was loaded.
+        Used when the file list is streamed and never held in memory.
+        """
+        with self._lock:
+            self._remove_keys(self._touched)
+
+    def _remove_keys(self, keep: set[str]) -> None:
+        removed = set(key for key in self._entries if key not in keep)
+        self._entries = {key: entry for key,
+                         entry in self._entries.items() if key in keep}
+        self._updated -= removed
+        self._removed |= removed
+
+    def log_stats(self) -> None:
+        print(f"Manifest: {self.hits} unchanged files skipped, {self.misses} files read")
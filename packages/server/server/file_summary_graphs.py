@@ -0,0 +1,170 @@
+from typing import Annotated, List, Literal, LiteralString, Tuple, TypedDict
+
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain_core.language_models import BaseChatModel
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.graph.state import Command, CompiledStateGraph
+from langgraph.types import Send
+
+from server.agents import FileCategorizerAgent, FileSummarizerAgent, MethodDocumenterAgent, MethodNameSearcher
+from server.symbols import Symbol, extract_symbols, format_symbols
+
+CATEGORIES = ("source_code", "configuration_file", "something_else")
+
+
+def supervisor_system_prompt() -> LiteralString:
+    return """You are a supervisor tasked with managing a team of four workers: a file_categorizer, a method_name_searcher, a method_documenter and a file_summarizer.
+        Given the following text content, you will first ask the file categorizer to categorize the content.
+        If it is not source code, you will finish.
+        If it is source_code you will do these four steps:
+        1. Ask the method_name_searcher to list the method and function signatures in the content.
+        2. For each of the found method names you will ask the method_documenter to document that particular method.
+        3. Ask the file_summarizer to collect all the method documentations and add a summary.
+        4. Respond with the final summary.
+        When finished, you will respond with FINISH.
+        """
+
+
+class Router(TypedDict):
+    next_agent: Literal["file_categorizer", "method_name_searcher",
+                        "method_documenter", "file_summarizer", "FINISH"]
+
+
+def build_supervisor_graph(model: BaseChatModel, checkpointer: BaseCheckpointSaver | None = None) -> CompiledStateGraph:
+    """
+    Builds the graph where a supervisor LLM decides which worker runs next, after every step.
+    """
+    categorizer_agent = FileCategorizerAgent("file_categorizer", model)
+    summarizer_agent = FileSummarizerAgent("file_summarizer", model)
+    # Lists the signatures with a parser instead of an LLM call
+    method_name_searcher = MethodNameSearcher("method_name_searcher")
+    method_documenter_agent = MethodDocumenterAgent(
+        "method_documenter", model)
+
+    def supervisor(state: MessagesState) -> Command[Literal["file_categorizer", "method_name_searcher", "method_documenter", "file_summarizer", "__end__"]]:
+        messages = [
+            SystemMessage(
+                content=supervisor_system_prompt()),
+        ] + state["messages"]
+        response = model.with_structured_output(Router).invoke(messages)
+
+        goto = response["next_agent"]
+        if goto == "FINISH":
+            goto = END
+        return Command(goto=goto)
+
+    # Setup graph
+    builder = StateGraph(MessagesState)
+
+    # Add nodes
+    builder.add_node("supervisor", supervisor)
+    builder.add_node(categorizer_agent.name, categorizer_agent.invoke)
+    builder.add_node(summarizer_agent.name, summarizer_agent.invoke)
+    builder.add_node(method_name_searcher.name,
+                     method_name_searcher.invoke)
+    builder.add_node(method_documenter_agent.name, method_documenter_agent.invoke)
+
+    # Add edges
+    builder.add_edge(START, "supervisor")
+
+    return builder.compile(checkpointer=checkpointer)
+
+
+def add_method_documentations(left: List[Tuple[int, str]], right: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    # The documenters each add one documentation, an empty update starts a new file
+    return left + right if len(right) > 0 else []
+
+
+class PipelineState(TypedDict):
+    messages: Annotated[list, add_messages]
+    category: str
+    symbols: List[Symbol]
+    # The start line and the documentation of every method, added by the method documenters in parallel
+    method_documentations: Annotated[List[Tuple[int, str]], add_method_documentations]
+
+
+class MethodState(TypedDict):
+    content: str
+    symbol: Symbol
+
+
+def parse_category(response: str) -> str:
+    """
+    Returns the first category mentioned in the response of the file categorizer, or something_else.
+    """
+    response = response.lower()
+    found = [(response.find(category), category)
+             for category in CATEGORIES if category in response]
+    return min(found)[1] if len(found) > 0 else "something_else"
+
+
+def build_pipeline_graph(model: BaseChatModel, checkpointer: BaseCheckpointSaver | None = None) -> CompiledStateGraph:
+    """
+    Builds a fixed categorize -> extract -> document methods -> summarize pipeline. Unlike the supervisor graph,
+    no LLM calls are spent on deciding what to do next, and the methods are documented in parallel
+    (limit the number of parallel calls with max_concurrency in the config of the run).
+    """
+    categorizer_agent = FileCategorizerAgent("file_categorizer", model)
+    method_documenter_agent = MethodDocumenterAgent(
+        "method_documenter", model)
+    summarizer_agent = FileSummarizerAgent("file_summarizer", model)
+
+    def file_content(state: PipelineState) -> str:
+        return next((str(message.content) for message in reversed(state["messages"])
+                     if isinstance(message, HumanMessage)), "")
+
+    def categorize(state: PipelineState) -> dict:
+        message = categorizer_agent.respond(
+            {"messages": [HumanMessage(content=file_content(state))]})
+        return {"category": parse_category(str(message.content)), "messages": [message], "method_documentations": []}
+
+    def route_category(state: PipelineState) -> Literal["method_name_searcher", "__end__"]:
+        return "method_name_searcher" if state["category"] == "source_code" else END
+
+    def extract(state: PipelineState) -> dict:
+        symbols = extract_symbols(None, file_content(state))
+        return {"symbols": symbols, "messages": [AIMessage(
+            content=format_symbols(symbols) or "No methods or functions found.", name="method_name_searcher")]}
+
+    def fan_out(state: PipelineState) -> List[Send] | Literal["file_summarizer"]:
+        methods = [symbol for symbol in state["symbols"]
+                   if symbol["kind"] in ("function", "method")]
+        if len(methods) == 0:
+            return "file_summarizer"
+        content = file_content(state)
+        return [Send("method_documenter", MethodState(content=content, symbol=symbol)) for symbol in methods]
+
+    def document_method(state: MethodState) -> dict:
+        symbol = state["symbol"]
+        message = method_documenter_agent.respond({"messages": [HumanMessage(
+            content=f"{state['content']}\n\nDocument the method or function {symbol['signature']} "
+                    f"(lines {symbol['start_line']}-{symbol['end_line']}).")]})
+        return {"method_documentations": [(symbol["start_line"], str(message.content))]}
+
+    def summarize(state: PipelineState) -> dict:
+        # The documentations arrive in the order the documenters finished, put them back in file order
+        documentations = [documentation for _, documentation in sorted(
+            state["method_documentations"], key=lambda item: item[0])]
+        message = summarizer_agent.respond({"messages": [HumanMessage(
+            content=file_content(state) + "\n\nThese are the descriptions of the methods and functions:\n\n" +
+            "\n\n".join(documentations))]})
+        return {"messages": [message]}
+
+    builder = StateGraph(PipelineState)
+
+    builder.add_node(categorizer_agent.name, categorize)
+    builder.add_node("method_name_searcher", extract)
+    builder.add_node(method_documenter_agent.name, document_method)
+    builder.add_node(summarizer_agent.name, summarize)
+
+    builder.add_edge(START, categorizer_agent.name)
+    builder.add_conditional_edges(categorizer_agent.name, route_category)
+    builder.add_conditional_edges(
+        "method_name_searcher", fan_out, [method_documenter_agent.name, summarizer_agent.name])
+    # The summarizer waits for all the method documenters
+    builder.add_edge(method_documenter_agent.name, summarizer_agent.name)
+    builder.add_edge(summarizer_agent.name, END)
+
+    return builder.compile(checkpointer=checkpointer)
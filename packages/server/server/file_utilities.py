@@ -1,10 +1,11 @@
 import hashlib
 import os
 import pathspec
-from typing import List
+from typing import Iterator, List, Tuple
 from typing import TypedDict
 
 IGNORED_EXTENSIONS = [".bin", ".sqlite3"]
+IGNORED_FOLDERS = [".git"]
 MAX_FILE_SIZE = 20000
 
 
@@ -17,6 +18,7 @@ class FileResult(TypedDict):
     file_path: str
     relative_file_path: str
     content: str
+    content_hash: str
     id: str
 
 
@@ -28,53 +30,192 @@ class FolderResult(TypedDict):
     id: str
 
 
-def get_files_to_process(base_folder: str) -> FileProcessResult:
+class WalkStats:
+    def __init__(self) -> None:
+        self.ignored_files = 0
+        self.binary_files = 0
+        self.pruned_folders = 0
+
+
+GitignoreSpecs = List[Tuple[str, pathspec.PathSpec]]
+
+
+def get_files_to_process(base_folder: str, check_binary: bool = False) -> FileProcessResult:
     """
-    Recursively scans the given folder and returns a dictionary containing a list of files to process and a log.
+    Recursively scans the given folder and returns a dictionary containing a list of files to process and the folders containing them.
 
     Args:
         base_folder (str): The path to the folder to scan.
+        check_binary (bool): Whether to open the files to skip binary files. By default the files are not
+            opened, binary files are skipped when they are read (see read_text_file and FileManifest).
 
     Returns:
         FileProcessResult: A dataclass with two attributes:
-            - files: A list of text file paths that do not include "node_modules" and do not start with ".git" or end with any of the ignored extensions.
-            - log: A string log of the scanning process, including the number of files found and the number of files after excluding ignored folders.
-    """
-    spec = generate_gitignore_spec(base_folder)
-    files_and_dirs = []
-    print(f"Scanning files and directories in {base_folder} ({
-          os.path.abspath(base_folder)})")
-    for root, dirs, files in os.walk(base_folder):
-        for name in files:
-            file_path = os.path.join(root, name)
-            relative_path = os.path.relpath(file_path, base_folder)
-            if not spec.match_file(relative_path) and not is_binary_file(file_path):
-                files_and_dirs.append(file_path)
-
-    all_files = len(files_and_dirs)
-    print("Found", all_files, "files")
-
-    def is_ignored(path) -> bool:
-        relative_path = os.path.relpath(path, base_folder)
-        if spec.match_file(relative_path):
-            return True
-        if ".git" in path.split(os.sep):
-            return True
-        if any(path.endswith(ext) for ext in IGNORED_EXTENSIONS):
-            return True
-        return False
-
-    files = [f for f in files_and_dirs if not is_ignored(f)]
-    all_dirs = [os.path.dirname(f) for f in files]
-    all_dirs = list(set(all_dirs))
+            - files: A list of file paths that are not ignored by any .gitignore file, are not inside a .git folder and do not end with any of the ignored extensions.
+            - folders: A list of the folders containing the files.
+    """
+    print(f"Scanning files and directories in {base_folder} ({os.path.abspath(base_folder)})")
+    stats = WalkStats()
+    files = list(iter_files_to_process(base_folder, check_binary=check_binary, stats=stats))
+    all_dirs = list(set(os.path.dirname(f) for f in files))
 
-    files_to_index = len(files)
-    print(f"Found {files_to_index} files to index in {len(all_dirs)} dirs (ignoring {
-          all_files - files_to_index})\n\n")
+    binary_files = f"{stats.binary_files} binary files and " if check_binary else ""
+    print(f"Found {len(files)} files to index in {len(all_dirs)} dirs (ignoring {stats.ignored_files} files, "
+          f"{binary_files}{stats.pruned_folders} folders)\n\n")
 
     return FileProcessResult(files=files, folders=all_dirs)
 
 
+def iter_files_to_process(base_folder: str, check_binary: bool = False, stats: WalkStats | None = None,
+                          folder: str | None = None) -> Iterator[str]:
+    """
+    Walks the given folder in a single pass using os.scandir and yields the paths of the files to process.
+
+    Ignored folders are pruned before descending into them. The .gitignore files of all folders are evaluated
+    hierarchically, so the patterns of a nested .gitignore take precedence over the ones of its parents.
+    The extension filters are applied before any I/O on the file itself, so the files are never opened. Only
+    with check_binary the remaining files are probed for binary content, otherwise the binary check is left to
+    the read (read_text_file does it in the same open).
+
+    Args:
+        base_folder (str): The path to the folder to scan.
+        check_binary (bool): Whether to open the files to skip binary files.
+        stats (WalkStats | None): Optional counters of what was skipped.
+        folder (str | None): Only walk this folder below base_folder (e.g. a folder moved into the tree). The
+            .gitignore files of the folders above it still apply.
+    """
+    stats = stats or WalkStats()
+    # Each stack entry is a folder, its path relative to base_folder and the .gitignore specs that apply to it
+    stack: List[Tuple[str, str, GitignoreSpecs]] = [(base_folder, "", [])]
+    if folder is not None:
+        if not is_file_to_process(base_folder, folder, is_dir=True):
+            return
+        relative_folder = os.path.relpath(folder, base_folder).replace(os.sep, "/")
+        if relative_folder != ".":
+            stack = [(folder, relative_folder, get_parent_gitignore_specs(base_folder, relative_folder))]
+    while stack:
+        files, subfolders = scan_folder(*stack.pop(), check_binary=check_binary, stats=stats)
+        yield from files
+        # Reverse so the subfolders are popped in alphabetical order
+        stack.extend(reversed(subfolders))
+
+
+def list_folder_to_process(base_folder: str, folder: str) -> Tuple[List[str], List[str]]:
+    """
+    Lists the files to process directly in a folder below base_folder, and its subfolders that are not ignored,
+    with the rules of iter_files_to_process (including the .gitignore files of the folders above it).
+
+    Returns:
+        Tuple[List[str], List[str]]: The paths of the files and of the subfolders, both empty when the folder
+        is ignored or can not be scanned.
+    """
+    if not is_file_to_process(base_folder, folder, is_dir=True):
+        return [], []
+    relative_folder = os.path.relpath(folder, base_folder).replace(os.sep, "/")
+    if relative_folder == ".":
+        files, subfolders = scan_folder(base_folder, "", [])
+    else:
+        files, subfolders = scan_folder(folder, relative_folder,
+                                        get_parent_gitignore_specs(base_folder, relative_folder))
+    return files, [subfolder for subfolder, _, _ in subfolders]
+
+
+def scan_folder(folder: str, relative_folder: str, specs: GitignoreSpecs, check_binary: bool = False,
+                stats: WalkStats | None = None) -> Tuple[List[str], List[Tuple[str, str, GitignoreSpecs]]]:
+    """
+    Scans one folder of the walk of iter_files_to_process, given the .gitignore specs of the folders above it.
+    Returns the files to process and the subfolders to walk, each with the specs that apply to it.
+    """
+    stats = stats or WalkStats()
+    spec = generate_gitignore_spec(folder)
+    if len(spec.patterns) > 0:
+        specs = specs + [(relative_folder, spec)]
+
+    try:
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+    except OSError as error:
+        print(f"Could not scan {folder}: {error}")
+        return [], []
+
+    files: List[str] = []
+    subfolders: List[Tuple[str, str, GitignoreSpecs]] = []
+    for entry in entries:
+        relative_path = relative_folder + "/" + entry.name if relative_folder else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name in IGNORED_FOLDERS or is_ignored_by_gitignore(specs, relative_path, is_dir=True):
+                stats.pruned_folders += 1
+            else:
+                subfolders.append((entry.path, relative_path, specs))
+        elif entry.is_file():
+            if entry.name.endswith(tuple(IGNORED_EXTENSIONS)) or is_ignored_by_gitignore(specs, relative_path, is_dir=False):
+                stats.ignored_files += 1
+            elif check_binary and is_binary_file(entry.path):
+                stats.binary_files += 1
+            else:
+                files.append(entry.path)
+    return files, subfolders
+
+
+def is_ignored_by_gitignore(specs: GitignoreSpecs, relative_path: str, is_dir: bool) -> bool:
+    """
+    Checks a path (relative to the base folder, using / as separator) against the .gitignore specs that apply to it.
+    The deepest .gitignore with a matching pattern decides, so negated patterns in nested files work like in git.
+    """
+    for spec_folder, spec in reversed(specs):
+        path = relative_path[len(spec_folder) + 1:] if spec_folder else relative_path
+        result = spec.check_file(path + "/" if is_dir else path)
+        if result.include is not None:
+            return result.include
+    return False
+
+
+def is_file_to_process(base_folder: str, file_path: str, is_dir: bool = False) -> bool:
+    """
+    Checks a single path against the rules of iter_files_to_process (ignored folders and extensions, and the
+    .gitignore files of the folders on its way), e.g. for a path reported by the file system watcher. The file
+    does not have to exist any more and is not probed for binary content. With is_dir, the path is checked as
+    a folder to walk.
+    """
+    relative_path = os.path.relpath(file_path, base_folder).replace(os.sep, "/")
+    if relative_path == ".":
+        return is_dir
+    if relative_path == ".." or relative_path.startswith("../"):
+        return False
+    parts = relative_path.split("/")
+    folders = parts if is_dir else parts[:-1]
+    if any(part in IGNORED_FOLDERS for part in folders):
+        return False
+    if not is_dir and parts[-1].endswith(tuple(IGNORED_EXTENSIONS)):
+        return False
+    specs: GitignoreSpecs = []
+    folder, relative_folder = base_folder, ""
+    for index, part in enumerate(parts):
+        spec = generate_gitignore_spec(folder)
+        if len(spec.patterns) > 0:
+            specs = specs + [(relative_folder, spec)]
+        relative_part = relative_folder + "/" + part if relative_folder else part
+        if is_ignored_by_gitignore(specs, relative_part, is_dir=is_dir or index < len(parts) - 1):
+            return False
+        folder, relative_folder = os.path.join(folder, part), relative_part
+    return True
+
+
+def get_parent_gitignore_specs(base_folder: str, relative_folder: str) -> GitignoreSpecs:
+    """
+    Returns the .gitignore specs of the folders above a folder (relative to the base folder, using / as
+    separator), from the base folder down to its parent, as iter_files_to_process would pass them to it.
+    """
+    specs: GitignoreSpecs = []
+    folder, relative_parent = base_folder, ""
+    for part in relative_folder.split("/"):
+        spec = generate_gitignore_spec(folder)
+        if len(spec.patterns) > 0:
+            specs = specs + [(relative_parent, spec)]
+        folder = os.path.join(folder, part)
+        relative_parent = relative_parent + "/" + part if relative_parent else part
+    return specs
+
+
 def generate_gitignore_spec(base_folder) -> pathspec.PathSpec:
     gitignore_path = os.path.join(base_folder, '.gitignore')
     ignored_patterns = []
@@ -86,13 +227,23 @@ def generate_gitignore_spec(base_folder) -> pathspec.PathSpec:
     return spec
 
 
-def read_file_content(base_folder: str, filepath: str, skip_content: bool = False) -> FileResult:
+def get_cache_folder() -> str:
+    """
+    Returns the folder used for local caches (file manifests etc.), creating it if needed.
+    """
+    cache_folder = os.getenv('CACHE_FOLDER') or './.repo-chat'
+    os.makedirs(cache_folder, exist_ok=True)
+    return cache_folder
+
+
+def read_file_content(base_folder: str, filepath: str, skip_content: bool = False, max_size: int | None = MAX_FILE_SIZE) -> FileResult:
     """
     Reads the content of a file, if not binary, and returns a FileResult containing the content and its MD5 hash.
 
     Args:
         base_folder (str): The path to the base folder.
         filepath (str): The path to the file to be read.
+        max_size (int | None): The content is truncated to this many characters. The id always covers the full content.
 
     Returns:
       FileHandleResult: A dataclass with three attributes:
@@ -102,20 +253,54 @@ def read_file_content(base_folder: str, filepath: str, skip_content: bool = Fals
     """
     with open(filepath, 'r', encoding='utf-8') as file:
         content = file.read()
-        # Only take the first max_file_size characters, but log the full length if truncated
-        if len(content) > MAX_FILE_SIZE:
-            print(
-                f"File {filepath} has {len(content)} characters, truncating to {MAX_FILE_SIZE}")
-            content = content[:MAX_FILE_SIZE]
-        relative_filepath = os.path.relpath(
-            filepath, os.path.dirname(base_folder))
-
-        return FileResult(
-            file_path=filepath,
-            relative_file_path=relative_filepath,
-            content="" if skip_content else content,
-            id=hashlib.md5((relative_filepath + content).encode()).hexdigest()
-        )
+    result = create_file_result(base_folder, filepath, content, max_size)
+    if skip_content:
+        result["content"] = ""
+    return result
+
+
+def read_text_file(base_folder: str, filepath: str, max_size: int | None = MAX_FILE_SIZE) -> FileResult | None:
+    """
+    Does the binary check and reads the content of a file with a single open, returning None if the file is binary.
+
+    Args:
+        base_folder (str): The path to the base folder.
+        filepath (str): The path to the file to be read.
+        max_size (int | None): The content is truncated to this many characters. The id always covers the full content.
+
+    Returns:
+        FileResult | None: The same result as read_file_content, or None if the file is not UTF-8 text.
+    """
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    try:
+        content = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    # Translate newlines like reading in text mode does, so the ids match the ones from read_file_content
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return create_file_result(base_folder, filepath, content, max_size)
+
+
+def create_file_result(base_folder: str, filepath: str, content: str, max_size: int | None = MAX_FILE_SIZE) -> FileResult:
+    relative_filepath = os.path.relpath(
+        filepath, os.path.dirname(base_folder))
+    # The id and hash cover the full content, so a change beyond max_size is still detected
+    content_hash = hashlib.md5(content.encode()).hexdigest()
+    id = hashlib.md5((relative_filepath + content).encode()).hexdigest()
+    # Only take the first max_size characters, but log the full length if truncated
+    if max_size is not None and len(content) > max_size:
+        print(
+            f"File {filepath} has {len(content)} characters, truncating to {max_size}")
+        content = content[:max_size]
+
+    return FileResult(
+        file_path=filepath,
+        relative_file_path=relative_filepath,
+        content=content,
+        content_hash=content_hash,
+        id=id
+    )
 
 
 def is_binary_file(filepath: str) -> bool:
@@ -1,115 +1,180 @@
-import hashlib
+import asyncio
 import os
-from typing import List
+from typing import Dict, List
 
+from langchain_core.language_models import LanguageModelInput
 from langchain_ollama import ChatOllama
-from server.file_utilities import FileResult, FolderResult, get_files_to_process, read_file_content
+from server.change_set import compute_change_set
+from server.chroma_client import wait_until_chroma_ready
+from server.directory_tree import DirectoryNode, build_changed_directory_tree, build_directory_tree, get_changed_folders
+from server.file_utilities import FileResult, FolderResult, iter_files_to_process
+from server.progress import ThroughputReport
 from server.repositories import DocumentationRepository, FolderDocumentation
+from server.repository_sync import RepositorySync
+from server.retry import retry_async
 
 
 class FolderSummarizer:
-    def __init__(self) -> None:
+    def __init__(self, concurrency: int = 4, max_attempts: int = 5) -> None:
+        """
+        Args:
+            concurrency (int): The maximum number of folder summaries requested from the LLM at the same time.
+            max_attempts (int): The number of attempts per folder on transient LLM failures.
+        """
         self.llm = ChatOllama(model="llama3.2", num_ctx=5000)
-        self.documentation_repo = DocumentationRepository()
-
-    def document_code(self) -> str:
-
-        number_of_docs = self.documentation_repo.count()
-        print(f'{number_of_docs} documents documented')
-
-        base_folder = os.getenv('BASE_FOLDER') or './../../'
-        codebase = get_files_to_process(base_folder)
-
-        stored_ids = self.documentation_repo.query_all_ids_of_type(
-            FolderDocumentation())
-
-        folders = codebase["folders"]
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    def document_code(self, full: bool = False) -> str:
+        return asyncio.run(self.adocument_code(full))
+
+    async def adocument_code(self, full: bool = False) -> str:
+        """
+        Summarizes the new and changed folders of BASE_FOLDER and removes the summaries of folders that are gone.
+
+        Like the indexer, only the folders above the files git reports as changed since the last complete run
+        are listed again, unless full is True or the changes can not be derived from git.
+        """
+        # The repository connects right away, e.g. while the Chroma container is still starting
+        wait_until_chroma_ready()
+        documentation_repo = DocumentationRepository()
+
+        sync = RepositorySync(documentation_repo, "folder", full)
+        base_folder = sync.base_folder
+        manifest = sync.manifest
+        git_changes = sync.git_changes
+
+        # The folder ids are Merkle hashes of the whole subtree, so only the folders on the path from a changed
+        # file to the root get a new id. The binary check is left to the manifest, so unchanged files are not
+        # opened
+        if git_changes is not None:
+            changed_folders = get_changed_folders(base_folder, git_changes["changed"] + git_changes["removed"])
+            stored_hashes = documentation_repo.get_folder_hashes()
+            tree = build_changed_directory_tree(base_folder, changed_folders, manifest, stored_hashes)
+            # Only the folders of the tree (and the changed folders that are gone) are compared with their stored
+            # summaries, the summaries of all other folders are left as they are
+            listed_folders = changed_folders | set(node.relative_folder_path for node in tree.iter_nodes())
+            stored_ids = [id for relative_folder_path, id in stored_hashes.items()
+                          if relative_folder_path in listed_folders]
+        else:
+            stored_ids = list(documentation_repo.iter_ids_of_type(
+                FolderDocumentation()))
+            # The tree is built while walking
+            tree = build_directory_tree(
+                base_folder, iter_files_to_process(base_folder), manifest)
         folder_results: List[FolderResult] = []
-        for folder in folders:
-            path_prefix = folder + os.sep
-            files_in_folder = [file for file in codebase["files"]
-                               if file.startswith(path_prefix) and file.count(os.sep, len(folder) + 1) == 0]
-            file_results = [read_file_content(base_folder, file_path)
-                            for file_path in files_in_folder]
-            hashes = [result["id"] for result in file_results]
-            folder_hash = hashlib.md5("".join(hashes).encode()).hexdigest()
-            relative_folder_path = os.path.relpath(folder, base_folder)
-            folder_depth = relative_folder_path.count(os.sep)
-            folder_results.append({
-                "folder_path": folder,
-                "relative_folder_path": relative_folder_path,
-                "folder_depth": folder_depth,
-                "file_results": file_results,
-                "id": folder_hash
-            })
-
-        folder_results = sorted(
-            folder_results, key=lambda x: -x["folder_depth"])
-        repo_ids = [result["id"] for result in folder_results]
-        new_folder_results = [
-            result for result in folder_results if result["id"] not in stored_ids]
-        removed_ids = [id for id in stored_ids if id not in repo_ids]
-
-        # Document the new or changed folders
-        for index, result in enumerate(new_folder_results):
-            print(index, result["id"], result["relative_folder_path"])
-            file_summaries = self.read_file_summaries(result["file_results"])
-            subfolder_summaries = self.read_subfolder_summaries(
-                result["folder_path"])
-            summary = self.prepare_summary(result,
-                                           self.format_file_summaries(
-                                               file_summaries),
-                                           self.format_subfolder_summaries(subfolder_summaries) if len(subfolder_summaries) > 0 else None)
-            print(summary[:50])
-            summary = result["relative_folder_path"] + "\n" + summary
-            self.documentation_repo.upsert(
-                [result["id"]], [summary], {"folder_summary": True, "relative_folder_path": result["relative_folder_path"]})
+        subfolders: Dict[str, List[FolderResult]] = {}
+        results_by_node: Dict[DirectoryNode, FolderResult] = {}
+        for node in tree.iter_nodes():
+            result = FolderResult(
+                folder_path=node.folder_path,
+                relative_folder_path=node.relative_folder_path,
+                folder_depth=node.folder_depth,
+                file_results=node.file_results,
+                id=node.hash
+            )
+            results_by_node[node] = result
+            subfolders[node.folder_path] = [results_by_node[child]
+                                            for child in node.children]
+            folder_results.append(result)
+
+        if git_changes is None:
+            manifest.prune_untouched()
+        manifest.save()
+        manifest.log_stats()
+
+        changes = compute_change_set(
+            stored_ids, folder_results, key=lambda result: result["id"])
+        changes.log("Folder summaries")
+        changes.log_duplicates(lambda result: result["relative_folder_path"])
+        removed_ids = changes.removed_ids
+
+        # Document the new or changed folders. A folder is summarized as soon as all its subfolders are,
+        # and the summaries of the subfolders are passed on in memory
+        new_paths = set(result["folder_path"] for result in changes.added)
+        unchanged_subfolder_ids = list(set(subfolder["id"] for result in changes.added
+                                           for subfolder in subfolders[result["folder_path"]]
+                                           if subfolder["folder_path"] not in new_paths))
+        stored_summaries = documentation_repo.get_documents(
+            unchanged_subfolder_ids)
+
+        report = ThroughputReport("Folder summaries", len(changes.added))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: Dict[str, asyncio.Task[str | None]] = {}
+
+        async def summarize(result: FolderResult) -> str | None:
+            subfolder_summaries: List[str] = []
+            for subfolder in subfolders[result["folder_path"]]:
+                if subfolder["folder_path"] in new_paths:
+                    subfolder_summary = await tasks[subfolder["folder_path"]]
+                    if subfolder_summary is None:
+                        # Leave the folder for the next run, when the subfolder is summarized
+                        print(f"Skipping {result['relative_folder_path']}, subfolder {subfolder['relative_folder_path']} failed")
+                        report.record_failure()
+                        return None
+                else:
+                    subfolder_summary = stored_summaries.get(subfolder["id"])
+                if subfolder_summary is not None:
+                    subfolder_summaries.append(subfolder_summary)
+
+            async with semaphore:
+                try:
+                    file_summaries = await asyncio.to_thread(self.read_file_summaries, documentation_repo,
+                                                             result["file_results"])
+                    response = await retry_async(lambda: self.llm.ainvoke(self.summary_messages(
+                        result,
+                        self.format_file_summaries(file_summaries) if len(file_summaries) > 0 else None,
+                        self.format_subfolder_summaries(subfolder_summaries) if len(subfolder_summaries) > 0 else None), {}),
+                        attempts=self.max_attempts)
+                except Exception as error:
+                    print(f"Could not summarize {result['relative_folder_path']}: {error}")
+                    report.record_failure()
+                    return None
+            report.record(response.usage_metadata)
+            print(report.completed, result["id"], result["relative_folder_path"], response.content[:50])
+            summary = result["relative_folder_path"] + "\n" + response.content
+            await asyncio.to_thread(documentation_repo.upsert,
+                                    [result["id"]], [summary], {"folder_summary": True, "relative_folder_path": result["relative_folder_path"]})
+            return summary
+
+        for result in changes.added:
+            tasks[result["folder_path"]] = asyncio.create_task(
+                summarize(result))
+        await asyncio.gather(*tasks.values())
+        print(report.summary())
 
         # Remove docs that are no longer in the repo
         if len(removed_ids) > 0:
             print(f"Removing {len(removed_ids)} documents\n\n")
-            self.documentation_repo.remove_docs(ids=removed_ids)
+            documentation_repo.remove_docs(ids=removed_ids)
             print("Removed", len(removed_ids), "docs from collection")
 
-        count_final = self.documentation_repo.count()
-        log = f"Collection {self.documentation_repo.name()} contains {count_final} documents, {abs(number_of_docs - count_final)} {
-            'added' if number_of_docs - count_final <= 0 else 'removed'}\n\n"
-        print(log)
-        return log
+        # Invalidate the cached search results of the collection. Folders that failed are summarized again by
+        # walking the tree on the next run
+        return sync.finish(report.completed > 0 or len(removed_ids) > 0, complete=report.failed == 0)
 
-    def read_file_summaries(self, file_results: List[FileResult]) -> List[str]:
+    def read_file_summaries(self, documentation_repo: DocumentationRepository,
+                            file_results: List[FileResult]) -> List[str]:
+        if len(file_results) == 0:
+            return []
         file_ids = [result["id"] for result in file_results]
         file_path = file_results[0]["file_path"]
         relative_folder = os.path.relpath(
             os.path.dirname(file_path), os.getenv('BASE_FOLDER') or './../../')
         summaries_with_file_paths = (
-            self.documentation_repo.get_by_id(file_ids) or [])
+            documentation_repo.get_by_id(file_ids) or [])
         summaries_without_file_paths = [
             summary[len(relative_folder) + len(os.sep):] for summary in summaries_with_file_paths]
         return summaries_without_file_paths
 
-    def read_subfolder_summaries(self, folder_path: str) -> List[str]:
-        subfolders = [folder for folder in os.listdir(
-            folder_path) if os.path.isdir(folder)]
-        relative_folder_path = os.path.relpath(folder_path, os.getenv(
-            'BASE_FOLDER') or './../../')
-        subfolder_results: List[str] = []
-        for subfolder in subfolders:
-            subfolder_relative_path = os.path.join(
-                relative_folder_path, subfolder)
-            subfolder_summary = self.documentation_repo.search(
-                query="", metadata={"relative_folder_path": subfolder_relative_path}) or []
-            subfolder_results.extend(subfolder_summary)
-        return subfolder_results
-
     def format_file_summaries(self, summaries: List[str]) -> str:
         return "Summary of file " + "\n\nSummary of file ".join(summaries)
 
     def format_subfolder_summaries(self, summaries: List[str]) -> str:
         return "Summary of folder " + "\n\nSummary of folder ".join(summaries)
 
-    def prepare_summary(self, file_result: FolderResult, file_summaries: str | None, folder_summaries: str | None) -> str:
-        messages = [
+    def summary_messages(self, file_result: FolderResult, file_summaries: str | None, folder_summaries: str | None) -> LanguageModelInput:
+        return [
             ("system", f"""You are an expert programmer specialised in writing excellent documentation of source code and configuration files.
                 You will summarize the purpose of the code in the folder/package: {file_result["relative_folder_path"]}
                 The folder might contain source code or configuration and subfolders.
@@ -124,7 +189,10 @@ class FolderSummarizer:
                  file_summaries if file_summaries else ""}
                 {"These are the existing subfolder summaries: " + folder_summaries if folder_summaries else ""}""")
         ]
-        response = self.llm.invoke(messages, {})
+
+    def prepare_summary(self, file_result: FolderResult, file_summaries: str | None, folder_summaries: str | None) -> str:
+        response = self.llm.invoke(self.summary_messages(
+            file_result, file_summaries, folder_summaries), {})
         return response.content
 
 
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from typing import Dict, List, Set, Tuple
+from typing import TypedDict
+
+from server.file_utilities import get_cache_folder, is_file_to_process
+
+# Git is only asked about the local object database, a slow answer means something is wrong
+GIT_TIMEOUT = 30
+
+
+class GitChanges(TypedDict):
+    # The commit the changes lead to, HEAD at the time of the detection
+    commit: str
+    # The files to index again, files that exist. They are not probed for binary content, the consumers read
+    # them with read_text_file and remove the binary ones
+    changed: List[str]
+    # The files to remove, deleted or renamed
+    removed: List[str]
+    # The modified and untracked files (relative to the base folder), which are checked again on the next run
+    dirty: List[str]
+
+
+class GitStateEntry(TypedDict):
+    commit: str
+    dirty: List[str]
+
+
+def run_git(base_folder: str, *args: str) -> str | None:
+    """
+    Runs git in the base folder and returns its output, or None when git is not installed, the folder is not
+    a git checkout or the command fails.
+    """
+    try:
+        return subprocess.run(["git", "-C", base_folder, *args], capture_output=True, text=True, check=True,
+                              timeout=GIT_TIMEOUT).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def split_null_terminated(output: str) -> List[str]:
+    return [item for item in output.split("\0") if item != ""]
+
+
+def get_head_commit(base_folder: str) -> str | None:
+    output = run_git(base_folder, "rev-parse", "--verify", "HEAD")
+    return output.strip() if output else None
+
+
+def get_dirty_paths(base_folder: str) -> List[str] | None:
+    """
+    Returns the modified (staged or not) and untracked files below the base folder, relative to it. Files
+    ignored by .gitignore are left out.
+    """
+    modified = run_git(base_folder, "diff", "--name-only", "-z", "--relative", "HEAD")
+    untracked = run_git(base_folder, "ls-files", "--others", "--exclude-standard", "-z")
+    if modified is None or untracked is None:
+        return None
+    return sorted(set(split_null_terminated(modified)) | set(split_null_terminated(untracked)))
+
+
+def snapshot_git_state(base_folder: str) -> GitStateEntry | None:
+    """
+    Returns HEAD and the dirty files, to be recorded once a run that started now has finished.
+    """
+    commit = get_head_commit(base_folder)
+    dirty = get_dirty_paths(base_folder) if commit is not None else None
+    if commit is None or dirty is None:
+        return None
+    return GitStateEntry(commit=commit, dirty=dirty)
+
+
+def detect_git_changes(base_folder: str, since: GitStateEntry) -> GitChanges | None:
+    """
+    Derives the files that changed since a recorded state from git: the diff between the recorded commit and
+    the working tree (committed, staged and unstaged changes, with renames), the untracked files, and the
+    files that were dirty at the recorded state (they may have been reverted since).
+
+    Returns:
+        GitChanges | None: None when the changes can not be derived from git (not a checkout, the recorded
+        commit is gone, e.g. after a history rewrite) or when a .gitignore changed, which can change the set
+        of files to index as a whole. The caller walks the full tree instead.
+    """
+    if run_git(base_folder, "cat-file", "-e", since["commit"] + "^{commit}") is None:
+        return None
+    snapshot = snapshot_git_state(base_folder)
+    diff = run_git(base_folder, "diff", "--name-status", "-z", "-M", "--relative", since["commit"])
+    if snapshot is None or diff is None:
+        return None
+
+    changed: Set[str] = set(snapshot["dirty"]) | set(since["dirty"])
+    removed: Set[str] = set()
+    items = split_null_terminated(diff)
+    index = 0
+    while index < len(items):
+        status = items[index]
+        if status[0] in "RC":
+            source, destination = items[index + 1], items[index + 2]
+            index += 3
+            if status[0] == "R":
+                removed.add(source)
+            changed.add(destination)
+        else:
+            path = items[index + 1]
+            index += 2
+            if status[0] == "D":
+                removed.add(path)
+            else:
+                changed.add(path)
+    if any(os.path.basename(path) == ".gitignore" for path in changed | removed):
+        print("A .gitignore file changed, the changes can not be derived from git")
+        return None
+
+    changed_files: List[str] = []
+    removed_files: List[str] = []
+    for relative_path in sorted(changed | removed):
+        file_path = os.path.join(base_folder, *relative_path.split("/"))
+        if not is_file_to_process(base_folder, file_path):
+            continue
+        if relative_path not in removed and os.path.isfile(file_path):
+            changed_files.append(file_path)
+        else:
+            removed_files.append(file_path)
+    return GitChanges(commit=snapshot["commit"], changed=changed_files, removed=removed_files,
+                      dirty=snapshot["dirty"])
+
+
+class GitState:
+    """
+    The git state (commit and dirty files) of a base folder that each consumer (e.g. the indexer and the
+    summarizer) last processed completely, persisted in the cache folder.
+    """
+
+    def __init__(self, base_folder: str, state_path: str | None = None) -> None:
+        self.base_folder = base_folder
+        self.state_path = state_path or os.path.join(
+            get_cache_folder(),
+            f"git-state-{hashlib.md5(os.path.abspath(base_folder).encode()).hexdigest()}.json")
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, GitStateEntry]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, name: str) -> GitStateEntry | None:
+        with self._lock:
+            return self._load().get(name)
+
+    def set(self, name: str, entry: GitStateEntry) -> None:
+        with self._lock:
+            state = self._load()
+            state[name] = entry
+            # Write to a temporary file with a unique name first, like the manifest
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(self.state_path) or ".",
+                                             prefix=os.path.basename(self.state_path) + ".", suffix=".tmp",
+                                             delete=False) as state_file:
+                json.dump(state, state_file)
+            os.replace(state_file.name, self.state_path)
+
+    def snapshot(self) -> GitStateEntry | None:
+        return snapshot_git_state(self.base_folder)
+
+    def changes(self, name: str) -> Tuple[GitChanges | None, GitStateEntry | None]:
+        """
+        Returns the changes since the state the consumer last processed (None when it has to walk the full
+        tree), and the current state to record once it has processed them.
+        """
+        since = self.get(name)
+        if since is not None:
+            changes = detect_git_changes(self.base_folder, since)
+            if changes is not None:
+                return changes, GitStateEntry(commit=changes["commit"], dirty=changes["dirty"])
+        return None, self.snapshot()
@@ -0,0 +1,71 @@
+import json
+from typing import List, Tuple
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, RemoveMessage, ToolMessage
+
+from server.tokens import CHARACTERS_PER_TOKEN
+
+# The history of a conversation is compacted to stay below this many tokens in the prompt
+HISTORY_TOKEN_BUDGET = 6000
+# Outputs of the tools of earlier turns are shortened to this many characters
+MAX_OLD_TOOL_OUTPUT = 500
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    size = len(message.content if isinstance(message.content, str) else json.dumps(message.content))
+    if isinstance(message, AIMessage):
+        size += sum(len(json.dumps(tool_call["args"])) for tool_call in message.tool_calls)
+    return size // CHARACTERS_PER_TOKEN + 1
+
+
+def split_turns(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+    """
+    Splits a conversation into turns, each starting with a message of the user. Tool calls and their results
+    never span turns, so whole turns can be dropped without breaking the conversation for the LLM.
+    """
+    turns: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or len(turns) == 0:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_history(messages: List[AnyMessage],
+                    token_budget: int = HISTORY_TOKEN_BUDGET) -> Tuple[List[AnyMessage], List[AnyMessage]]:
+    """
+    Compacts the history of a conversation to fit a token budget. The latest turn is kept as it is. First the
+    tool outputs of earlier turns are shortened, then the oldest turns are dropped until the rest fits.
+
+    Args:
+        messages (List[AnyMessage]): The messages of the conversation.
+        token_budget (int): The number of tokens the history may take in the prompt.
+
+    Returns:
+        Tuple[List[AnyMessage], List[AnyMessage]]: The messages to put in the prompt, and the updates for the
+        messages of the state (shortened messages with the ids of the originals and RemoveMessages), so the
+        stored conversation does not grow either.
+    """
+    turns = split_turns(messages)
+    total = sum(estimate_tokens(message) for message in messages)
+    updates: List[AnyMessage] = []
+    if total <= token_budget or len(turns) <= 1:
+        return messages, updates
+
+    for turn in turns[:-1]:
+        for index, message in enumerate(turn):
+            if isinstance(message, ToolMessage) and isinstance(message.content, str) \
+                    and len(message.content) > MAX_OLD_TOOL_OUTPUT:
+                shortened = message.model_copy(update={
+                    "content": message.content[:MAX_OLD_TOOL_OUTPUT] + " [shortened]"})
+                total += estimate_tokens(shortened) - estimate_tokens(message)
+                turn[index] = shortened
+                updates.append(shortened)
+
+    while total > token_budget and len(turns) > 1:
+        dropped = turns.pop(0)
+        total -= sum(estimate_tokens(message) for message in dropped)
+        updates = [update for update in updates if update not in dropped]
+        updates.extend(RemoveMessage(id=message.id) for message in dropped if message.id is not None)
+
+    return [message for turn in turns for message in turn], updates
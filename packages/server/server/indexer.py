@@ -1,62 +1,147 @@
 import os
-from server.file_utilities import get_files_to_process, read_file_content
+from typing import Iterable, List
+
+from server.chroma_client import wait_until_chroma_ready
+from server.file_manifest import FileManifest
+from server.file_utilities import FileResult, iter_files_to_process
+from server.ingestion_pipeline import IngestionPipeline
+from server.jobs import Job, until_cancelled
 from server.repositories.code_repo import CodeRepository
+from server.repository_sync import RepositorySync
+
 
+def indexer(batch_size: int = 100, max_in_flight: int = 4, read_workers: int | None = None, job: Job | None = None,
+            full: bool = False) -> str:
+    """
+    Indexes the new and changed files of BASE_FOLDER and removes the files that are gone.
 
-def indexer() -> str:
+    When BASE_FOLDER is a git checkout, the commit of the last complete run is recorded. The next run only
+    indexes the files git reports as changed since then (committed, staged, unstaged and untracked). The
+    whole tree is walked on the first run, with full=True, or when the changes can not be derived from git.
+
+    When run as a job, the progress counts are reported to the job, and a cancelled job stops walking the
+    files. The files indexed until then are kept, but nothing is removed, as the walk was incomplete.
+    """
+    wait_until_chroma_ready()
     code_repo = CodeRepository()
+    sync = RepositorySync(code_repo, "indexer", full)
+    manifest = sync.manifest
 
-    number_of_docs = code_repo.count()
-    print(f'{number_of_docs} documents indexed')
+    stored_ids, legacy_ids = code_repo.get_indexed_file_ids()
+    # The lexical index is kept next to the collection, bring it up to date with what is stored there
+    synced_files = code_repo.sync_lexical_index(stored_ids)
+    if synced_files > 0:
+        print(f"Added {synced_files} stored files to the lexical index")
 
-    base_folder = os.getenv('BASE_FOLDER') or './../../'
-    codebase = get_files_to_process(base_folder)
-
-    file_results = [result for result in (read_file_content(
-        base_folder, file) for file in codebase["files"])]
-    for result in file_results[:20]:
-        print(result["id"], result["relative_file_path"])
-
-    stored_ids = code_repo.get_all_ids()
-    repo_ids = [result["id"] for result in file_results]
-    new_file_results = [
-        result for result in file_results if result["id"] not in stored_ids]
-    new_ids = [result["id"] for result in new_file_results]
-    new_docs = [result["content"] for result in new_file_results]
-    removed_ids = [id for id in stored_ids if id not in repo_ids]
-
-    # Make sure the ids are unique
-    non_unique_ids = set([id for id in new_ids if new_ids.count(id) > 1])
-    if len(non_unique_ids) > 0:
-        print('Non-unique ids:', non_unique_ids)
-        # print the paths of the files with non-unique ids
-        for id in non_unique_ids:
-            print('Files with id:', id)
-            for result in file_results:
-                if result["id"] == id:
-                    print(result["relative_file_path"])
-            print()
-
-    assert len(new_ids) == len(set(new_ids)), 'The ids are not unique'
-
-    if len(new_ids) > 0:
-        print(f"Adding {len(new_ids)} new documents\n\n")
-        batch_size = 100
-        for i in range(0, len(new_ids), batch_size):
-            print(f"Adding {i} to {i + batch_size} documents")
-            code_repo.upsert(new_ids[i:i + batch_size],
-                             new_docs[i:i + batch_size],
-                             [{"relative_file_path": result["relative_file_path"]} for result in new_file_results[i:i + batch_size]])
-        print("Added", len(new_docs), "docs to collection")
-    # Remove docs that are no longer in the repo
+    if sync.git_changes is not None and len(legacy_ids) > 0:
+        # The unchanged files of the unchunked documents have to be read again, which needs the walk
+        print(f"{len(legacy_ids)} unchunked documents are stored, walking the full tree")
+        sync.git_changes = None
+    if sync.git_changes is not None:
+        log = index_changes(sync.git_changes["changed"], sync.git_changes["removed"], code_repo, manifest,
+                            batch_size=batch_size, job=job)
+        sync.save_state()
+        return log
+
+    def upsert(batch: List[FileResult]) -> None:
+        code_repo.upsert_files(batch)
+
+    # The binary check is done by the readers of the pipeline, in the same open as the read.
+    # The files are read in full, they are chunked by the code repository
+    pipeline = IngestionPipeline(manifest, upsert, read_workers=read_workers,
+                                 batch_size=batch_size, max_in_flight=max_in_flight)
+    stats = pipeline.stats
+    if job is not None:
+        job.track(lambda: {"files": stats.files, "binary": stats.binary,
+                           "unreadable": stats.unreadable, "added": stats.upserted})
+    changes = pipeline.run(until_cancelled(iter_files_to_process(sync.base_folder), job), stored_ids)
+    if job is not None and job.cancelled:
+        manifest.save()
+        if stats.upserted > 0:
+            code_repo.bump_generation()
+        job.raise_if_cancelled()
+    manifest.prune_untouched()
+    manifest.save()
+    manifest.log_stats()
+    print(f"Found {stats.files} files, {stats.binary} binary, {stats.unreadable} unreadable, "
+          f"{stats.upserted} added in {stats.batches} batches")
+    changes.log("Files")
+    # Make sure the ids are unique, duplicates are skipped by the pipeline
+    changes.log_duplicates(lambda relative_file_path: relative_file_path)
+
+    # Remove the chunks of files that are no longer in the repo
+    removed_ids = changes.removed_ids
     if len(removed_ids) > 0:
-        print(f"Removing {len(removed_ids)} documents\n\n")
-        code_repo.remove_docs(ids=removed_ids)
-        print("Removed", len(removed_ids), "docs from collection")
+        print(f"Removing {len(removed_ids)} files\n\n")
+        code_repo.remove_files(file_ids=removed_ids)
+        print("Removed", len(removed_ids), "files from collection")
+    # Documents from before the code was chunked are replaced by chunks
+    if len(legacy_ids) > 0:
+        print(f"Removing {len(legacy_ids)} unchunked documents")
+        code_repo.remove_docs(ids=legacy_ids)
+
+    # Invalidate the cached search results of the collection. The state from before the walk is recorded,
+    # files changed during the walk are indexed again on the next run
+    return sync.finish(stats.upserted > 0 or len(removed_ids) > 0 or len(legacy_ids) > 0)
+
+
+def index_changes(changed_paths: Iterable[str], removed_paths: Iterable[str], code_repo: CodeRepository | None = None,
+                  manifest: FileManifest | None = None, batch_size: int = 100, job: Job | None = None) -> str:
+    """
+    Indexes only the given files of BASE_FOLDER instead of walking the whole tree, e.g. the files reported by
+    the watcher. The changed files are read and chunked again, the chunks of the removed files are removed.
+    Changed files that are gone or binary by now are removed as well.
+
+    The cached search results are only invalidated when a chunk was stored or removed, files reported as
+    changed may be unchanged (e.g. the modified files git reports on every run). When run as a job, the
+    progress counts are reported to the job, and a cancelled job stops between batches of batch_size files.
+    """
+    code_repo = code_repo or CodeRepository()
+    base_folder = os.getenv('BASE_FOLDER') or './../../'
+    manifest = manifest or FileManifest(base_folder)
+
+    changed_paths = list(changed_paths)
+    gone_paths = list(removed_paths)
+    # Files that became binary keep their manifest entry, so the summarizers know without opening them again
+    binary_paths: List[str] = []
+    counts = {"files": 0, "indexed": 0, "removed": 0}
+    if job is not None:
+        job.track(lambda: dict(counts))
+    embedded_chunks = 0
+    changed_chunks = 0
+    for start in until_cancelled(range(0, len(changed_paths), batch_size), job):
+        file_results: List[FileResult] = []
+        for file_path in changed_paths[start:start + batch_size]:
+            try:
+                result = manifest.read_text_file(file_path)
+            except OSError:
+                gone_paths.append(file_path)
+                continue
+            if result is None:
+                binary_paths.append(file_path)
+            else:
+                file_results.append(result)
+        counts["files"] += len(changed_paths[start:start + batch_size])
+        if len(file_results) > 0:
+            upserted = code_repo.upsert_files(file_results)
+            embedded_chunks += upserted["embedded"]
+            changed_chunks += upserted["changed"]
+            counts["indexed"] += len(file_results)
+
+    for file_path in gone_paths:
+        manifest.remove(file_path)
+    if len(gone_paths) + len(binary_paths) > 0:
+        changed_chunks += code_repo.remove_paths([os.path.relpath(file_path, os.path.dirname(base_folder))
+                                                  for file_path in gone_paths + binary_paths])
+        counts["removed"] = len(gone_paths) + len(binary_paths)
+    manifest.save()
+    if changed_chunks > 0:
+        code_repo.bump_generation()
+    if job is not None:
+        job.raise_if_cancelled()
 
-    count_final = code_repo.count()
-    log = f"Collection {code_repo.name()} contains {count_final} documents, {abs(number_of_docs - count_final)} {
-        'added' if number_of_docs - count_final <= 0 else 'removed'}\n\n"
+    log = (f"Indexed {counts['indexed']} changed files ({embedded_chunks} chunks embedded, {changed_chunks} "
+           f"changed), removed {counts['removed']} files")
     print(log)
     return log
 
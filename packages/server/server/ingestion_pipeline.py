@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, Set, TypeVar
+
+from server.change_set import ChangeSet
+from server.file_manifest import FileManifest
+from server.file_utilities import FileResult
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+UpsertFunction = Callable[[List[FileResult]], None]
+
+
+class IngestionStats:
+    def __init__(self) -> None:
+        self.files = 0
+        self.binary = 0
+        self.unreadable = 0
+        self.upserted = 0
+        self.batches = 0
+
+
+def bounded_map(function: Callable[[T], R], items: Iterable[T], executor: ThreadPoolExecutor, max_pending: int) -> Iterator[R]:
+    """
+    Like executor.map, but never submits more than max_pending items ahead of the consumer,
+    so the input is consumed lazily and only max_pending results are held in memory.
+    Results are yielded in input order.
+    """
+    pending: Deque[Future[R]] = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def batched(items: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class IngestionPipeline:
+    """
+    Streams files from disk to the vector store in three overlapping stages:
+
+    1. A thread pool reads, binary-probes and hashes the files (a single open per file). Files whose
+       stat signature is unchanged in the manifest, and whose id is already stored or that were binary,
+       are not opened.
+    2. The new or changed files are collected into batches. At most queue_size files are read ahead.
+    3. The batches are upserted concurrently, with at most max_in_flight batches in flight.
+
+    Memory therefore only depends on queue_size, batch_size and max_in_flight, not on the size of the repo.
+    """
+
+    def __init__(self,
+                 manifest: FileManifest,
+                 upsert: UpsertFunction,
+                 read_workers: int | None = None,
+                 queue_size: int = 256,
+                 batch_size: int = 100,
+                 max_in_flight: int = 4,
+                 max_size: int | None = None) -> None:
+        self.manifest = manifest
+        self.upsert = upsert
+        self.read_workers = read_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        # The content is read in full by default, it is chunked before it is stored
+        self.max_size = max_size
+        self.stats = IngestionStats()
+        self._stats_lock = threading.Lock()
+
+    def run(self, file_paths: Iterable[str], stored_ids: Set[str]) -> ChangeSet[str]:
+        """
+        Ingests the given files and returns the change set of the file ids against the stored ids.
+        Only the relative paths of the files are kept in the change set, not their content.
+        """
+        changes: ChangeSet[str] = ChangeSet(stored_ids)
+        with ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix="ingest-read") as read_executor, \
+                ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ingest-upsert") as upsert_executor:
+            results = bounded_map(lambda file_path: self._read(file_path, stored_ids),
+                                  file_paths, read_executor, self.queue_size)
+            new_results = (result for result in results
+                           if result is not None and changes.add(result["id"], result["relative_file_path"]))
+            in_flight: Deque[Future[None]] = deque()
+            for batch in batched(new_results, self.batch_size):
+                in_flight.append(upsert_executor.submit(self._upsert, batch))
+                if len(in_flight) >= self.max_in_flight:
+                    in_flight.popleft().result()
+            while in_flight:
+                in_flight.popleft().result()
+
+        return changes
+
+    def _read(self, file_path: str, stored_ids: Set[str]) -> FileResult | None:
+        with self._stats_lock:
+            self.stats.files += 1
+        entry = self.manifest.get(file_path)
+        if entry is not None and (entry["binary"] or entry["id"] in stored_ids):
+            result = self.manifest.unchanged_file_result(file_path, entry)
+            if result is None:
+                with self._stats_lock:
+                    self.stats.binary += 1
+            return result
+        try:
+            result = self.manifest.read_text_file(file_path, self.max_size)
+        except OSError as error:
+            print(f"Could not read {file_path}: {error}")
+            with self._stats_lock:
+                self.stats.unreadable += 1
+            return None
+        if result is None:
+            with self._stats_lock:
+                self.stats.binary += 1
+        return result
+
+    def _upsert(self, batch: List[FileResult]) -> None:
+        self.upsert(batch)
+        with self._stats_lock:
+            self.stats.upserted += len(batch)
+            self.stats.batches += 1
+            print(f"Added {self.stats.upserted} documents")
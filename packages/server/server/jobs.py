@@ -0,0 +1,183 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, TypeVar
+from typing import TypedDict
+
+T = TypeVar("T")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Finished jobs are kept for GET requests until there are more than this many
+MAX_FINISHED_JOBS = 100
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobInfo(TypedDict):
+    id: str
+    kind: str
+    params: dict
+    status: str
+    progress: Dict[str, int]
+    result: str | None
+    error: str | None
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+
+
+class Job:
+    """
+    A long running job, like indexing or documenting the repo. The work function gets the job, so it can
+    report its progress with track and stop early when the job is cancelled.
+    """
+
+    def __init__(self, kind: str, params: dict) -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.result: str | None = None
+        self.error: str | None = None
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._cancel_event = threading.Event()
+        self._progress: Callable[[], Dict[str, int]] = lambda: {}
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def track(self, progress: Callable[[], Dict[str, int]]) -> None:
+        """
+        Sets the function that returns the progress counts of the job. It is called on every status request,
+        so the job does not have to push its progress.
+        """
+        self._progress = progress
+
+    def info(self) -> JobInfo:
+        return JobInfo(id=self.id, kind=self.kind, params=self.params, status=self.status,
+                       progress=self._progress(), result=self.result, error=self.error,
+                       created_at=self.created_at, started_at=self.started_at, finished_at=self.finished_at)
+
+
+def until_cancelled(items: Iterable[T], job: Job | None) -> Iterator[T]:
+    """
+    Yields the items until the job is cancelled.
+    """
+    for item in items:
+        if job is not None and job.cancelled:
+            return
+        yield item
+
+
+JobFunction = Callable[[Job], str]
+
+
+class JobManager:
+    """
+    Runs jobs in a pool of worker threads, off the event loop of the server.
+
+    Jobs are single-flighted: starting a job while an identical job (same kind and params) is queued or
+    running returns the existing job instead of starting the same work twice.
+    """
+
+    def __init__(self, max_workers: int = 2) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job")
+        self._functions: Dict[str, JobFunction] = {}
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._active: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def register(self, kind: str, function: JobFunction) -> None:
+        self._functions[kind] = function
+
+    def kinds(self) -> List[str]:
+        return list(self._functions.keys())
+
+    def start(self, kind: str, params: dict | None = None) -> Job:
+        """
+        Starts a job of a registered kind, or returns the identical job that is already queued or running.
+        """
+        if kind not in self._functions:
+            raise KeyError(f"Unknown job kind {kind}")
+        params = params or {}
+        key = kind + json.dumps(params, sort_keys=True)
+        with self._lock:
+            active_job = self._active.get(key)
+            if active_job is not None and active_job.status in ACTIVE_STATUSES and not active_job.cancelled:
+                return active_job
+            job = Job(kind, params)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._forget_finished_jobs()
+        self._executor.submit(self._run, job, key)
+        return job
+
+    def get(self, id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, id: str) -> Job | None:
+        """
+        Cancels a job. A queued job does not start, a running job stops at its next cancellation check.
+        """
+        job = self.get(id)
+        if job is not None and job.status in ACTIVE_STATUSES:
+            job.cancel()
+        return job
+
+    def shutdown(self) -> None:
+        for job in self.list():
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, key: str) -> None:
+        try:
+            job.raise_if_cancelled()
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.result = self._functions[job.kind](job)
+            job.status = SUCCEEDED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as error:
+            print(f"Job {job.kind} {job.id} failed: {error}")
+            job.error = str(error)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(key) is job:
+                    del self._active[key]
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [job.id for job in self._jobs.values()
+                    if job.status not in ACTIVE_STATUSES]
+        for id in itertools.islice(finished, max(0, len(finished) - MAX_FINISHED_JOBS)):
+            del self._jobs[id]
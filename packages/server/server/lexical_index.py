@@ -0,0 +1,261 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+from typing import TypedDict
+
+from server.file_utilities import get_cache_folder
+from server.symbols import has_symbol_extractor
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constant of reciprocal rank fusion, which dampens the influence of the top ranks of a single ranking
+RRF_K = 60
+# Added to the identifier score of a chunk that defines the identifier, so definitions rank above all uses
+DEFINITION_SCORE = 1000
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+# Parts of snake_case, camelCase and PascalCase identifiers, e.g. get, Files, HTTP and 2
+IDENTIFIER_PARTS_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+DEFINITION_PATTERN = re.compile(
+    r"\b(?:def|class|function|interface|type|enum|const|let|var)\s+([A-Za-z_$][A-Za-z0-9_$]*)")
+
+
+class IndexedChunk(TypedDict):
+    id: str
+    relative_file_path: str
+    file_id: str
+    start_line: int
+    end_line: int
+    document: str
+    # The names of the symbols defined in the chunk (see symbols.py)
+    symbols: List[str]
+
+
+class LexicalHit(TypedDict):
+    id: str
+    document: str
+    relative_file_path: str
+    start_line: int
+    end_line: int
+    score: float
+
+
+def tokenize_identifier_parts(identifier: str) -> List[str]:
+    return [part.lower() for part in IDENTIFIER_PARTS_PATTERN.findall(identifier)
+            if len(part) > 1 and part.lower() != identifier.lower()]
+
+
+def tokenize_document(text: str) -> List[str]:
+    """
+    Splits text into lowercase terms. Identifiers are kept as a whole and are also split into their parts,
+    so get_files_to_process matches both the query get_files_to_process and the query "files to process".
+    """
+    terms: List[str] = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        if len(identifier) < 2:
+            continue
+        terms.append(identifier.lower())
+        terms.extend(tokenize_identifier_parts(identifier))
+    return terms
+
+
+def extract_definitions(text: str) -> Set[str]:
+    """
+    Finds definitions with a regular expression, for languages without a symbol extractor.
+    """
+    return set(DEFINITION_PATTERN.findall(text))
+
+
+def looks_like_identifier(word: str) -> bool:
+    """
+    Whether a word of a query is written like code (snake_case, camelCase or PascalCase with several parts)
+    rather than like an ordinary word.
+    """
+    return "_" in word or len(IDENTIFIER_PARTS_PATTERN.findall(word)) > 1
+
+
+class LexicalIndex:
+    """
+    Local inverted index of the chunks of the code collection, stored in SQLite next to the other caches.
+
+    It keeps BM25 postings of the terms of every chunk and an exact table of the identifiers in every chunk,
+    where the chunks that define an identifier (the symbols of the chunk) are marked. It is maintained
+    by CodeRepository together with the Chroma collection, so lexical lookups never touch the vector store.
+    """
+
+    def __init__(self, collection_name: str, index_path: str | None = None) -> None:
+        self.index_path = index_path or os.path.join(
+            get_cache_folder(), f"lexical-{collection_name}.sqlite3")
+        # The index is updated from the upsert threads of the ingestion pipeline
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.index_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY,
+                    relative_file_path TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    start_line INTEGER NOT NULL,
+                    end_line INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    document TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chunks_path ON chunks (relative_file_path);
+                CREATE INDEX IF NOT EXISTS chunks_file_id ON chunks (file_id);
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    frequency INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_chunk_id ON postings (chunk_id);
+                CREATE TABLE IF NOT EXISTS identifiers (
+                    identifier TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    occurrences INTEGER NOT NULL,
+                    is_definition INTEGER NOT NULL,
+                    PRIMARY KEY (identifier, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS identifiers_chunk_id ON identifiers (chunk_id);
+                """)
+
+    def file_ids(self) -> Set[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT file_id FROM chunks").fetchall()
+        return set(row[0] for row in rows)
+
+    def replace_files(self, chunks: List[IndexedChunk]) -> None:
+        """
+        Replaces all chunks of the files of the given chunks, in one transaction.
+        """
+        paths = list(set(chunk["relative_file_path"] for chunk in chunks))
+        with self._lock, self._connection:
+            for start in range(0, len(paths), 500):
+                batch = paths[start:start + 500]
+                self._delete_chunks(
+                    f"relative_file_path IN ({','.join('?' * len(batch))})", batch)
+            for chunk in chunks:
+                self._insert_chunk(chunk)
+
+    def remove_files(self, file_ids: List[str]) -> None:
+        with self._lock, self._connection:
+            for start in range(0, len(file_ids), 500):
+                batch = file_ids[start:start + 500]
+                self._delete_chunks(
+                    f"file_id IN ({','.join('?' * len(batch))})", batch)
+
+    def remove_paths(self, relative_file_paths: List[str]) -> None:
+        with self._lock, self._connection:
+            for start in range(0, len(relative_file_paths), 500):
+                batch = relative_file_paths[start:start + 500]
+                self._delete_chunks(
+                    f"relative_file_path IN ({','.join('?' * len(batch))})", batch)
+
+    def _delete_chunks(self, condition: str, parameters: List[str]) -> None:
+        chunk_ids = [(row[0],) for row in self._connection.execute(
+            f"SELECT id FROM chunks WHERE {condition}", parameters)]
+        self._connection.executemany(
+            "DELETE FROM postings WHERE chunk_id = ?", chunk_ids)
+        self._connection.executemany(
+            "DELETE FROM identifiers WHERE chunk_id = ?", chunk_ids)
+        self._connection.executemany(
+            "DELETE FROM chunks WHERE id = ?", chunk_ids)
+
+    def _insert_chunk(self, chunk: IndexedChunk) -> None:
+        terms = Counter(tokenize_document(chunk["document"]))
+        identifiers = Counter(identifier for identifier in IDENTIFIER_PATTERN.findall(
+            chunk["document"]) if len(identifier) > 1)
+        definitions = set(chunk["symbols"]) if has_symbol_extractor(
+            chunk["relative_file_path"]) else extract_definitions(chunk["document"])
+        self._connection.execute(
+            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chunk["id"], chunk["relative_file_path"], chunk["file_id"], chunk["start_line"],
+             chunk["end_line"], sum(terms.values()), chunk["document"]))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO postings VALUES (?, ?, ?)",
+            [(term, chunk["id"], frequency) for term, frequency in terms.items()])
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO identifiers VALUES (?, ?, ?, ?)",
+            [(identifier, chunk["id"], occurrences, int(identifier in definitions))
+             for identifier, occurrences in identifiers.items()])
+
+    def search_identifiers(self, identifiers: Iterable[str], n_results: int = 5) -> List[LexicalHit]:
+        """
+        Looks up exact (case sensitive) identifiers. Chunks that define an identifier come first, then the
+        chunks that use it most often.
+        """
+        identifiers = list(set(identifiers))
+        if len(identifiers) == 0:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                f"""SELECT chunks.id, chunks.document, chunks.relative_file_path, chunks.start_line, chunks.end_line,
+                           SUM(identifiers.is_definition), SUM(identifiers.occurrences)
+                    FROM identifiers JOIN chunks ON chunks.id = identifiers.chunk_id
+                    WHERE identifiers.identifier IN ({','.join('?' * len(identifiers))})
+                    GROUP BY chunks.id
+                    ORDER BY SUM(identifiers.is_definition) DESC, SUM(identifiers.occurrences) DESC
+                    LIMIT ?""",
+                identifiers + [n_results]).fetchall()
+        return [LexicalHit(id=id, document=document, relative_file_path=relative_file_path, start_line=start_line,
+                           end_line=end_line, score=definitions * DEFINITION_SCORE + occurrences)
+                for id, document, relative_file_path, start_line, end_line, definitions, occurrences in rows]
+
+    def search_bm25(self, query: str, n_results: int = 5) -> List[LexicalHit]:
+        """
+        Ranks the chunks by their BM25 score for the terms of the query.
+        """
+        terms = list(set(tokenize_document(query)))
+        if len(terms) == 0:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            number_of_chunks, average_length = self._connection.execute(
+                "SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            if number_of_chunks == 0:
+                return []
+            average_length = average_length or 1
+            for term in terms:
+                postings: List[Tuple[str, int, int]] = self._connection.execute(
+                    """SELECT postings.chunk_id, postings.frequency, chunks.length
+                       FROM postings JOIN chunks ON chunks.id = postings.chunk_id
+                       WHERE postings.term = ?""", (term,)).fetchall()
+                if len(postings) == 0:
+                    continue
+                idf = math.log(1 + (number_of_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency, length in postings:
+                    scores[chunk_id] = scores.get(chunk_id, 0) + idf * frequency * (BM25_K1 + 1) / (
+                        frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            chunks = self._get_chunks([chunk_id for chunk_id, _ in best])
+        return [LexicalHit(id=chunk_id, document=chunks[chunk_id][0], relative_file_path=chunks[chunk_id][1],
+                           start_line=chunks[chunk_id][2], end_line=chunks[chunk_id][3], score=score)
+                for chunk_id, score in best if chunk_id in chunks]
+
+    def _get_chunks(self, chunk_ids: List[str]) -> Dict[str, Tuple[str, str, int, int]]:
+        # The document, path, start line and end line of the chunks, by id
+        if len(chunk_ids) == 0:
+            return {}
+        rows = self._connection.execute(
+            f"""SELECT id, document, relative_file_path, start_line, end_line
+                FROM chunks WHERE id IN ({','.join('?' * len(chunk_ids))})""", chunk_ids).fetchall()
+        return {row[0]: (row[1], row[2], row[3], row[4]) for row in rows}
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    """
+    Fuses rankings of ids by the sum of 1 / (k + rank) over all rankings the id is in. Only the ranks are
+    used, so BM25 scores, identifier matches and vector distances do not need to be on the same scale.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0) + 1 / (k + rank)
+    return sorted(scores.keys(), key=lambda id: scores[id], reverse=True)
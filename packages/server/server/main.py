@@ -1,12 +1,52 @@
-from fastapi import FastAPI
+import uuid
+from contextlib import asynccontextmanager
+from functools import cache
+from typing import TYPE_CHECKING, AsyncIterator, List
 
-from server.single_file_summarizer import SingleFileSummarizer
-from server.indexer import indexer
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+
+from server.jobs import Job, JobInfo, JobManager
+
+if TYPE_CHECKING:
+    from langgraph.graph.state import CompiledStateGraph
 
 # To run server in dev mode:
 # fastapi dev server/main.py --port 8080
 
-app = FastAPI()
+# LangChain, LangGraph, Ollama and Chroma are imported on first use, not on startup (see
+# server/benchmarks/startup_benchmark.py), so the server starts fast and without Chroma running
+
+
+def run_indexer(job: Job) -> str:
+    from server.indexer import indexer
+    return indexer(job=job)
+
+
+def run_document(job: Job) -> str:
+    from server.single_file_summarizer import SingleFileSummarizer
+    return SingleFileSummarizer().document_code(job=job)
+
+
+def run_watch(job: Job) -> str:
+    from server.watcher import Watcher
+    return Watcher().run(job=job)
+
+
+# The watch job runs until it is cancelled, the other jobs keep two workers. The jobs share the manifest of
+# BASE_FOLDER, each merges its own entries when it saves it (see FileManifest.save)
+job_manager = JobManager(max_workers=3)
+job_manager.register("indexer", run_indexer)
+job_manager.register("document", run_document)
+job_manager.register("watch", run_watch)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    job_manager.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/")
@@ -14,13 +54,89 @@ def read_root() -> dict[str, str]:
     return {"message": "Repo Chat server is running"}
 
 
-@app.get("/indexer")
-def index_repo() -> dict[str, str]:
-    result: str = indexer()
-    return {"message": "Indexer", "result": result}
+@app.get("/ready")
+def ready() -> dict[str, bool]:
+    """
+    Readiness check: answers 503 while Chroma (CHROMA_HOST and CHROMA_PORT) is not reachable.
+    """
+    from server.chroma_client import is_chroma_ready
+    if not is_chroma_ready():
+        raise HTTPException(status_code=503, detail="Chroma is not ready")
+    return {"chroma": True}
+
+
+@app.get("/metrics")
+def metrics() -> dict:
+    """
+    The number of Chroma requests per operation with their errors, retries and latency in seconds.
+    """
+    from server.chroma_client import chroma_metrics
+    return {"chroma": chroma_metrics.snapshot()}
+
+
+@cache
+def get_chat_graph() -> "CompiledStateGraph":
+    from server.chat import build_chat_graph
+    from server.checkpointer import SqliteCheckpointer
+
+    # One graph serves all sessions, the conversations are kept per thread id by the checkpointer
+    return build_chat_graph(SqliteCheckpointer())
+
+
+@app.get("/chat")
+def chat(message: str, session_id: str | None = None) -> StreamingResponse:
+    """
+    Streams the answer of the chat agent as server-sent events (see stream_chat). Pass the session_id of the
+    first session event with the next messages to continue the conversation.
+    """
+    from server.chat import stream_chat
+    return StreamingResponse(stream_chat(get_chat_graph(), message, session_id or uuid.uuid4().hex),
+                             media_type="text/event-stream",
+                             # Proxies must pass the tokens on as they come
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/jobs/{kind}", status_code=202)
+def start_job(kind: str) -> JobInfo:
+    """
+    Starts an indexer or document job in the background and returns it, with the id to poll its status.
+    If the same job is already queued or running, that job is returned instead.
+    """
+    if kind not in job_manager.kinds():
+        raise HTTPException(
+            status_code=404, detail=f"Unknown job kind {kind}, use one of {', '.join(job_manager.kinds())}")
+    return job_manager.start(kind).info()
+
+
+@app.get("/jobs")
+def list_jobs() -> List[JobInfo]:
+    return [job.info() for job in job_manager.list()]
+
+
+@app.get("/jobs/{id}")
+def get_job(id: str) -> JobInfo:
+    job = job_manager.get(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {id} not found")
+    return job.info()
+
+
+@app.post("/jobs/{id}/cancel")
+def cancel_job(id: str) -> JobInfo:
+    job = job_manager.cancel(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {id} not found")
+    return job.info()
+
+
+# The endpoints below used to run the job within the request, they now start it in the background
+
+
+@app.get("/indexer", status_code=202)
+def index_repo() -> JobInfo:
+    return job_manager.start("indexer").info()
 
 
-@app.get("/document")
-def document() -> dict[str, str]:
-    result: str = SingleFileSummarizer().document_code()
-    return {"message": "Document code", "result": result}
+@app.get("/document", status_code=202)
+def document() -> JobInfo:
+    return job_manager.start("document").info()
@@ -0,0 +1,76 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+
+class ThroughputReport:
+    """
+    Counts the completed LLM jobs of a run and the tokens they used, to report the throughput at the end.
+    """
+
+    def __init__(self, name: str, total: int) -> None:
+        self.name = name
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        # The items that failed, when the caller names them
+        self.failed_paths: List[str] = []
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.start = time.perf_counter()
+
+    def record(self, usage: UsageMetadata | None) -> None:
+        self.completed += 1
+        if usage is not None:
+            self.input_tokens += usage["input_tokens"]
+            self.output_tokens += usage["output_tokens"]
+
+    def record_cache_hit(self) -> None:
+        self.completed += 1
+        self.cache_hits += 1
+
+    def record_failure(self, path: str | None = None) -> None:
+        self.failed += 1
+        if path is not None:
+            self.failed_paths.append(path)
+
+    def counts(self) -> Dict[str, int]:
+        return {"total": self.total, "completed": self.completed, "failed": self.failed,
+                "cache_hits": self.cache_hits, "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed(), 1e-9)
+        return (f"{self.name}: {self.completed}/{self.total} done ({self.cache_hits} from cache), "
+                f"{self.failed} failed in {elapsed:.1f}s, "
+                f"{self.completed / elapsed * 60:.1f} per min, "
+                f"{self.output_tokens / elapsed:.1f} output tokens/s "
+                f"({self.input_tokens} input and {self.output_tokens} output tokens)")
+
+
+class ReportingCallbackHandler(BaseCallbackHandler):
+    """
+    Records every LLM call made while running a graph or an agent (including the calls inside agents that
+    only return their last message) in a ThroughputReport.
+    """
+
+    def __init__(self, report: ThroughputReport) -> None:
+        self.report = report
+        # Nodes that run in parallel report from several threads
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = generation.message.usage_metadata if isinstance(
+                    generation, ChatGeneration) and hasattr(generation.message, "usage_metadata") else None
+                with self._lock:
+                    self.report.record(usage)
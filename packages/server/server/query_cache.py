@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Tuple, TypeVar
+
+V = TypeVar("V")
+
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TTL = 600.0
+# How long a generation read from Chroma is trusted before it is read again
+GENERATION_CHECK_INTERVAL = 5.0
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread safe least recently used cache, where entries also expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, max_size: int, ttl: float | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, is_valid: Callable[[V], bool] | None = None) -> V | None:
+        """
+        Returns the value of the key, unless it is missing, expired or rejected by is_valid.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl) \
+                    or (is_valid is not None and not is_valid(entry[1])):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class QueryCache:
+    """
+    Process wide cache of search results and query embeddings.
+
+    Results are stored together with the generation of their collection. The indexer and the summarizers bump
+    the generation of a collection when they change it (see BaseRepository.bump_generation), which
+    invalidates all cached results of that collection. The generation is stored in the collection metadata,
+    so bumps in other processes are seen within GENERATION_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL) -> None:
+        self.results: LRUCache[Tuple[int, object]] = LRUCache(max_size, ttl)
+        # Query embeddings only depend on the text and the model, so they never expire
+        self.embeddings: LRUCache[object] = LRUCache(max_size)
+        self._generations: dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, collection_name: str, read_generation: Callable[[], int]) -> int:
+        with self._lock:
+            cached = self._generations.get(collection_name)
+        if cached is not None and time.monotonic() - cached[1] < GENERATION_CHECK_INTERVAL:
+            return cached[0]
+        generation = read_generation()
+        self.set_generation(collection_name, generation)
+        return generation
+
+    def set_generation(self, collection_name: str, generation: int) -> None:
+        with self._lock:
+            self._generations[collection_name] = (
+                generation, time.monotonic())
+
+    def get_result(self, key: Hashable, generation: int) -> object | None:
+        entry = self.results.get(
+            key, is_valid=lambda entry: entry[0] == generation)
+        return None if entry is None else entry[1]
+
+    def put_result(self, key: Hashable, generation: int, result: object) -> None:
+        self.results.put(key, (generation, result))
+
+
+query_cache = QueryCache()
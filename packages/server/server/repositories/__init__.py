@@ -1,3 +1,4 @@
+from .base_repo import SearchHit
 from .code_repo import CodeRepository
 from .documentation_repo import DocumentationRepository, FolderDocumentation, SingleFileDocumentation
 
@@ -5,5 +6,6 @@ __all__ = [
     'CodeRepository',
     'DocumentationRepository',
     'FolderDocumentation',
+    'SearchHit',
     'SingleFileDocumentation',
 ]
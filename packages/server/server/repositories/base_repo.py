@@ -1,43 +1,248 @@
-from typing import List
-from chromadb import HttpClient, Metadata, QueryResult, Where
+import json
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar, cast
+from typing import TypedDict
+from chromadb import Documents, EmbeddingFunction, Metadata, Where
 from chromadb.api import ClientAPI
-from chromadb.api.types import ID, Document, OneOrMany
+import numpy as np
+from chromadb.api.types import ID, Document, Embedding, Include, OneOrMany
+from server.chroma_client import call_chroma, get_chroma_client
+from server.embeddings import CachedEmbeddingFunction
+from server.query_cache import query_cache
+from server.search_hit import SearchHit
+
+PAGE_SIZE = 1000
+# With diversification, this many times n_results candidates are fetched to choose from
+MMR_FETCH_FACTOR = 4
+
+R = TypeVar("R")
+
+
+class StoredDocument(TypedDict):
+    id: str
+    document: Document | None
+    metadata: Metadata | None
+
+
+def max_marginal_relevance(query_embedding: Embedding, embeddings: Sequence[Embedding], n_results: int,
+                           lambda_mult: float) -> List[int]:
+    """
+    Selects n_results of the embeddings by maximal marginal relevance: one by one, the embedding with the best
+    balance of similarity to the query and dissimilarity to the ones selected before.
+
+    Args:
+        lambda_mult (float): 1 ranks by similarity to the query only, 0 by diversity only.
+
+    Returns:
+        List[int]: The indexes of the selected embeddings, in the order they were selected.
+    """
+    if len(embeddings) == 0:
+        return []
+    vectors = np.array(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    query_similarities = vectors @ query
+    selected: List[int] = []
+    # The highest similarity of every candidate to the selected ones
+    redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)
+    while len(selected) < min(n_results, len(vectors)):
+        scores = lambda_mult * query_similarities - (1 - lambda_mult) * np.maximum(redundancy, 0)
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
 
 
 class BaseRepository():
-    def __init__(self, collection_name: str, http_client: ClientAPI | None) -> None:
-        if http_client is None:
-            http_client = HttpClient(host="localhost", port=8000)
-        self._chroma_client = http_client
-        self._collection = self._chroma_client.get_or_create_collection(
-            collection_name)
+    def __init__(self, collection_name: str, http_client: ClientAPI | None, embedding_function: EmbeddingFunction[Documents] | None = None) -> None:
+        # Repositories share the client (and its connections) of the process, unless one is injected
+        self._chroma_client = http_client or get_chroma_client()
+        # Documents are embedded on the client, through a cache, before they are sent to Chroma
+        self._embedding_function = embedding_function or CachedEmbeddingFunction()
+        self._collection = call_chroma("get_or_create_collection", lambda: self._chroma_client.get_or_create_collection(
+            collection_name, embedding_function=self._embedding_function))
 
     def name(self) -> str:
         return self._collection.name
 
     def count(self) -> int:
-        return self._collection.count()
+        return call_chroma("count", self._collection.count)
+
+    def upsert(self, ids: OneOrMany[ID], docs: OneOrMany[Document], metadatas: OneOrMany[Metadata] | None = None, embed_texts: List[str] | None = None) -> None:
+        """
+        Embeds the documents (or embed_texts, if the embedded text should differ from the stored document) and stores them.
+        """
+        if isinstance(docs, str):
+            docs = [docs]
+        embeddings = self._embedding_function(embed_texts or docs)
+        call_chroma("upsert", lambda: self._collection.upsert(
+            ids, embeddings=embeddings, documents=docs, metadatas=metadatas))
 
-    def upsert(self, ids: OneOrMany[ID], docs: OneOrMany[Document], metadatas: OneOrMany[Metadata] | None = None) -> None:
-        self._collection.upsert(ids, documents=docs, metadatas=metadatas)
+    def update_metadatas(self, ids: List[ID], metadatas: List[Metadata]) -> None:
+        # Unlike upsert, update does not re-embed the documents
+        call_chroma("update", lambda: self._collection.update(ids, metadatas=metadatas))
+
+    def update_documents(self, ids: List[ID], docs: List[Document], metadatas: List[Metadata]) -> None:
+        """
+        Replaces the documents and metadatas of stored entries whose embedded text is unchanged (e.g. a chunk
+        that moved to other lines), keeping the stored embeddings instead of embedding the documents again.
+        """
+        stored = call_chroma("get", lambda: self._collection.get(ids=ids, include=["embeddings"]))
+        embeddings_by_id = dict(zip(stored["ids"], stored["embeddings"] if stored["embeddings"] is not None else []))
+        call_chroma("update", lambda: self._collection.update(
+            ids, embeddings=[embeddings_by_id[id] for id in ids], documents=docs, metadatas=metadatas))
 
     def remove_docs(self, ids: list) -> None:
-        self._collection.delete(ids=ids)
+        call_chroma("delete", lambda: self._collection.delete(ids=ids))
+
+    def remove_where(self, where: Where) -> None:
+        call_chroma("delete", lambda: self._collection.delete(where=where))
+
+    def get_ids(self, where: Where | None = None) -> List[str]:
+        return list(self.iter_ids(where))
+
+    def iter_ids(self, where: Where | None = None, page_size: int = PAGE_SIZE) -> Iterator[str]:
+        """
+        Yields the ids of all documents (matching the where filter) by paging through the collection.
+        No embeddings are computed and there is no upper bound on the number of ids.
+        """
+        for document in self.iter_documents(where, include=[], page_size=page_size):
+            yield document["id"]
+
+    def iter_documents(self, where: Where | None = None, include: Include | None = None, page_size: int = PAGE_SIZE) -> Iterator[StoredDocument]:
+        """
+        Yields all documents (matching the where filter) by paging through the collection with offset and limit.
+        Only the fields in include (by default documents and metadatas) are fetched, the others are None.
+        """
+        if include is None:
+            include = ["documents", "metadatas"]
+        offset = 0
+        while True:
+            result = call_chroma("get", lambda: self._collection.get(
+                where=where, include=include, limit=page_size, offset=offset))
+            ids = result["ids"]
+            documents = result["documents"] or [None] * len(ids)
+            metadatas = result["metadatas"] or [None] * len(ids)
+            for id, document, metadata in zip(ids, documents, metadatas):
+                yield StoredDocument(id=id, document=document, metadata=metadata)
+            if len(ids) < page_size:
+                return
+            offset += len(ids)
 
     def get_by_id(self, id: OneOrMany[ID]) -> List[Document] | None:
-        return self._collection.get(id, include=["documents"])["documents"]
-
-    def get_all_ids(self) -> List[str]:
-        return self._collection.peek(limit=100000)['ids']
-
-    def query_all_ids(self, where: Where | None) -> List[str]:
-        result: QueryResult = self._collection.query(
-            # Empty query to get all documents. Does this actually work?
-            query_texts=[""],
-            where=where, n_results=100000)
-        return result["ids"][0]
-
-    def search(self, query: str, metadata: Metadata | None = None) -> List[str] | None:
-        result: List[str] = self._collection.query(
-            query_texts=[query], n_results=5, where=metadata)
-        return result["documents"][0]
+        return call_chroma("get", lambda: self._collection.get(id, include=["documents"]))["documents"]
+
+    def get_documents(self, ids: List[ID]) -> Dict[str, Document]:
+        """
+        Returns the stored documents of the given ids, by id. Ids that are not stored are left out.
+        """
+        if len(ids) == 0:
+            return {}
+        result = call_chroma("get", lambda: self._collection.get(ids, include=["documents"]))
+        return dict(zip(result["ids"], result["documents"] or []))
+
+    def generation(self) -> int:
+        """
+        The generation of the collection, which changes every time the collection is updated by a run of the
+        indexer or the summarizers. Cached search results of older generations are not used.
+        """
+        return query_cache.generation(self.name(), self._read_generation)
+
+    def _read_generation(self) -> int:
+        collection = call_chroma("get_collection", lambda: self._chroma_client.get_collection(
+            self.name(), embedding_function=self._embedding_function))
+        return int((collection.metadata or {}).get("generation", 0))
+
+    def bump_generation(self) -> None:
+        # A timestamp rather than a counter, so concurrent bumps from different processes never collide
+        generation = time.time_ns()
+        metadata = dict(self._collection.metadata or {})
+        metadata["generation"] = generation
+        call_chroma("modify", lambda: self._collection.modify(metadata=metadata))
+        query_cache.set_generation(self.name(), generation)
+
+    def embed_query(self, query: str) -> Embedding:
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[Embedding]:
+        """
+        Embeds the queries through the query cache, with one call of the embedding function for the queries
+        that are not cached.
+        """
+        model_name = getattr(self._embedding_function, "model_name",
+                             type(self._embedding_function).__name__)
+        embeddings = [query_cache.embeddings.get((model_name, query)) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if len(missing) > 0:
+            computed = dict(zip(missing, self._embedding_function(missing)))
+            for query, embedding in computed.items():
+                query_cache.embeddings.put((model_name, query), embedding)
+            embeddings = [computed[query] if embedding is None else embedding
+                          for query, embedding in zip(queries, embeddings)]
+        return cast(List[Embedding], embeddings)
+
+    def cached_result(self, key: Tuple, compute: Callable[[], R]) -> R:
+        """
+        Returns the cached result of the key for the current generation of the collection, or computes and caches it.
+        """
+        key = (self.name(),) + key
+        generation = self.generation()
+        cached = query_cache.get_result(key, generation)
+        if cached is not None:
+            return cast(R, cached)
+        result = compute()
+        query_cache.put_result(key, generation, result)
+        return result
+
+    def search(self, query: str, metadata: Metadata | None = None, n_results: int = 5) -> List[str] | None:
+        hits = self.search_many([query], n_results, where=metadata)[0]
+        return [hit["document"] or "" for hit in hits] if len(hits) > 0 else None
+
+    def search_many(self, queries: List[str], n_results: int = 5, where: Where | None = None,
+                    include: Include | None = None, mmr_lambda: float | None = None) -> List[List[SearchHit]]:
+        """
+        Searches the collection for several queries with one request to Chroma.
+
+        Args:
+            queries (List[str]): The query texts, embedded in one batch.
+            n_results (int): The number of hits per query.
+            where (Where | None): A metadata filter for all queries.
+            include (Include | None): The fields of the hits to fetch, documents and metadatas by default.
+                Distances are always fetched.
+            mmr_lambda (float | None): Diversifies the hits by maximal marginal relevance (see
+                max_marginal_relevance), to leave out near duplicates. None ranks by distance only.
+
+        Returns:
+            List[List[SearchHit]]: The hits of every query, in the order of the queries.
+        """
+        if len(queries) == 0:
+            return []
+        if include is None:
+            include = ["documents", "metadatas"]
+        include = [field for field in include if field in ("documents", "metadatas")]
+
+        def compute() -> List[List[SearchHit]]:
+            query_embeddings = self.embed_queries(queries)
+            fetched_fields = include + ["distances"] + (["embeddings"] if mmr_lambda is not None else [])
+            result = call_chroma("query", lambda: self._collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results * MMR_FETCH_FACTOR if mmr_lambda is not None else n_results,
+                where=where, include=fetched_fields))
+            hits: List[List[SearchHit]] = []
+            for index, ids in enumerate(result["ids"]):
+                documents = result["documents"][index] if result["documents"] else [None] * len(ids)
+                metadatas = result["metadatas"][index] if result["metadatas"] else [None] * len(ids)
+                distances = result["distances"][index] if result["distances"] else [None] * len(ids)
+                order = list(range(len(ids)))
+                if mmr_lambda is not None and result["embeddings"] is not None:
+                    order = max_marginal_relevance(
+                        query_embeddings[index], result["embeddings"][index], n_results, mmr_lambda)
+                hits.append([SearchHit(id=ids[position], document=documents[position], metadata=metadatas[position],
+                                       distance=None if distances[position] is None else float(distances[position]))
+                             for position in order[:n_results]])
+            return hits
+
+        return self.cached_result(("search_many", tuple(queries), n_results, json.dumps(where, sort_keys=True),
+                                   tuple(include), mmr_lambda), compute)
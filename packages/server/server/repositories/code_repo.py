@@ -1,7 +1,253 @@
+from typing import Dict, List, Set, Tuple, TypedDict, cast
+from chromadb import Documents, EmbeddingFunction, Metadata
 from chromadb.api import ClientAPI
-from server.repositories.base_repo import BaseRepository
+from server.chunker import Chunk, chunk_file, create_chunk
+from server.file_utilities import FileResult
+from server.lexical_index import DEFINITION_SCORE, IDENTIFIER_PATTERN, IndexedChunk, LexicalHit, LexicalIndex, looks_like_identifier, reciprocal_rank_fusion
+from server.repositories.base_repo import BaseRepository, SearchHit
+from server.symbols import extract_symbols
+
+
+class UpsertResult(TypedDict):
+    # The number of chunks that were embedded
+    embedded: int
+    # The number of chunks that were added, replaced, updated or removed, 0 when the files were stored as they are
+    changed: int
 
 
 class CodeRepository(BaseRepository):
-    def __init__(self, http_client: ClientAPI | None = None) -> None:
-        super().__init__("repo-chat", http_client)
+    """
+    Stores the source code as chunks (see chunker.py). Every chunk has the metadata relative_file_path,
+    file_id (the id of the file version it belongs to), start_line, end_line and symbols (the comma separated
+    names of the functions, classes and methods that start in the chunk, see symbols.py).
+
+    The chunks are also kept in a local lexical index (see lexical_index.py), which is used by hybrid_search.
+    """
+
+    def __init__(self, http_client: ClientAPI | None = None, embedding_function: EmbeddingFunction[Documents] | None = None,
+                 lexical_index: LexicalIndex | None = None) -> None:
+        super().__init__("repo-chat", http_client, embedding_function)
+        self.lexical_index = lexical_index or LexicalIndex(self.name())
+
+    def upsert_files(self, file_results: List[FileResult]) -> UpsertResult:
+        """
+        Chunks the given (new or changed) files and stores the chunks. Chunks that are already stored for the
+        same path with the same content are kept and only get their file_id (and their span, if they moved)
+        updated, so only the chunks that changed are embedded. Chunks of the previous versions that no longer
+        exist are removed.
+
+        Returns:
+            UpsertResult: The number of chunks that were embedded and the number of chunks that changed.
+        """
+        paths = [result["relative_file_path"] for result in file_results]
+        existing_metadatas: Dict[str, Metadata] = {}
+        existing_spans: Dict[str, Tuple[int, int]] = {}
+        for document in self.iter_documents(where={"relative_file_path": {"$in": paths}}, include=["metadatas"]):
+            metadata = document["metadata"] or {}
+            existing_metadatas[document["id"]] = metadata
+            existing_spans[document["id"]] = (int(metadata.get("start_line", 0)), int(metadata.get("end_line", 0)))
+
+        new_chunks: Dict[str, Tuple[Chunk, Metadata]] = {}
+        kept_chunks: Dict[str, Metadata] = {}
+        moved_chunks: Dict[str, Tuple[Chunk, Metadata]] = {}
+        indexed_chunks: List[IndexedChunk] = []
+        for result in file_results:
+            chunks = chunk_file(result["relative_file_path"], result["content"])
+            if len(chunks) == 0:
+                # Empty files are stored as an empty chunk, so they are known to be indexed
+                chunks = [create_chunk(result["relative_file_path"], 0, 0, "")]
+            symbols = extract_symbols(
+                result["relative_file_path"], result["content"])
+            for chunk in chunks:
+                chunk_symbols = [symbol["name"] for symbol in symbols
+                                 if chunk["start_line"] <= symbol["start_line"] <= chunk["end_line"]]
+                metadata: Metadata = {
+                    "relative_file_path": chunk["relative_file_path"],
+                    "file_id": result["id"],
+                    "start_line": chunk["start_line"],
+                    "end_line": chunk["end_line"],
+                    "symbols": ",".join(chunk_symbols),
+                }
+                if chunk["id"] not in existing_spans:
+                    new_chunks[chunk["id"]] = (chunk, metadata)
+                elif existing_spans[chunk["id"]] != (chunk["start_line"], chunk["end_line"]):
+                    # The document starts with the span, it is replaced without embedding the chunk again
+                    moved_chunks[chunk["id"]] = (chunk, metadata)
+                else:
+                    kept_chunks[chunk["id"]] = metadata
+                indexed_chunks.append(IndexedChunk(
+                    id=chunk["id"],
+                    relative_file_path=chunk["relative_file_path"],
+                    file_id=result["id"],
+                    start_line=chunk["start_line"],
+                    end_line=chunk["end_line"],
+                    document=self.format_chunk(chunk),
+                    symbols=chunk_symbols))
+
+        # Files reported as changed may be unchanged (e.g. touched), their chunks are left alone
+        updated_chunks = {id: metadata for id, metadata in kept_chunks.items()
+                          if existing_metadatas[id] != metadata}
+        if len(updated_chunks) > 0:
+            self.update_metadatas(list(updated_chunks.keys()),
+                                  list(updated_chunks.values()))
+        if len(moved_chunks) > 0:
+            self.update_documents(list(moved_chunks.keys()),
+                                  [self.format_chunk(chunk) for chunk, _ in moved_chunks.values()],
+                                  [metadata for _, metadata in moved_chunks.values()])
+        if len(new_chunks) > 0:
+            self.upsert(list(new_chunks.keys()),
+                        [self.format_chunk(chunk)
+                         for chunk, _ in new_chunks.values()],
+                        [metadata for _, metadata in new_chunks.values()],
+                        # Only the content is embedded, so identical code at another path reuses the cached embedding
+                        embed_texts=[chunk["content"] for chunk, _ in new_chunks.values()])
+        stale_ids = list(set(existing_spans) - set(kept_chunks) - set(moved_chunks))
+        if len(stale_ids) > 0:
+            self.remove_docs(ids=stale_ids)
+        self.lexical_index.replace_files(indexed_chunks)
+        return UpsertResult(embedded=len(new_chunks),
+                            changed=len(new_chunks) + len(moved_chunks) + len(updated_chunks) + len(stale_ids))
+
+    def format_chunk(self, chunk: Chunk) -> str:
+        # Like the summaries in the documentation collection, the document starts with the path
+        return f"{chunk['relative_file_path']}:{chunk['start_line']}-{chunk['end_line']}\n{chunk['content']}"
+
+    def get_indexed_file_ids(self) -> Tuple[Set[str], List[str]]:
+        """
+        Returns the ids of the indexed files, and the ids of documents stored as whole files
+        (without a file_id), as done before the code was chunked.
+        """
+        file_ids: Set[str] = set()
+        legacy_ids: List[str] = []
+        for document in self.iter_documents(include=["metadatas"]):
+            metadata = document["metadata"]
+            if metadata is not None and "file_id" in metadata:
+                file_ids.add(str(metadata["file_id"]))
+            else:
+                legacy_ids.append(document["id"])
+        return file_ids, legacy_ids
+
+    def remove_files(self, file_ids: List[str]) -> None:
+        self.remove_where(where={"file_id": {"$in": file_ids}})
+        self.lexical_index.remove_files(file_ids)
+
+    def remove_paths(self, relative_file_paths: List[str]) -> int:
+        """
+        Removes the chunks of the files at the given paths, whatever version of the files they belong to.
+
+        Returns:
+            int: The number of chunks removed, 0 when none of the files was indexed.
+        """
+        ids = self.get_ids(where={"relative_file_path": {"$in": relative_file_paths}})
+        if len(ids) > 0:
+            self.remove_docs(ids=ids)
+        self.lexical_index.remove_paths(relative_file_paths)
+        return len(ids)
+
+    def sync_lexical_index(self, file_ids: Set[str], batch_size: int = 100) -> int:
+        """
+        Makes the lexical index contain exactly the given indexed files. Files that are missing from the index
+        (e.g. when the index was deleted, or the collection was indexed before there was a lexical index) are
+        added from the documents stored in Chroma, without reading or chunking them again.
+
+        Returns:
+            int: The number of files added to the lexical index.
+        """
+        indexed_file_ids = self.lexical_index.file_ids()
+        extra_file_ids = list(indexed_file_ids - file_ids)
+        if len(extra_file_ids) > 0:
+            self.lexical_index.remove_files(extra_file_ids)
+        missing_file_ids = list(file_ids - indexed_file_ids)
+        for start in range(0, len(missing_file_ids), batch_size):
+            batch = missing_file_ids[start:start + batch_size]
+            chunks: List[IndexedChunk] = []
+            for document in self.iter_documents(where={"file_id": {"$in": batch}}):
+                metadata = document["metadata"] or {}
+                chunks.append(IndexedChunk(
+                    id=document["id"],
+                    relative_file_path=str(metadata["relative_file_path"]),
+                    file_id=str(metadata["file_id"]),
+                    start_line=int(metadata["start_line"]),
+                    end_line=int(metadata["end_line"]),
+                    document=document["document"] or "",
+                    symbols=[name for name in str(metadata.get("symbols", "")).split(",") if name != ""]))
+            self.lexical_index.replace_files(chunks)
+        return len(missing_file_ids)
+
+    def hybrid_search(self, query: str, n_results: int = 5) -> List[str]:
+        """
+        Searches the code for one query with hybrid_search_many.
+
+        Returns:
+            List[str]: The documents of the best chunks, which start with path:start_line-end_line.
+        """
+        return [hit["document"] or "" for hit in self.hybrid_search_many([query], n_results)[0]]
+
+    def hybrid_search_many(self, queries: List[str], n_results: int = 5,
+                           mmr_lambda: float | None = None) -> List[List[SearchHit]]:
+        """
+        Searches the code for several queries by combining the lexical index and the vector store. The vector
+        searches of all queries are sent to Chroma in one request.
+
+        A query that consists of a single identifier (e.g. get_files_to_process or `FolderResult`) is answered
+        from the identifier table only, with the chunks that define it first. A single ordinary word (e.g.
+        caching) only counts as an identifier when a chunk defines it, as every word of the comments is in the
+        identifier table too. Other queries fuse the rankings of the identifiers in the query, BM25 and the
+        vector search with reciprocal rank fusion.
+
+        The identifier queries are answered before the cached results of the collection are looked up, as that
+        checks the generation of the collection in Chroma. So they are answered even when Chroma is down.
+
+        Args:
+            mmr_lambda (float | None): Diversifies the vector search (see BaseRepository.search_many).
+
+        Returns:
+            List[List[SearchHit]]: The best chunks of every query, with their relative_file_path, start_line
+            and end_line. Only chunks found by the vector search have a distance.
+        """
+        results = [self._identifier_hits(query, n_results) for query in queries]
+        other_queries = [query for query, result in zip(queries, results) if result is None]
+        if len(other_queries) == 0:
+            return cast(List[List[SearchHit]], results)
+        other_results = iter(self.cached_result(
+            ("hybrid_search_many", tuple(other_queries), n_results, mmr_lambda),
+            lambda: self._fused_search_many(other_queries, n_results, mmr_lambda)))
+        return [result if result is not None else next(other_results) for result in results]
+
+    def _identifier_hits(self, query: str, n_results: int) -> List[SearchHit] | None:
+        """
+        Returns the hits of a query that consists of a single identifier, or None for other queries.
+        """
+        words = IDENTIFIER_PATTERN.findall(query)
+        if len(words) != 1:
+            return None
+        hits = self.lexical_index.search_identifiers(words, n_results)
+        # The hits are ordered by definitions first
+        if len(hits) > 0 and (looks_like_identifier(words[0]) or hits[0]["score"] >= DEFINITION_SCORE):
+            return [lexical_search_hit(hit) for hit in hits]
+        return None
+
+    def _fused_search_many(self, queries: List[str], n_results: int,
+                           mmr_lambda: float | None) -> List[List[SearchHit]]:
+        # Every ranking contributes more candidates than requested, so chunks ranked well by several agree
+        candidates = n_results * 2
+        results: List[List[SearchHit]] = []
+        for query, vector_hits in zip(queries, self.search_many(queries, candidates, mmr_lambda=mmr_lambda)):
+            hits_by_id: Dict[str, SearchHit] = {}
+            rankings: List[List[str]] = []
+            identifiers = [word for word in IDENTIFIER_PATTERN.findall(query) if looks_like_identifier(word)]
+            for lexical_hits in [self.lexical_index.search_identifiers(identifiers, candidates),
+                                 self.lexical_index.search_bm25(query, candidates)]:
+                hits_by_id.update((hit["id"], lexical_search_hit(hit)) for hit in lexical_hits)
+                rankings.append([hit["id"] for hit in lexical_hits])
+            # The hits of the vector search replace the lexical ones, they have the full metadata and a distance
+            hits_by_id.update((hit["id"], hit) for hit in vector_hits)
+            rankings.append([hit["id"] for hit in vector_hits])
+            results.append([hits_by_id[id] for id in reciprocal_rank_fusion(rankings)[:n_results]])
+        return results
+
+
+def lexical_search_hit(hit: LexicalHit) -> SearchHit:
+    return SearchHit(id=hit["id"], document=hit["document"], distance=None,
+                     metadata={"relative_file_path": hit["relative_file_path"], "start_line": hit["start_line"],
+                               "end_line": hit["end_line"]})
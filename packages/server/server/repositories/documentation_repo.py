@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from chromadb import Metadata, Where
+from typing import Dict, Iterator
+from chromadb import Documents, EmbeddingFunction, Metadata, Where
 from chromadb.api import ClientAPI
 from server.repositories.base_repo import BaseRepository
 
@@ -26,8 +27,16 @@ class FolderDocumentation(DocumentationType):
 
 
 class DocumentationRepository(BaseRepository):
-    def __init__(self, http_client: ClientAPI | None = None) -> None:
-        super().__init__("documentation", http_client)
-
-    def query_all_ids_of_type(self, type: DocumentationType) -> list:
-        return super().query_all_ids(where=type.where())
+    def __init__(self, http_client: ClientAPI | None = None, embedding_function: EmbeddingFunction[Documents] | None = None) -> None:
+        super().__init__("documentation", http_client, embedding_function)
+
+    def iter_ids_of_type(self, type: DocumentationType) -> Iterator[str]:
+        return self.iter_ids(where=type.where())
+
+    def get_folder_hashes(self) -> Dict[str, str]:
+        """
+        Returns the ids (the Merkle hashes of the folders) of the stored folder summaries by relative folder
+        path, without fetching the summaries.
+        """
+        return {str((document["metadata"] or {}).get("relative_folder_path")): document["id"]
+                for document in self.iter_documents(where=FolderDocumentation().where(), include=["metadatas"])}
@@ -0,0 +1,58 @@
+import os
+
+from server.file_manifest import FileManifest
+from server.git_changes import GitState
+from server.repositories.base_repo import BaseRepository
+
+
+class RepositorySync:
+    """
+    The steps shared by the runs that bring a collection up to date with BASE_FOLDER (the indexer and the
+    summarizers), so they can not drift apart.
+
+    On construction, git_changes holds the changes git reports since the last complete run of the consumer
+    state_name, or None when the whole tree has to be walked: on the first run (an empty collection), with
+    full=True, or when the changes can not be derived from git. current_state is the state to record once
+    the run is complete.
+    """
+
+    def __init__(self, repo: BaseRepository, state_name: str, full: bool = False) -> None:
+        self.repo = repo
+        self.state_name = state_name
+        self.number_of_docs = repo.count()
+        print(f'{self.number_of_docs} documents in collection {repo.name()}')
+
+        self.base_folder = os.getenv('BASE_FOLDER') or './../../'
+        print(f"Scanning files and directories in {self.base_folder} ({os.path.abspath(self.base_folder)})")
+        self.manifest = FileManifest(self.base_folder)
+        self.git_state = GitState(self.base_folder)
+        self.git_changes, self.current_state = self.git_state.changes(state_name) \
+            if not full and self.number_of_docs > 0 else (None, self.git_state.snapshot())
+        if self.git_changes is not None:
+            print(f"Git reports {len(self.git_changes['changed'])} changed and "
+                  f"{len(self.git_changes['removed'])} removed files")
+
+    def save_state(self) -> None:
+        """
+        Records the git state from before the run, files changed during the run are processed again on the
+        next run.
+        """
+        if self.current_state is not None:
+            self.git_state.set(self.state_name, self.current_state)
+
+    def finish(self, changed: bool, complete: bool = True) -> str:
+        """
+        Invalidates the cached search results of the collection when documents were stored or removed, records
+        the git state when the run is complete and logs the number of documents in the collection.
+        """
+        if changed:
+            self.repo.bump_generation()
+        if complete:
+            self.save_state()
+
+        count_final = self.repo.count()
+        log = f"Collection {self.repo.name()} contains {count_final} documents, {
+            abs(self.number_of_docs - count_final)} {
+            'added' if self.number_of_docs - count_final <= 0 else 'removed'}\n\n"
+        print(log)
+        return log
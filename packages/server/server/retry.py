@@ -0,0 +1,68 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Errors worth retrying: connection problems, timeouts and overloaded or failing servers.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError)):
+        return True
+    # The Ollama and OpenAI clients expose the HTTP status code of the failed response
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # Exponential backoff with full jitter, attempt starts at 1
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+async def retry_async(function: Callable[[], Awaitable[T]],
+                      attempts: int = 5,
+                      base_delay: float = 1.0,
+                      max_delay: float = 30.0,
+                      is_retryable: Callable[[BaseException], bool] = is_transient_error) -> T:
+    """
+    Awaits function(), retrying with exponential backoff when it fails with a retryable error.
+    The last error is raised when all attempts have failed.
+    """
+    attempt = 1
+    while True:
+        try:
+            return await function()
+        except Exception as error:
+            if attempt >= attempts or not is_retryable(error):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Attempt {attempt} failed with {type(error).__name__}: {error}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def retry(function: Callable[[], T],
+          attempts: int = 5,
+          base_delay: float = 1.0,
+          max_delay: float = 30.0,
+          is_retryable: Callable[[BaseException], bool] = is_transient_error) -> T:
+    """
+    Calls function(), retrying with exponential backoff when it fails with a retryable error.
+    The last error is raised when all attempts have failed.
+    """
+    attempt = 1
+    while True:
+        try:
+            return function()
+        except Exception as error:
+            if attempt >= attempts or not is_retryable(error):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Attempt {attempt} failed with {type(error).__name__}: {error}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,12 @@
+from typing import Mapping
+from typing import TypedDict
+
+
+# The hits of the repositories, kept free of the chromadb types, so code that only formats hits (e.g. the
+# context packer) does not import chromadb
+class SearchHit(TypedDict):
+    id: str
+    document: str | None
+    metadata: Mapping[str, str | int | float | bool] | None
+    # The distance to the query in the vector store (lower is closer), None for hits not found by embedding
+    distance: float | None
@@ -1,44 +1,98 @@
+import asyncio
+import hashlib
 import os
+from typing import Dict, List, Tuple
 
-from chromadb import Where
+from chromadb import Metadata, Where
 from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages.ai import UsageMetadata
 from langchain_ollama import ChatOllama
-from server.file_utilities import FileResult, get_files_to_process, read_file_content
+from server.change_set import compute_change_set
+from server.chroma_client import wait_until_chroma_ready
+from server.file_manifest import FileManifest
+from server.file_utilities import FileResult, get_files_to_process
+from server.jobs import Job
+from server.progress import ThroughputReport
 from server.repositories import DocumentationRepository, SingleFileDocumentation
+from server.repository_sync import RepositorySync
+from server.retry import retry_async
+from server.summary_cache import SummaryCache
+
+SUMMARY_SYSTEM_PROMPT = """You are an expert programmer specialised in writing excellent documentation of source code and configuration files.
+                You will read the following source code or configuration and write a summary of the purpose of the code, including any important details.
+                You will end the summary with a comma separated list of the most important keywords that are directly relevant to the code.
+                You will respond simply with the summary of the code. Do not include any of the code in your response.
+                Do not include any conversational elements in your response, like "It appears that you have provided ...".
+                Just respond with the summary and keywords.
+                """
+# Cached summaries are only reused for the same prompt
+PROMPT_VERSION = hashlib.md5(SUMMARY_SYSTEM_PROMPT.encode()).hexdigest()
 
 
 class SingleFileSummarizer:
-    def __init__(self) -> None:
+    def __init__(self, concurrency: int = 4, upsert_batch_size: int = 20, max_attempts: int = 5) -> None:
+        """
+        Args:
+            concurrency (int): The maximum number of summaries requested from the LLM at the same time.
+            upsert_batch_size (int): The number of finished summaries stored in one upsert.
+            max_attempts (int): The number of attempts per file on transient LLM failures.
+        """
         self.llm = ChatOllama(model="llama3.2", num_ctx=5000)
         self.is_file_summary: Where = {"file_summary": True}
+        self.concurrency = concurrency
+        self.upsert_batch_size = upsert_batch_size
+        self.max_attempts = max_attempts
+        self.summary_cache = SummaryCache()
+
+    def document_code(self, job: Job | None = None, full: bool = False) -> str:
+        return asyncio.run(self.adocument_code(job, full))
+
+    async def adocument_code(self, job: Job | None = None, full: bool = False) -> str:
+        """
+        Summarizes the new and changed files of BASE_FOLDER and removes the summaries of files that are gone.
 
-    def document_code(self) -> str:
+        Like the indexer, only the files git reports as changed since the last complete run are summarized,
+        unless full is True or the changes can not be derived from git.
+
+        When run as a job, the progress counts are reported to the job. A cancelled job stops sending files to
+        the LLM, stores the summaries that are done and raises JobCancelled.
+        """
+        wait_until_chroma_ready()
         documentation_repo = DocumentationRepository()
 
-        number_of_docs = documentation_repo.count()
-        print(f'{number_of_docs} documents documented')
+        sync = RepositorySync(documentation_repo, "summarizer", full)
+        manifest = sync.manifest
+        if sync.git_changes is not None:
+            log, report = await self.asummarize_changes(sync.git_changes["changed"], sync.git_changes["removed"],
+                                                        manifest, job)
+            # Files that failed are checked again on the next run
+            if sync.current_state is not None:
+                sync.current_state["dirty"] = sorted(set(sync.current_state["dirty"]) | set(
+                    os.path.relpath(path, sync.base_folder).replace(os.sep, "/") for path in report.failed_paths))
+            sync.save_state()
+            return log
 
-        base_folder = os.getenv('BASE_FOLDER') or './../../'
-        codebase = get_files_to_process(base_folder)
+        # The binary check is left to the manifest, so unchanged files are not opened
+        codebase = get_files_to_process(sync.base_folder)
 
-        stored_ids = documentation_repo.query_all_ids_of_type(
+        stored_ids = documentation_repo.iter_ids_of_type(
             SingleFileDocumentation())
-        file_results = [result for result in (read_file_content(
-            base_folder, file, skip_content=True) for file in codebase["files"])]
-        repo_ids = [result["id"] for result in file_results]
-        new_file_results = [
-            result for result in file_results if result["id"] not in stored_ids]
-        removed_ids = [id for id in stored_ids if id not in repo_ids]
-
-        # Document the new files
-        for index, result in enumerate(new_file_results):
-            print(index, result["id"], result["relative_file_path"])
-            result = read_file_content(base_folder, result["file_path"])
-            summary = self.prepare_summary(result)
-            print(summary[:50])
-            summary = result["relative_file_path"] + "\n" + summary
-            documentation_repo.upsert([result["id"]], [summary], [
-                                      {"relative_file_path": result["relative_file_path"], "file_summary": True}])
+        file_results = [result for result in (manifest.read_file(file, skip_content=True)
+                                              for file in codebase["files"]) if result is not None]
+        manifest.prune(codebase["files"])
+        manifest.save()
+        manifest.log_stats()
+        changes = compute_change_set(
+            stored_ids, file_results, key=lambda result: result["id"])
+        changes.log("File summaries")
+        changes.log_duplicates(lambda result: result["relative_file_path"])
+        removed_ids = changes.removed_ids
+
+        report = await self.asummarize_files(documentation_repo, manifest, changes.added, job)
+        if job is not None and job.cancelled:
+            if report.completed > 0:
+                documentation_repo.bump_generation()
+            job.raise_if_cancelled()
 
         # Remove docs that are no longer in the repo
         if len(removed_ids) > 0:
@@ -46,27 +100,180 @@ class SingleFileSummarizer:
             documentation_repo.remove_docs(ids=removed_ids)
             print("Removed", len(removed_ids), "docs from collection")
 
-        count_final = documentation_repo.count()
-        log = f"Collection {documentation_repo.name()} contains {count_final} documents, {abs(number_of_docs - count_final)} {
-            'added' if number_of_docs - count_final <= 0 else 'removed'}\n\n"
-        print(log)
+        # Invalidate the cached search results of the collection. Files that failed are summarized again by
+        # walking the tree on the next run
+        return sync.finish(report.completed > 0 or len(removed_ids) > 0, complete=report.failed == 0)
+
+    async def asummarize_files(self, documentation_repo: DocumentationRepository, manifest: FileManifest,
+                               file_results: List[FileResult], job: Job | None = None) -> ThroughputReport:
+        """
+        Summarizes the given files, with at most self.concurrency LLM calls in flight, and stores the summaries
+        in batches of upsert_batch_size. The files are read when their summary is not cached.
+        """
+        report = ThroughputReport("File summaries", len(file_results))
+        if job is not None:
+            job.track(report.counts)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: List[Tuple[str, str, Metadata]] = []
+        # The summary of every content hash that is sent to the LLM in this run, None if it failed
+        summaries_by_hash: Dict[str, asyncio.Future[str | None]] = {}
+
+        async def summarize(result: FileResult) -> Tuple[FileResult, str] | None:
+            # Files with the same content (e.g. after a rename) are not sent to the LLM again
+            cached_summary = self.cached_summary(result)
+            if cached_summary is not None:
+                report.record_cache_hit()
+                return result, cached_summary
+            # Files with the same content in this run (licenses, __init__.py) wait for the first one
+            shared_summary = summaries_by_hash.get(result["content_hash"])
+            if shared_summary is not None:
+                summary = await shared_summary
+                if summary is None:
+                    report.record_failure(result["file_path"])
+                    return None
+                report.record_cache_hit()
+                return result, summary
+            shared_summary = asyncio.get_running_loop().create_future()
+            summaries_by_hash[result["content_hash"]] = shared_summary
+            finished: Tuple[FileResult, str] | None = None
+            try:
+                finished = await summarize_with_llm(result)
+            finally:
+                shared_summary.set_result(finished[1] if finished is not None else None)
+            return finished
+
+        async def summarize_with_llm(result: FileResult) -> Tuple[FileResult, str] | None:
+            async with semaphore:
+                if job is not None and job.cancelled:
+                    return None
+                try:
+                    file_result = await asyncio.to_thread(manifest.read_file, result["file_path"])
+                    if file_result is None:
+                        raise ValueError("not a UTF-8 text file any more")
+                    result = file_result
+                    summary, usage = await retry_async(lambda: self.aprepare_summary(result),
+                                                       attempts=self.max_attempts)
+                except Exception as error:
+                    # The file is summarized again on the next run
+                    print(f"Could not summarize {result['relative_file_path']}: {error}")
+                    report.record_failure(result["file_path"])
+                    return None
+            report.record(usage)
+            return result, summary
+
+        async def flush() -> None:
+            batch = pending.copy()
+            pending.clear()
+            await asyncio.to_thread(documentation_repo.upsert,
+                                    [id for id, _, _ in batch],
+                                    [summary for _, summary, _ in batch],
+                                    [metadata for _, _, metadata in batch])
+
+        tasks = [asyncio.create_task(summarize(result))
+                 for result in file_results]
+        for task in asyncio.as_completed(tasks):
+            finished = await task
+            if finished is None:
+                continue
+            result, summary = finished
+            print(report.completed, result["id"],
+                  result["relative_file_path"], summary[:50])
+            summary = result["relative_file_path"] + "\n" + summary
+            pending.append((result["id"], summary, {
+                           "relative_file_path": result["relative_file_path"], "file_summary": True}))
+            if len(pending) >= self.upsert_batch_size:
+                await flush()
+        if len(pending) > 0:
+            await flush()
+        print(report.summary())
+        return report
+
+    def document_changes(self, changed_paths: List[str], removed_paths: List[str],
+                         manifest: FileManifest | None = None) -> str:
+        return asyncio.run(self.adocument_changes(changed_paths, removed_paths, manifest))
+
+    async def adocument_changes(self, changed_paths: List[str], removed_paths: List[str],
+                                manifest: FileManifest | None = None) -> str:
+        """
+        Summarizes only the given changed files of BASE_FOLDER instead of walking the whole tree, e.g. the files
+        reported by the watcher. The summaries of the removed files and of the previous versions of the
+        changed files are removed.
+        """
+        log, _ = await self.asummarize_changes(changed_paths, removed_paths, manifest)
         return log
 
-    def prepare_summary(self, file_result: FileResult) -> str:
-        messages: LanguageModelInput = [
-            ("system", """You are an expert programmer specialised in writing excellent documentation of source code and configuration files.
-                You will read the following source code or configuration and write a summary of the purpose of the code, including any important details.
-                You will end the summary with a comma separated list of the most important keywords that are directly relevant to the code.
-                You will respond simply with the summary of the code. Do not include any of the code in your response.
-                Do not include any conversational elements in your response, like "It appears that you have provided ...".
-                Just respond with the summary and keywords.
-                """),
+    async def asummarize_changes(self, changed_paths: List[str], removed_paths: List[str],
+                                 manifest: FileManifest | None = None,
+                                 job: Job | None = None) -> Tuple[str, ThroughputReport]:
+        """
+        Same as adocument_changes, also returning the report of the summaries. A cancelled job stores the
+        summaries that are done and raises JobCancelled.
+        """
+        documentation_repo = DocumentationRepository()
+        base_folder = os.getenv('BASE_FOLDER') or './../../'
+        manifest = manifest or FileManifest(base_folder)
+
+        file_results: List[FileResult] = []
+        gone_paths = list(removed_paths)
+        for file_path in changed_paths:
+            try:
+                result = manifest.read_file(file_path, skip_content=True)
+            except OSError:
+                result = None
+            # Files that are gone or binary by now are removed
+            if result is None:
+                gone_paths.append(file_path)
+            else:
+                file_results.append(result)
+        manifest.save()
+
+        relative_paths = [os.path.relpath(file_path, os.path.dirname(base_folder))
+                          for file_path in changed_paths + gone_paths]
+        stored_ids = set(documentation_repo.get_ids(where={"$and": [
+            {"file_summary": True}, {"relative_file_path": {"$in": relative_paths}}]})) if len(relative_paths) > 0 else set()
+        current_ids = set(result["id"] for result in file_results)
+        report = await self.asummarize_files(documentation_repo, manifest,
+                                             [result for result in file_results if result["id"] not in stored_ids], job)
+        if job is not None and job.cancelled:
+            if report.completed > 0:
+                documentation_repo.bump_generation()
+            job.raise_if_cancelled()
+
+        stale_ids = list(stored_ids - current_ids)
+        if len(stale_ids) > 0:
+            documentation_repo.remove_docs(ids=stale_ids)
+        if report.completed > 0 or len(stale_ids) > 0:
+            documentation_repo.bump_generation()
+
+        log = f"Summarized {report.completed} changed files, removed {len(stale_ids)} summaries"
+        print(log)
+        return log, report
+
+    def summary_messages(self, file_result: FileResult) -> LanguageModelInput:
+        return [
+            ("system", SUMMARY_SYSTEM_PROMPT),
             ("user", f"Summarize this file: <file_name>{
              file_result["relative_file_path"]}</file_name><content>{file_result["content"]}</content>")
         ]
-        response = self.llm.invoke(messages, {})
+
+    def cached_summary(self, file_result: FileResult) -> str | None:
+        return self.summary_cache.get(file_result["content_hash"], PROMPT_VERSION, self.llm.model)
+
+    def prepare_summary(self, file_result: FileResult) -> str:
+        cached_summary = self.cached_summary(file_result)
+        if cached_summary is not None:
+            return cached_summary
+        response = self.llm.invoke(self.summary_messages(file_result), {})
+        self.summary_cache.put(
+            file_result["content_hash"], PROMPT_VERSION, self.llm.model, response.content)
         return response.content
 
+    async def aprepare_summary(self, file_result: FileResult) -> Tuple[str, UsageMetadata | None]:
+        response = await self.llm.ainvoke(self.summary_messages(file_result), {})
+        self.summary_cache.put(
+            file_result["content_hash"], PROMPT_VERSION, self.llm.model, response.content)
+        return response.content, response.usage_metadata
+
 
 if __name__ == '__main__':
     SingleFileSummarizer().document_code()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import threading
+import time
+
+from server.file_utilities import get_cache_folder
+
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+
+class SummaryCache:
+    """
+    Local, content-addressed cache of LLM summaries stored in SQLite.
+
+    Summaries are keyed by the hash of the summarized content, the version of the prompt and the name of the
+    model, not by the path of the file, so moving or renaming files does not require new LLM calls.
+    When the cache grows beyond max_bytes, the least recently used summaries are evicted.
+    """
+
+    def __init__(self, cache_path: str | None = None, max_bytes: int = MAX_CACHE_BYTES) -> None:
+        self.cache_path = cache_path or os.path.join(
+            get_cache_folder(), "summaries.sqlite3")
+        self.max_bytes = max_bytes
+        # The cache is used from the worker threads of the summarizers
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.cache_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    content_hash TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, prompt_version, model)
+                )""")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)")
+            # Running total of the sizes, so a put does not have to sum the whole table
+            self._total_bytes = self._size()
+
+    def get(self, content_hash: str, prompt_version: str, model: str) -> str | None:
+        key = (content_hash, prompt_version, model)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT summary FROM summaries WHERE content_hash = ? AND prompt_version = ? AND model = ?", key).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE summaries SET last_used = ? WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+                (time.time(),) + key)
+        return row[0]
+
+    def put(self, content_hash: str, prompt_version: str, model: str, summary: str) -> None:
+        size = len(summary.encode())
+        with self._lock, self._connection:
+            replaced = self._connection.execute(
+                "SELECT size FROM summaries WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+                (content_hash, prompt_version, model)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, prompt_version, model, summary, size, time.time()))
+            self._total_bytes += size - (replaced[0] if replaced is not None else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size()
+
+    def _size(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+
+    def _evict(self) -> None:
+        # Other processes may share the cache file, so the total is counted again before evicting
+        self._total_bytes = self._size()
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        # Delete the least recently used summaries until the cache is below its limit again
+        freed = 0
+        rows = self._connection.execute(
+            "SELECT rowid, size FROM summaries ORDER BY last_used").fetchall()
+        rowids = []
+        for rowid, size in rows:
+            if freed >= excess:
+                break
+            rowids.append((rowid,))
+            freed += size
+        self._connection.executemany(
+            "DELETE FROM summaries WHERE rowid = ?", rowids)
+        self._total_bytes -= freed
+        print(f"Evicted {len(rowids)} summaries ({freed} bytes) from the summary cache")
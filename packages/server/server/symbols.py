@@ -0,0 +1,294 @@
+import ast
+import bisect
+import re
+from typing import List, Tuple
+from typing import TypedDict
+
+PYTHON_EXTENSIONS = (".py",)
+TYPESCRIPT_EXTENSIONS = (".ts", ".tsx", ".mts", ".cts",
+                         ".js", ".jsx", ".mjs", ".cjs")
+MARKDOWN_EXTENSIONS = (".md", ".mdx")
+SYMBOL_EXTENSIONS = PYTHON_EXTENSIONS + TYPESCRIPT_EXTENSIONS + MARKDOWN_EXTENSIONS
+
+# Declarations at the top level of a TypeScript/JavaScript file (or of a namespace)
+TYPESCRIPT_DECLARATION_PATTERN = re.compile(
+    r"^[ \t]*(?:export[ \t]+)?(?:default[ \t]+)?(?:declare[ \t]+)?(?:"
+    r"(?P<function>(?:async[ \t]+)?function[ \t]*\*?[ \t]*(?P<function_name>[A-Za-z_$][\w$]*))|"
+    r"(?P<class>(?:abstract[ \t]+)?class[ \t]+(?P<class_name>[A-Za-z_$][\w$]*))|"
+    r"(?P<interface>interface[ \t]+(?P<interface_name>[A-Za-z_$][\w$]*))|"
+    r"(?P<type>type[ \t]+(?P<type_name>[A-Za-z_$][\w$]*)[^=\n]*=)|"
+    r"(?P<enum>(?:const[ \t]+)?enum[ \t]+(?P<enum_name>[A-Za-z_$][\w$]*))|"
+    r"(?P<arrow>(?:const|let|var)[ \t]+(?P<arrow_name>[A-Za-z_$][\w$]*)[ \t]*(?::[^=\n]+)?=[ \t]*"
+    r"(?:async[ \t]+)?(?:function\b|(?:<[^>\n]*>)?(?:\([^)]*\)|[A-Za-z_$][\w$]*)[ \t]*(?::[^=\n]+)?=>)))",
+    re.MULTILINE)
+# Methods, constructors and accessors in the body of a class
+TYPESCRIPT_METHOD_PATTERN = re.compile(
+    r"^[ \t]*(?:(?:public|private|protected|static|readonly|abstract|override|async|get|set)[ \t]+)*\*?[ \t]*"
+    r"(?P<name>#?[A-Za-z_$][\w$]*)[ \t]*(?:<[^>\n]*>)?[ \t]*\(",
+    re.MULTILINE)
+TYPESCRIPT_KEYWORDS = {"if", "for", "while", "switch", "catch", "return", "function",
+                       "with", "new", "typeof", "await", "super", "this"}
+MARKDOWN_HEADING_PATTERN = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+# Matched at a position, so the rest of the code is never copied: the block body of an arrow function, and the
+# | or & that continues a type alias on the next line
+BLOCK_BODY_PATTERN = re.compile(r"\s*\{")
+TYPE_CONTINUATION_PATTERN = re.compile(r"[ \t]*[|&]")
+
+
+class Symbol(TypedDict):
+    name: str
+    # function, method, class, interface, type, enum or section
+    kind: str
+    signature: str
+    # 1-based and inclusive, like the spans of the chunks
+    start_line: int
+    end_line: int
+    # The name of the enclosing class, for methods
+    parent: str | None
+
+
+def extract_symbols(relative_file_path: str | None, content: str) -> List[Symbol]:
+    """
+    Extracts the functions, classes, methods and other declarations of a file without an LLM: Python files are
+    parsed with ast, TypeScript and JavaScript files are scanned with regular expressions after removing
+    comments and strings, and Markdown files yield their headings.
+
+    Args:
+        relative_file_path (str | None): The path of the file, used to pick the language. Without a path,
+            the content is parsed as Python if possible, otherwise scanned as TypeScript.
+        content (str): The content of the file.
+
+    Returns:
+        List[Symbol]: The symbols in the order of their position in the file.
+    """
+    if relative_file_path is None:
+        symbols = extract_python_symbols(content)
+        return symbols if symbols is not None else extract_typescript_symbols(content)
+    if relative_file_path.endswith(PYTHON_EXTENSIONS):
+        return extract_python_symbols(content) or []
+    if relative_file_path.endswith(TYPESCRIPT_EXTENSIONS):
+        return extract_typescript_symbols(content)
+    if relative_file_path.endswith(MARKDOWN_EXTENSIONS):
+        return extract_markdown_symbols(content)
+    return []
+
+
+def has_symbol_extractor(relative_file_path: str) -> bool:
+    return relative_file_path.endswith(SYMBOL_EXTENSIONS)
+
+
+def format_symbols(symbols: List[Symbol]) -> str:
+    """
+    Formats symbols as one line per symbol: the line span, followed by the signature.
+    """
+    return "\n".join(f"{symbol['start_line']}-{symbol['end_line']}: {symbol['signature']}" for symbol in symbols)
+
+
+def extract_python_symbols(content: str) -> List[Symbol] | None:
+    """
+    Returns the module level functions and classes and the methods of classes (also of nested classes),
+    or None if the content is not valid Python.
+    """
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+    symbols: List[Symbol] = []
+
+    def visit(body: List[ast.stmt], parent: str | None) -> None:
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                prefix = "async def" if isinstance(
+                    node, ast.AsyncFunctionDef) else "def"
+                returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                symbols.append(python_symbol(node, "method" if parent else "function",
+                                             f"{prefix} {node.name}({ast.unparse(node.args)}){returns}", parent))
+            elif isinstance(node, ast.ClassDef):
+                bases = [ast.unparse(base) for base in node.bases] + \
+                    [ast.unparse(keyword) for keyword in node.keywords]
+                symbols.append(python_symbol(node, "class",
+                                             f"class {node.name}({', '.join(bases)})" if bases else f"class {node.name}", parent))
+                visit(node.body, node.name)
+
+    visit(tree.body, None)
+    return symbols
+
+
+def python_symbol(node: ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef, kind: str, signature: str, parent: str | None) -> Symbol:
+    # Decorators belong to the definition
+    start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    return Symbol(name=node.name, kind=kind, signature=signature, start_line=start_line,
+                  end_line=node.end_lineno or node.lineno, parent=parent)
+
+
+def extract_typescript_symbols(content: str) -> List[Symbol]:
+    """
+    Returns the top level functions, arrow functions, classes, interfaces, type aliases and enums and the
+    methods of classes. Declarations nested in functions are not included.
+    """
+    code = strip_comments_and_strings(content)
+    line_starts = [0] + [index + 1 for index, character in enumerate(code) if character == "\n"]
+    depths = line_depths(code, line_starts)
+    symbols: List[Symbol] = []
+
+    for match in TYPESCRIPT_DECLARATION_PATTERN.finditer(code):
+        start_line = line_of(line_starts, match.start())
+        if depths[start_line - 1] != 0:
+            continue
+        kind = next(group for group in ("function", "class", "interface", "type", "enum", "arrow")
+                    if match.group(group) is not None)
+        name = match.group(f"{kind}_name")
+        # Type aliases and arrow functions with an expression body have no braces around their body
+        expression_body = kind == "type" or (
+            kind == "arrow" and BLOCK_BODY_PATTERN.match(code, match.end()) is None)
+        signature_end, end = declaration_end(code, match.end(), stop_at_newline=expression_body)
+        symbols.append(Symbol(name=name, kind="function" if kind == "arrow" else kind,
+                              signature=collapse_whitespace(content[match.start():signature_end]),
+                              start_line=start_line, end_line=line_of(line_starts, end), parent=None))
+        if kind == "class":
+            symbols.extend(typescript_methods(content, code, line_starts, depths,
+                                              name, signature_end, end))
+    return sorted(symbols, key=lambda symbol: symbol["start_line"])
+
+
+def typescript_methods(content: str, code: str, line_starts: List[int], depths: List[int],
+                       class_name: str, body_start: int, body_end: int) -> List[Symbol]:
+    methods: List[Symbol] = []
+    body_depth = depths[line_of(line_starts, body_start) - 1] + 1
+    for match in TYPESCRIPT_METHOD_PATTERN.finditer(code, body_start + 1, body_end):
+        start_line = line_of(line_starts, match.start())
+        if depths[start_line - 1] != body_depth or match.group("name") in TYPESCRIPT_KEYWORDS:
+            continue
+        signature_end, end = declaration_end(code, match.end() - 1)
+        methods.append(Symbol(name=match.group("name"), kind="method",
+                              signature=collapse_whitespace(content[match.start():signature_end]),
+                              start_line=start_line, end_line=line_of(line_starts, end), parent=class_name))
+    return methods
+
+
+def extract_markdown_symbols(content: str) -> List[Symbol]:
+    """
+    Returns the headings, each spanning the lines up to the next heading of the same or a higher level.
+    """
+    line_count = len(content.splitlines())
+    headings: List[Tuple[int, int, str]] = []
+    for match in MARKDOWN_HEADING_PATTERN.finditer(content):
+        headings.append((content.count("\n", 0, match.start()) + 1,
+                        len(match.group(1)), match.group(2)))
+    symbols: List[Symbol] = []
+    for index, (start_line, level, title) in enumerate(headings):
+        end_line = next((next_start - 1 for next_start, next_level, _ in headings[index + 1:]
+                         if next_level <= level), line_count)
+        symbols.append(Symbol(name=title, kind="section", signature="#" * level + " " + title,
+                              start_line=start_line, end_line=end_line, parent=None))
+    return symbols
+
+
+def strip_comments_and_strings(content: str) -> str:
+    """
+    Replaces comments and the contents of string and template literals with spaces,
+    keeping newlines and the positions of all other characters, so the code can be scanned for braces.
+    """
+    result = list(content)
+    index = 0
+    length = len(content)
+
+    def blank(start: int, end: int) -> None:
+        for position in range(start, min(end, length)):
+            if result[position] != "\n":
+                result[position] = " "
+
+    while index < length:
+        character = content[index]
+        following = content[index + 1] if index + 1 < length else ""
+        if character == "/" and following == "/":
+            end = content.find("\n", index)
+            end = length if end == -1 else end
+            blank(index, end)
+            index = end
+        elif character == "/" and following == "*":
+            end = content.find("*/", index + 2)
+            end = length if end == -1 else end + 2
+            blank(index, end)
+            index = end
+        elif character in "'\"`":
+            end = index + 1
+            while end < length and content[end] != character:
+                if content[end] == "\\":
+                    end += 1
+                elif content[end] == "\n" and character != "`":
+                    break
+                end += 1
+            # Keep the quotes, so an empty string is still a token
+            blank(index + 1, end)
+            index = end + 1
+        else:
+            index += 1
+    return "".join(result)
+
+
+def line_depths(code: str, line_starts: List[int]) -> List[int]:
+    """
+    Returns the depth of curly braces at the start of every line.
+    """
+    depths: List[int] = []
+    depth = 0
+    previous = 0
+    for start in line_starts:
+        segment = code[previous:start]
+        depth += segment.count("{") - segment.count("}")
+        depths.append(depth)
+        previous = start
+    return depths
+
+
+def declaration_end(code: str, position: int, stop_at_newline: bool = False) -> Tuple[int, int]:
+    """
+    Scans a declaration from position on and returns where its signature ends (before the body) and where the
+    declaration ends (the closing brace of the body, or the semicolon of a declaration without a body).
+    """
+    depth = 0
+    index = position
+    while index < len(code):
+        character = code[index]
+        if character in "([":
+            depth += 1
+        elif character in ")]":
+            depth -= 1
+        elif character == "{" and depth == 0 and not stop_at_newline:
+            return index, matching_brace(code, index)
+        elif character == "{":
+            depth += 1
+        elif character == "}" and depth > 0:
+            depth -= 1
+        elif character == ";" and depth == 0:
+            return index, index
+        elif character == "\n" and depth == 0 and stop_at_newline:
+            # Type aliases may continue on the next line with | or &
+            if TYPE_CONTINUATION_PATTERN.match(code, index + 1) is None:
+                return index, index
+        index += 1
+    return len(code), len(code)
+
+
+def matching_brace(code: str, position: int) -> int:
+    depth = 0
+    for index in range(position, len(code)):
+        if code[index] == "{":
+            depth += 1
+        elif code[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(code)
+
+
+def line_of(line_starts: List[int], position: int) -> int:
+    """
+    Returns the 1-based line of a position, by bisecting the start positions of the lines.
+    """
+    return bisect.bisect_right(line_starts, position)
+
+
+def collapse_whitespace(text: str) -> str:
+    return " ".join(text.split()).rstrip(" ={")
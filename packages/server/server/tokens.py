@@ -0,0 +1,6 @@
+# A rough estimate for English text and code, good enough to stay within the context window
+CHARACTERS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARACTERS_PER_TOKEN + 1
@@ -0,0 +1,416 @@
+import argparse
+import os
+import threading
+import time
+from typing import Dict, List, Protocol, Set, Tuple
+
+from server.file_manifest import FileManifest
+from server.file_utilities import get_cache_folder, is_file_to_process, iter_files_to_process
+from server.indexer import index_changes, indexer
+from server.jobs import Job, JobCancelled
+from server.repositories.code_repo import CodeRepository
+from server.single_file_summarizer import SingleFileSummarizer
+
+# Changes are processed once no new change came in for DEBOUNCE_SECONDS (e.g. while a branch is checked
+# out), but never later than MAX_DELAY_SECONDS after the first change
+DEBOUNCE_SECONDS = 1.0
+MAX_DELAY_SECONDS = 10.0
+# How often the polling backend walks the tree, when watchdog is not available
+POLL_INTERVAL = 2.0
+
+StatSignature = Tuple[int, int, int]
+
+
+class PendingChanges:
+    """
+    Collects the changed and removed paths reported by a watch backend until they are processed in one batch.
+    A path that changes several times is processed once, with its last state.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self.changed: Set[str] = set()
+        self.removed: Set[str] = set()
+        self.changed_folders: Set[str] = set()
+        self.removed_folders: Set[str] = set()
+        self._first_change = 0.0
+        self._last_change = 0.0
+
+    def file_changed(self, path: str) -> None:
+        with self._condition:
+            self.removed.discard(path)
+            self.changed.add(path)
+            self._touch()
+
+    def file_removed(self, path: str) -> None:
+        with self._condition:
+            self.changed.discard(path)
+            self.removed.add(path)
+            self._touch()
+
+    def file_moved(self, source: str, destination: str) -> None:
+        with self._condition:
+            self.changed.discard(source)
+            self.removed.add(source)
+            self.removed.discard(destination)
+            self.changed.add(destination)
+            self._touch()
+
+    def folder_removed(self, path: str) -> None:
+        with self._condition:
+            self.removed_folders.add(path)
+            self._touch()
+
+    def folder_changed(self, path: str) -> None:
+        with self._condition:
+            self.changed_folders.add(path)
+            self._touch()
+
+    def folder_moved(self, source: str, destination: str) -> None:
+        with self._condition:
+            self.removed_folders.add(source)
+            self.changed_folders.add(destination)
+            self._touch()
+
+    def _touch(self) -> None:
+        now = time.monotonic()
+        if self._first_change == 0.0:
+            self._first_change = now
+        self._last_change = now
+        self._condition.notify_all()
+
+    def _has_changes_locked(self) -> bool:
+        return len(self.changed) + len(self.removed) + len(self.changed_folders) + len(self.removed_folders) > 0
+
+    def wait(self, stop: threading.Event, debounce: float = DEBOUNCE_SECONDS,
+             max_delay: float = MAX_DELAY_SECONDS) -> bool:
+        """
+        Waits until there are changes and no new change came in for debounce seconds (or the first change is
+        max_delay seconds old). Returns False when stop is set first.
+        """
+        with self._condition:
+            while not stop.is_set():
+                if self._has_changes_locked():
+                    now = time.monotonic()
+                    due = min(self._last_change + debounce, self._first_change + max_delay)
+                    if now >= due:
+                        return True
+                    self._condition.wait(min(due - now, 0.5))
+                else:
+                    # Wake up regularly to see the stop event
+                    self._condition.wait(0.5)
+            return False
+
+    def drain(self) -> Tuple[List[str], List[str], List[str], List[str]]:
+        """
+        Returns and clears the changed files, removed files, changed folders and removed folders.
+        """
+        with self._condition:
+            drained = (sorted(self.changed), sorted(self.removed),
+                       sorted(self.changed_folders), sorted(self.removed_folders))
+            self.changed, self.removed, self.changed_folders, self.removed_folders = set(), set(), set(), set()
+            self._first_change = 0.0
+            return drained
+
+
+class WatchBackend(Protocol):
+    name: str
+
+    def start(self) -> None:
+        ...
+
+    def stop(self) -> None:
+        ...
+
+
+class PollingBackend:
+    """
+    Detects changes by comparing the stat signatures (size, mtime_ns, inode) of all files between walks of the
+    tree. Only the walk costs I/O, no file is opened. A file that disappears while a file with its inode
+    appears is reported as moved.
+    """
+
+    name = "polling"
+
+    def __init__(self, base_folder: str, pending: PendingChanges, interval: float = POLL_INTERVAL) -> None:
+        self.base_folder = base_folder
+        self.pending = pending
+        self.interval = interval
+        # The files of the last walk, every file counts as new until start takes the first snapshot
+        self._snapshot: Dict[str, StatSignature] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="watch-poll", daemon=True)
+
+    def start(self) -> None:
+        self._snapshot = self.scan()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def scan(self) -> Dict[str, StatSignature]:
+        snapshot: Dict[str, StatSignature] = {}
+        for file_path in iter_files_to_process(self.base_folder):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return snapshot
+
+    def poll(self) -> None:
+        """
+        Walks the tree once and reports the differences to the previous walk.
+        """
+        snapshot = self.scan()
+        added = [path for path in snapshot if path not in self._snapshot]
+        added_by_inode = {snapshot[path][2]: path for path in added}
+        for path, signature in self._snapshot.items():
+            if path not in snapshot:
+                destination = added_by_inode.pop(signature[2], None)
+                if destination is not None:
+                    self.pending.file_moved(path, destination)
+                else:
+                    self.pending.file_removed(path)
+            elif snapshot[path] != signature:
+                self.pending.file_changed(path)
+        for path in added_by_inode.values():
+            self.pending.file_changed(path)
+        self._snapshot = snapshot
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+class WatchdogBackend:
+    """
+    Gets the changes from the operating system through watchdog (inotify on Linux, FSEvents on macOS).
+
+    The whole base folder is watched, the events of ignored paths (e.g. in .git or the cache folder, which
+    change on every run) are dropped before they count as a change.
+    """
+
+    name = "watchdog"
+
+    def __init__(self, base_folder: str, pending: PendingChanges) -> None:
+        # Raises ImportError when watchdog is not installed
+        from watchdog.events import FileSystemEvent, FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        is_watched = self.is_watched
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event: FileSystemEvent) -> None:
+                # The type is checked first: checking a path reads .gitignore files, which reports opened events
+                source = os.fsdecode(event.src_path)
+                destination = os.fsdecode(event.dest_path) if event.dest_path else ""
+                if event.event_type in ("created", "modified", "closed"):
+                    if not event.is_directory and is_watched(source, False):
+                        pending.file_changed(source)
+                elif event.event_type == "deleted":
+                    if not is_watched(source, event.is_directory):
+                        return
+                    if event.is_directory:
+                        pending.folder_removed(source)
+                    else:
+                        # The event of a deleted folder may come as a file event, removing the path covers both
+                        pending.file_removed(source)
+                        pending.folder_removed(source)
+                elif event.event_type == "moved":
+                    # A move out of or into an ignored folder is only the removal or the creation of a path
+                    watched_source = is_watched(source, event.is_directory)
+                    watched_destination = is_watched(destination, event.is_directory)
+                    if watched_source and watched_destination:
+                        if event.is_directory:
+                            pending.folder_moved(source, destination)
+                        else:
+                            pending.file_moved(source, destination)
+                    elif watched_source:
+                        if event.is_directory:
+                            pending.folder_removed(source)
+                        else:
+                            pending.file_removed(source)
+                    elif watched_destination:
+                        if event.is_directory:
+                            pending.folder_changed(destination)
+                        else:
+                            pending.file_changed(destination)
+
+        self.base_folder = base_folder
+        self.cache_folder = os.path.realpath(get_cache_folder())
+        self._observer = Observer()
+        self._observer.schedule(Handler(), base_folder, recursive=True)
+
+    def is_watched(self, path: str, is_dir: bool) -> bool:
+        real_path = os.path.realpath(path)
+        if real_path == self.cache_folder or real_path.startswith(self.cache_folder + os.sep):
+            return False
+        return is_file_to_process(self.base_folder, path, is_dir=is_dir)
+
+    def start(self) -> None:
+        self._observer.start()
+
+    def stop(self) -> None:
+        self._observer.stop()
+
+
+def create_backend(base_folder: str, pending: PendingChanges, polling: bool = False,
+                   poll_interval: float = POLL_INTERVAL) -> WatchBackend:
+    """
+    Starts watchdog, or the polling backend when polling is requested, watchdog is not installed or the
+    operating system refuses to watch (e.g. when the inotify watch limit is reached).
+    """
+    if not polling:
+        try:
+            backend = WatchdogBackend(base_folder, pending)
+            backend.start()
+            return backend
+        except ImportError:
+            print("watchdog is not installed, polling for changes instead")
+        except OSError as error:
+            print(f"Could not watch {base_folder} ({error}), polling for changes instead")
+    polling_backend = PollingBackend(base_folder, pending, poll_interval)
+    polling_backend.start()
+    return polling_backend
+
+
+class Watcher:
+    """
+    Keeps the code index (and optionally the file summaries) of BASE_FOLDER up to date while files change.
+
+    The changes reported by the backend are debounced and only the touched files are indexed and summarized
+    (see index_changes and SingleFileSummarizer.document_changes). Renames are handled as the removal of the
+    old path and a new file. A change of a .gitignore file can change which files are indexed at all, so it
+    triggers a full run instead.
+    """
+
+    def __init__(self,
+                 base_folder: str | None = None,
+                 document: bool = True,
+                 polling: bool = False,
+                 debounce: float = DEBOUNCE_SECONDS,
+                 max_delay: float = MAX_DELAY_SECONDS,
+                 poll_interval: float = POLL_INTERVAL) -> None:
+        self.base_folder = base_folder or os.getenv('BASE_FOLDER') or './../../'
+        self.document = document
+        self.polling = polling
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.pending = PendingChanges()
+        self.batches = 0
+        self.changed_files = 0
+        self.removed_files = 0
+        self.full_runs = 0
+        self.failures = 0
+
+    def counts(self) -> Dict[str, int]:
+        return {"batches": self.batches, "changed_files": self.changed_files, "removed_files": self.removed_files,
+                "full_runs": self.full_runs, "failures": self.failures}
+
+    def run(self, stop: threading.Event | None = None, job: Job | None = None, initial_run: bool = True) -> str:
+        """
+        Watches until stop is set or the job is cancelled. With initial_run, a full run first catches up with
+        the changes made while nothing was watching.
+        """
+        stop = stop or threading.Event()
+        if job is not None:
+            job.track(self.counts)
+            threading.Thread(target=lambda: self._stop_on_cancel(job, stop), name="watch-cancel", daemon=True).start()
+
+        backend = create_backend(self.base_folder, self.pending, self.polling, self.poll_interval)
+        print(f"Watching {self.base_folder} ({os.path.abspath(self.base_folder)}) with {backend.name}")
+        try:
+            if initial_run:
+                try:
+                    self.full_run(job)
+                except JobCancelled:
+                    raise
+                except Exception as error:
+                    print(f"Could not run a full index: {error}")
+                    self.failures += 1
+                finally:
+                    # The full run reports its own progress to the job
+                    if job is not None:
+                        job.track(self.counts)
+            code_repo = CodeRepository()
+            summarizer = SingleFileSummarizer() if self.document else None
+            while self.pending.wait(stop, self.debounce, self.max_delay):
+                try:
+                    self.process(*self.pending.drain(), code_repo=code_repo, summarizer=summarizer)
+                except Exception as error:
+                    # The files are picked up again by their next change or the next full run
+                    print(f"Could not process changes: {error}")
+                    self.failures += 1
+        finally:
+            backend.stop()
+        if job is not None:
+            job.raise_if_cancelled()
+        return f"Watched {self.base_folder}: {self.counts()}"
+
+    def process(self, changed: List[str], removed: List[str], changed_folders: List[str],
+                removed_folders: List[str], code_repo: CodeRepository | None = None,
+                summarizer: SingleFileSummarizer | None = None) -> None:
+        """
+        Indexes (and summarizes) one batch of changes.
+        """
+        self.batches += 1
+        if any(os.path.basename(path) == ".gitignore" for path in changed + removed):
+            print("A .gitignore file changed, running a full index")
+            self.full_run()
+            return
+
+        manifest = FileManifest(self.base_folder)
+        removed_paths = set(removed)
+        for folder in removed_folders:
+            removed_paths.update(manifest.file_paths_in(folder))
+        changed_paths = set(changed)
+        for folder in changed_folders:
+            # The .gitignore files above the folder apply to its files as well
+            changed_paths.update(iter_files_to_process(self.base_folder, folder=folder))
+        # Changed paths that no longer exist or are binary now are removed by index_changes and the summarizer,
+        # which find that out when they read them through the manifest
+        changed_files = [path for path in sorted(changed_paths - removed_paths)
+                         if is_file_to_process(self.base_folder, path)]
+        removed_files = [path for path in sorted(removed_paths) if is_file_to_process(self.base_folder, path)]
+        if len(changed_files) == 0 and len(removed_files) == 0:
+            return
+
+        print(f"{len(changed_files)} files changed, {len(removed_files)} removed")
+        index_changes(changed_files, removed_files, code_repo=code_repo, manifest=manifest)
+        if summarizer is not None:
+            summarizer.document_changes(changed_files, removed_files, manifest=manifest)
+        self.changed_files += len(changed_files)
+        self.removed_files += len(removed_files)
+
+    def full_run(self, job: Job | None = None) -> None:
+        """
+        Indexes (and summarizes) the whole tree. A cancelled job stops the run and raises JobCancelled.
+        """
+        self.full_runs += 1
+        indexer(job=job)
+        if self.document:
+            SingleFileSummarizer().document_code(job=job)
+
+    def _stop_on_cancel(self, job: Job, stop: threading.Event) -> None:
+        while not stop.wait(0.5):
+            if job.cancelled:
+                stop.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keeps the index of BASE_FOLDER up to date while files change")
+    parser.add_argument("--no-document", action="store_true",
+                        help="Only index the code, do not summarize the changed files")
+    parser.add_argument("--polling", action="store_true",
+                        help="Poll the tree for changes instead of using watchdog")
+    parser.add_argument("--no-initial-run", action="store_true",
+                        help="Do not run a full index before watching")
+    args = parser.parse_args()
+    watcher = Watcher(document=not args.no_document, polling=args.polling)
+    try:
+        watcher.run(initial_run=not args.no_initial_run)
+    except KeyboardInterrupt:
+        print(f"Stopped watching: {watcher.counts()}")
+    os._exit(0)
@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import pytest
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import empty_checkpoint
+
+from server.checkpointer import SqliteCheckpointer
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path) -> str:
+    return os.path.join(tmp_path, "checkpoints.sqlite3")
+
+
+def put_checkpoints(saver: SqliteCheckpointer, thread_id: str, count: int) -> RunnableConfig:
+    config: RunnableConfig = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    for _ in range(count):
+        config = saver.put(config, empty_checkpoint(), {"source": "loop", "step": 0}, {})
+        saver.put_writes(config, [("messages", "value")], task_id="task")
+    return config
+
+
+def count_rows(saver: SqliteCheckpointer, table: str, thread_id: str) -> int:
+    return saver.conn.execute(f"SELECT COUNT(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+
+def test_only_the_latest_checkpoints_of_a_thread_are_kept(checkpoint_path: str) -> None:
+    saver = SqliteCheckpointer(checkpoint_path, max_checkpoints_per_thread=3)
+
+    last_config = put_checkpoints(saver, "session", 5)
+    checkpoints = list(saver.list({"configurable": {"thread_id": "session"}}))
+
+    assert len(checkpoints) == 3
+    assert checkpoints[0].config["configurable"]["checkpoint_id"] == last_config["configurable"]["checkpoint_id"]
+    # The writes of the pruned checkpoints are deleted with them
+    assert count_rows(saver, "writes", "session") == 3
+
+
+def test_latest_checkpoint_is_returned_with_its_writes(checkpoint_path: str) -> None:
+    saver = SqliteCheckpointer(checkpoint_path, max_checkpoints_per_thread=3)
+    last_config = put_checkpoints(saver, "session", 2)
+
+    checkpoint_tuple = saver.get_tuple({"configurable": {"thread_id": "session"}})
+
+    assert checkpoint_tuple is not None
+    assert checkpoint_tuple.config["configurable"]["checkpoint_id"] == last_config["configurable"]["checkpoint_id"]
+    assert checkpoint_tuple.pending_writes == [("task", "messages", "value")]
+
+
+def test_pruning_keeps_other_threads(checkpoint_path: str) -> None:
+    saver = SqliteCheckpointer(checkpoint_path, max_checkpoints_per_thread=2)
+
+    put_checkpoints(saver, "first", 2)
+    put_checkpoints(saver, "second", 4)
+
+    assert count_rows(saver, "checkpoints", "first") == 2
+    assert count_rows(saver, "checkpoints", "second") == 2
+
+
+def test_checkpoints_survive_a_restart(checkpoint_path: str) -> None:
+    put_checkpoints(SqliteCheckpointer(checkpoint_path), "session", 2)
+
+    assert SqliteCheckpointer(checkpoint_path).get_tuple({"configurable": {"thread_id": "session"}}) is not None
+
+
+def test_unused_threads_expire(checkpoint_path: str) -> None:
+    put_checkpoints(SqliteCheckpointer(checkpoint_path), "session", 2)
+
+    # Every thread is older than a TTL of 0, the new saver expires them when it opens the database
+    saver = SqliteCheckpointer(checkpoint_path, thread_ttl=0)
+
+    assert saver.get_tuple({"configurable": {"thread_id": "session"}}) is None
+    assert count_rows(saver, "writes", "session") == 0
+    assert saver.expire() == 0
+
+
+def test_async_methods_run_the_saver(checkpoint_path: str) -> None:
+    saver = SqliteCheckpointer(checkpoint_path, max_checkpoints_per_thread=3)
+    last_config = put_checkpoints(saver, "session", 2)
+
+    checkpoint_tuple = asyncio.run(saver.aget_tuple({"configurable": {"thread_id": "session"}}))
+
+    assert checkpoint_tuple is not None
+    assert checkpoint_tuple.config["configurable"]["checkpoint_id"] == last_config["configurable"]["checkpoint_id"]
@@ -0,0 +1,44 @@
+import httpx
+import pytest
+
+from server import chroma_client
+from server.chroma_client import get_chroma_client, is_transient_chroma_error, keep_transient_status
+
+
+def answer(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/heartbeat"):
+        # The error page of a gateway in front of Chroma
+        return httpx.Response(503, text="<html>Service Unavailable</html>")
+    if request.url.path.endswith("/auth/identity"):
+        return httpx.Response(200, json={"user_id": "", "tenant": "default_tenant",
+                                         "databases": ["default_database"]})
+    return httpx.Response(200, json={"id": "00000000-0000-0000-0000-000000000000", "name": "default_database",
+                                     "tenant": "default_tenant"})
+
+
+def test_gateway_errors_are_transient(monkeypatch) -> None:
+    client_class = httpx.Client
+
+    class MockClient(client_class):  # type: ignore[misc, valid-type]
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(*args, transport=httpx.MockTransport(answer), **kwargs)
+
+    monkeypatch.setattr(httpx, "Client", MockClient)
+    client = get_chroma_client(host="chroma.test", port=1, attempts=1)
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        client.heartbeat()
+    assert is_transient_chroma_error(error.value)
+
+
+def test_missing_session_is_reported() -> None:
+    with pytest.raises(RuntimeError):
+        keep_transient_status(object())  # type: ignore[arg-type]
+
+
+def test_setup_errors_are_not_waited_for(monkeypatch) -> None:
+    monkeypatch.setenv("CHROMA_HOST", "unhooked.test")
+    monkeypatch.setattr(chroma_client, "HttpClient", lambda host, port: object())
+
+    with pytest.raises(RuntimeError):
+        chroma_client.wait_until_chroma_ready(timeout=60)
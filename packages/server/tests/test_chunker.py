@@ -0,0 +1,92 @@
+from server.chunker import MAX_CHUNK_CHARS, chunk_file
+
+PYTHON_CODE = '''import os
+
+CONSTANT = 1
+
+
+def first(a):
+    return a + 1
+
+
+class Greeter:
+    def greet(self, name):
+        return f"Hello {name}"
+'''
+
+
+def test_python_file_is_chunked_by_structure() -> None:
+    chunks = chunk_file("pkg/module.py", PYTHON_CODE)
+
+    assert [(chunk["start_line"], chunk["end_line"]) for chunk in chunks] == [(1, 3), (6, 7), (10, 12)]
+    assert chunks[1]["content"] == "def first(a):\n    return a + 1\n"
+    assert all(chunk["relative_file_path"] == "pkg/module.py" for chunk in chunks)
+
+
+def test_other_files_are_chunked_by_overlapping_windows() -> None:
+    content = "".join(f"line {number}\n" for number in range(1, 201))
+
+    chunks = chunk_file("notes.txt", content)
+
+    assert [(chunk["start_line"], chunk["end_line"]) for chunk in chunks] == [
+        (1, 60), (51, 110), (101, 160), (151, 200)]
+
+
+def test_python_that_does_not_parse_is_chunked_by_lines() -> None:
+    chunks = chunk_file("broken.py", "def broken(:\n    pass\n")
+
+    assert [(chunk["start_line"], chunk["end_line"]) for chunk in chunks] == [(1, 2)]
+
+
+def test_empty_file_has_no_chunks() -> None:
+    assert chunk_file("empty.py", "") == []
+    assert chunk_file("blank.txt", "\n\n  \n") == []
+
+
+def test_chunk_keeps_its_id_when_lines_are_inserted_above() -> None:
+    before = chunk_file("pkg/module.py", PYTHON_CODE)
+    # The module level block changes, the functions below only move
+    after = chunk_file("pkg/module.py", "import sys\n" + PYTHON_CODE)
+
+    assert before[0]["id"] != after[0]["id"]
+    assert [chunk["id"] for chunk in before[1:]] == [chunk["id"] for chunk in after[1:]]
+    assert [chunk["start_line"] for chunk in after[1:]] == [chunk["start_line"] + 1 for chunk in before[1:]]
+
+
+def test_chunk_id_depends_on_path_and_content() -> None:
+    chunk = chunk_file("pkg/module.py", PYTHON_CODE)[1]
+
+    assert chunk_file("pkg/other.py", PYTHON_CODE)[1]["id"] != chunk["id"]
+    assert chunk_file("pkg/module.py", PYTHON_CODE.replace("a + 1", "a + 2"))[1]["id"] != chunk["id"]
+
+
+def test_identical_chunks_in_one_file_get_different_ids() -> None:
+    function = "def same():\n    return 1\n"
+
+    chunks = chunk_file("pkg/module.py", function + "\n\n" + function)
+
+    assert len(chunks) == 2
+    assert chunks[0]["content_hash"] == chunks[1]["content_hash"]
+    assert chunks[0]["id"] != chunks[1]["id"]
+
+
+def test_long_lines_are_split_by_characters() -> None:
+    chunks = chunk_file("data.txt", "x" * (2 * MAX_CHUNK_CHARS + 10))
+
+    assert [len(chunk["content"]) for chunk in chunks] == [MAX_CHUNK_CHARS, MAX_CHUNK_CHARS, 10]
+    assert len(set(chunk["id"] for chunk in chunks)) == 3
+
+
+def test_code_between_and_after_the_methods_of_a_large_class_is_chunked() -> None:
+    method = "".join(f"        value_{number} = {number}\n" for number in range(60))
+    content = ("class Large:\n    NAME = 'large'\n\n"
+               "    def first(self):\n" + method + "\n"
+               "    # Between the methods\n    LIMIT = 10\n\n"
+               "    def second(self):\n" + method + "\n"
+               "    ALIASES = ['big']\n")
+
+    chunks = chunk_file("pkg/large.py", content)
+
+    assert [chunk["content"].strip().splitlines()[0] for chunk in chunks] == [
+        "class Large:", "def first(self):", "# Between the methods", "def second(self):", "ALIASES = ['big']"]
+    assert "LIMIT = 10" in chunks[2]["content"]
@@ -0,0 +1,65 @@
+import hashlib
+import os
+from typing import Iterator
+
+import chromadb
+import pytest
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+from server.file_utilities import create_file_result
+from server.lexical_index import LexicalIndex
+from server.repositories import CodeRepository
+
+CODE = '''def get_files_to_process(base_folder):
+    return []
+
+
+def answer(question):
+    return get_files_to_process(question)
+'''
+
+
+class WordEmbedding(EmbeddingFunction[Documents]):
+    def __init__(self) -> None:
+        pass
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for document in input:
+            vector = [0.0] * 16
+            for word in document.split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 16] += 1.0
+            embeddings.append(vector)
+        return embeddings
+
+
+@pytest.fixture
+def code_repo(tmp_path, monkeypatch) -> Iterator[CodeRepository]:
+    monkeypatch.setenv("CACHE_FOLDER", os.path.join(tmp_path, "cache"))
+    client = chromadb.EphemeralClient()
+    repo = CodeRepository(client, WordEmbedding(), LexicalIndex("test", os.path.join(tmp_path, "lexical.sqlite3")))
+    base_folder = os.path.join(tmp_path, "repo")
+    repo.upsert_files([create_file_result(base_folder, os.path.join(base_folder, "walker.py"), CODE)])
+    yield repo
+    client.delete_collection(repo.name())
+
+
+def fail(*args, **kwargs) -> None:
+    raise AssertionError("Chroma was called")
+
+
+def test_identifier_query_is_answered_without_chroma(code_repo: CodeRepository, monkeypatch) -> None:
+    monkeypatch.setattr(code_repo, "generation", fail)
+    monkeypatch.setattr(code_repo, "search_many", fail)
+
+    hits = code_repo.hybrid_search_many(["get_files_to_process"])[0]
+
+    assert hits[0]["document"] is not None and "def get_files_to_process" in hits[0]["document"]
+    assert all(hit["distance"] is None for hit in hits)
+
+
+def test_other_queries_are_fused_with_the_vector_search(code_repo: CodeRepository) -> None:
+    identifier_hits, fused_hits = code_repo.hybrid_search_many(["get_files_to_process", "answer the question"])
+
+    assert all(hit["distance"] is None for hit in identifier_hits)
+    assert any(hit["distance"] is not None for hit in fused_hits)
@@ -0,0 +1,70 @@
+from server.context_packer import interleave_hits, pack_search_results
+from server.search_hit import SearchHit
+from server.tokens import estimate_tokens
+
+
+def search_hit(id: str, document: str) -> SearchHit:
+    return SearchHit(id=id, document=document, metadata=None, distance=None)
+
+
+def code_hit(id: str, path: str, start_line: int, end_line: int) -> SearchHit:
+    lines = [f"    value_{number} = {number}" for number in range(start_line, end_line + 1)]
+    return search_hit(id, f"{path}:{start_line}-{end_line}\n" + "\n".join(lines))
+
+
+def test_only_the_lines_around_the_match_are_kept() -> None:
+    packed = pack_search_results([("value_20", [code_hit("a", "pkg/module.py", 10, 39)])])
+
+    assert "pkg/module.py:17-23\n    value_17 = 17" in packed
+    assert "value_20 = 20" in packed
+    assert "value_30 = 30" not in packed
+
+
+def test_lines_of_overlapping_hits_are_included_once() -> None:
+    packed = pack_search_results([
+        ("value_20", [code_hit("a", "pkg/module.py", 10, 39)]),
+        ("value_22", [code_hit("b", "pkg/module.py", 15, 44)]),
+    ])
+
+    code_lines = [line for line in packed.splitlines() if line.startswith("    value_")]
+    assert len(code_lines) == len(set(code_lines))
+    # The window of the second hit is split around the lines of the first one
+    assert "pkg/module.py:15-16\n" in packed
+    assert "pkg/module.py:24-25\n" in packed
+
+
+def test_documentation_is_kept_whole() -> None:
+    packed = pack_search_results([("summary", [search_hit("d", "pkg/module.py\nThe module does things.\n")])])
+
+    assert packed == "pkg/module.py\nThe module does things."
+
+
+def test_hits_that_do_not_fit_are_skipped_and_later_ones_still_packed() -> None:
+    small = search_hit("small", "docs/a.md\nShort summary.")
+    large = search_hit("large", "docs/b.md\n" + "Long summary. " * 200)
+    later = search_hit("later", "docs/c.md\nAnother short one.")
+
+    packed = pack_search_results([("summary", [small, large, later])], token_budget=50)
+
+    assert packed == "docs/a.md\nShort summary.\n\ndocs/c.md\nAnother short one."
+
+
+def test_first_hit_is_shortened_to_the_budget() -> None:
+    packed = pack_search_results([("summary", [search_hit("large", "docs/b.md\n" + "Long summary. " * 200)])],
+                                 token_budget=50)
+
+    assert packed.endswith(" [shortened]")
+    assert estimate_tokens(packed.removesuffix(" [shortened]")) <= 51
+
+
+def test_nothing_found() -> None:
+    assert pack_search_results([("query", [])]) == "Nothing found"
+
+
+def test_hits_of_several_queries_are_interleaved_by_rank() -> None:
+    a, b, c = search_hit("a", "a"), search_hit("b", "b"), search_hit("c", "c")
+
+    ordered = interleave_hits([("first", [a, b]), ("second", [b, c])])
+
+    # b is the best hit of the second query, it is not taken again as the second hit of the first one
+    assert [(query, hit["id"]) for query, hit in ordered] == [("first", "a"), ("second", "b"), ("second", "c")]
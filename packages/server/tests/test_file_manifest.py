@@ -0,0 +1,146 @@
+import os
+
+import pytest
+
+import server.file_manifest
+from server.file_manifest import FileManifest, manifest_lock
+
+
+@pytest.fixture
+def base_folder(tmp_path) -> str:
+    folder = os.path.join(tmp_path, "repo")
+    os.makedirs(os.path.join(folder, "pkg"))
+    with open(os.path.join(folder, "pkg", "module.py"), "w", encoding="utf-8") as file:
+        file.write("print('hello')\n")
+    with open(os.path.join(folder, "blob.dat"), "wb") as file:
+        file.write(b"\xff\xfe\x00\x01")
+    return folder
+
+
+@pytest.fixture
+def manifest(base_folder, tmp_path) -> FileManifest:
+    return FileManifest(base_folder, manifest_path=os.path.join(tmp_path, "manifest.json"))
+
+
+def fail_on_read(*args) -> None:
+    raise AssertionError("the file was read")
+
+
+def test_read_file_records_the_file(manifest: FileManifest, base_folder: str) -> None:
+    file_path = os.path.join(base_folder, "pkg", "module.py")
+
+    result = manifest.read_file(file_path)
+    entry = manifest.get(file_path)
+
+    assert result is not None
+    assert result["content"] == "print('hello')\n"
+    assert result["relative_file_path"] == os.path.join("repo", "pkg", "module.py")
+    assert entry is not None
+    assert (entry["id"], entry["content_hash"], entry["binary"]) == (result["id"], result["content_hash"], False)
+
+
+def test_unchanged_file_is_not_read_again(manifest: FileManifest, base_folder: str, monkeypatch) -> None:
+    file_path = os.path.join(base_folder, "pkg", "module.py")
+    first = manifest.read_file(file_path)
+    monkeypatch.setattr(server.file_manifest, "read_text_file", fail_on_read)
+
+    second = manifest.read_file(file_path, skip_content=True)
+
+    assert first is not None and second is not None
+    assert second["id"] == first["id"]
+    assert second["content"] == ""
+    assert manifest.hits == 1
+
+
+def test_changed_file_is_read_again(manifest: FileManifest, base_folder: str) -> None:
+    file_path = os.path.join(base_folder, "pkg", "module.py")
+    first = manifest.read_file(file_path)
+    with open(file_path, "a", encoding="utf-8") as file:
+        file.write("print('changed')\n")
+
+    assert manifest.get(file_path) is None
+    second = manifest.read_file(file_path, skip_content=True)
+
+    assert first is not None and second is not None
+    assert second["id"] != first["id"]
+    assert second["content"] == ""
+    assert manifest.misses == 2
+
+
+def test_binary_file_is_recorded_and_not_read_again(manifest: FileManifest, base_folder: str, monkeypatch) -> None:
+    file_path = os.path.join(base_folder, "blob.dat")
+
+    assert manifest.read_file(file_path) is None
+    entry = manifest.get(file_path)
+    assert entry is not None and entry["binary"]
+
+    monkeypatch.setattr(server.file_manifest, "read_text_file", fail_on_read)
+    assert manifest.read_file(file_path, skip_content=True) is None
+
+
+def test_missing_file_has_no_entry(manifest: FileManifest, base_folder: str) -> None:
+    assert manifest.get(os.path.join(base_folder, "missing.py")) is None
+
+
+def test_saved_manifest_is_loaded_again(manifest: FileManifest, base_folder: str) -> None:
+    file_path = os.path.join(base_folder, "pkg", "module.py")
+    result = manifest.read_file(file_path)
+    manifest.save()
+
+    reloaded = FileManifest(base_folder, manifest_path=manifest.manifest_path)
+    entry = reloaded.get(file_path)
+
+    assert result is not None and entry is not None
+    assert entry["id"] == result["id"]
+    assert reloaded.file_paths_in(os.path.join(base_folder, "pkg")) == [file_path]
+    assert [name for name in os.listdir(os.path.dirname(manifest.manifest_path)) if name.endswith(".tmp")] == []
+
+
+def test_untouched_entries_are_pruned(manifest: FileManifest, base_folder: str) -> None:
+    file_path = os.path.join(base_folder, "pkg", "module.py")
+    manifest.read_file(file_path)
+    manifest.read_file(os.path.join(base_folder, "blob.dat"))
+    manifest.save()
+
+    reloaded = FileManifest(base_folder, manifest_path=manifest.manifest_path)
+    reloaded.read_file(file_path, skip_content=True)
+    reloaded.prune_untouched()
+
+    assert len(reloaded) == 1
+    assert reloaded.get(os.path.join(base_folder, "blob.dat")) is None
+
+
+def test_manifest_lock_is_shared_per_folder(base_folder: str) -> None:
+    assert manifest_lock(base_folder) is manifest_lock(os.path.join(base_folder, "pkg", ".."))
+    assert manifest_lock(base_folder) is not manifest_lock(os.path.join(base_folder, "pkg"))
+
+
+def test_concurrent_saves_keep_each_others_entries(base_folder: str, tmp_path) -> None:
+    manifest_path = os.path.join(tmp_path, "manifest.json")
+    module_path = os.path.join(base_folder, "pkg", "module.py")
+    blob_path = os.path.join(base_folder, "blob.dat")
+
+    # Both runs load the manifest before either of them saves it
+    first = FileManifest(base_folder, manifest_path=manifest_path)
+    second = FileManifest(base_folder, manifest_path=manifest_path)
+    first.read_file(module_path)
+    first.save()
+    second.read_file(blob_path)
+    second.remove(module_path)
+    second.save()
+
+    reloaded = FileManifest(base_folder, manifest_path=manifest_path)
+    assert reloaded.get(blob_path) is not None
+    assert reloaded.get(module_path) is None
+
+
+def test_pruned_entries_are_removed_from_the_saved_manifest(manifest: FileManifest, base_folder: str) -> None:
+    module_path = os.path.join(base_folder, "pkg", "module.py")
+    manifest.read_file(module_path)
+    manifest.read_file(os.path.join(base_folder, "blob.dat"))
+    manifest.save()
+
+    manifest.prune([module_path])
+    manifest.save()
+
+    assert len(FileManifest(base_folder, manifest_path=manifest.manifest_path)) == 1
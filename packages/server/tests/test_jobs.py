@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Iterator
+
+import pytest
+
+from server.jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, Job, JobManager, until_cancelled
+
+
+def wait_for_status(job: Job, *statuses: str, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while job.status not in statuses:
+        assert time.monotonic() < deadline, f"job is still {job.status}"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def release() -> Iterator[threading.Event]:
+    event = threading.Event()
+    yield event
+    # Never leave a worker blocked, even when a test fails
+    event.set()
+
+
+@pytest.fixture
+def job_manager(release: threading.Event) -> Iterator[JobManager]:
+    manager = JobManager(max_workers=2)
+
+    def blocking(job: Job) -> str:
+        while not release.wait(0.01):
+            job.raise_if_cancelled()
+        return "done"
+
+    def failing(job: Job) -> str:
+        raise ValueError("broken")
+
+    manager.register("blocking", blocking)
+    manager.register("failing", failing)
+    yield manager
+    manager.shutdown()
+
+
+def test_identical_job_is_single_flighted(job_manager: JobManager, release: threading.Event) -> None:
+    first = job_manager.start("blocking")
+    wait_for_status(first, RUNNING)
+
+    assert job_manager.start("blocking") is first
+    assert job_manager.start("blocking", {}) is first
+
+    release.set()
+    wait_for_status(first, SUCCEEDED)
+    assert first.result == "done"
+
+
+def test_jobs_with_other_params_run_separately(job_manager: JobManager) -> None:
+    first = job_manager.start("blocking", {"full": True})
+
+    assert job_manager.start("blocking", {"full": False}) is not first
+    assert job_manager.start("blocking", {"full": True}) is first
+
+
+def test_finished_job_is_started_again(job_manager: JobManager, release: threading.Event) -> None:
+    release.set()
+    first = job_manager.start("blocking")
+    wait_for_status(first, SUCCEEDED)
+
+    second = job_manager.start("blocking")
+
+    assert second is not first
+    assert [job.id for job in job_manager.list()] == [first.id, second.id]
+
+
+def test_cancelled_job_is_not_reused(job_manager: JobManager) -> None:
+    first = job_manager.start("blocking")
+    wait_for_status(first, RUNNING)
+
+    job_manager.cancel(first.id)
+    second = job_manager.start("blocking")
+    wait_for_status(first, CANCELLED)
+
+    assert second is not first
+    assert second.status in (QUEUED, RUNNING)
+
+
+def test_failed_job_keeps_its_error(job_manager: JobManager) -> None:
+    job = job_manager.start("failing")
+    wait_for_status(job, FAILED)
+
+    assert job.error == "broken"
+    assert job_manager.get(job.id) is job
+
+
+def test_unknown_kind_is_rejected(job_manager: JobManager) -> None:
+    with pytest.raises(KeyError):
+        job_manager.start("unknown")
+
+
+def test_progress_is_read_on_every_info() -> None:
+    job = Job("blocking", {})
+    counts = {"files": 0}
+    job.track(lambda: dict(counts))
+    counts["files"] = 3
+
+    assert job.info()["progress"] == {"files": 3}
+
+
+def test_until_cancelled_stops_the_items() -> None:
+    job = Job("blocking", {})
+    items = []
+    for item in until_cancelled(range(10), job):
+        items.append(item)
+        if item == 2:
+            job.cancel()
+
+    assert items == [0, 1, 2]
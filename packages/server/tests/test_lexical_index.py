@@ -0,0 +1,107 @@
+import os
+from typing import List
+
+import pytest
+
+from server.lexical_index import (DEFINITION_SCORE, IndexedChunk, LexicalIndex, looks_like_identifier,
+                                  reciprocal_rank_fusion, tokenize_document)
+
+
+def indexed_chunk(id: str, relative_file_path: str, document: str, symbols: List[str] | None = None,
+                  file_id: str | None = None) -> IndexedChunk:
+    return IndexedChunk(id=id, relative_file_path=relative_file_path, file_id=file_id or relative_file_path,
+                        start_line=1, end_line=document.count("\n") + 1, document=document, symbols=symbols or [])
+
+
+@pytest.fixture
+def index(tmp_path) -> LexicalIndex:
+    lexical_index = LexicalIndex("test", index_path=os.path.join(tmp_path, "lexical.sqlite3"))
+    lexical_index.replace_files([
+        indexed_chunk("definition", "pkg/walker.py",
+                      "def get_files_to_process(base_folder):\n    return []", ["get_files_to_process"]),
+        indexed_chunk("use", "pkg/indexer.py",
+                      "files = get_files_to_process(folder)\nmore = get_files_to_process(other)"),
+        indexed_chunk("unrelated", "pkg/chat.py", "def answer(question):\n    return llm.invoke(question)",
+                      ["answer"]),
+        indexed_chunk("script", "lib/server.rb", "class WebServer\n  def start(port)\n    listen(port)\n  end\nend"),
+    ])
+    return lexical_index
+
+
+def test_identifiers_are_split_into_their_parts() -> None:
+    assert tokenize_document("get_files_to_process") == ["get_files_to_process", "get", "files", "to", "process"]
+    assert tokenize_document("HTTPServer x") == ["httpserver", "http", "server"]
+
+
+def test_looks_like_identifier() -> None:
+    assert looks_like_identifier("get_files")
+    assert looks_like_identifier("FolderResult")
+    assert not looks_like_identifier("indexer")
+
+
+def test_definitions_rank_above_uses(index: LexicalIndex) -> None:
+    hits = index.search_identifiers(["get_files_to_process"])
+
+    assert [hit["id"] for hit in hits] == ["definition", "use"]
+    assert hits[0]["score"] == DEFINITION_SCORE + 1
+    assert hits[1]["score"] == 2
+    assert hits[0]["relative_file_path"] == "pkg/walker.py"
+
+
+def test_identifier_lookup_is_exact(index: LexicalIndex) -> None:
+    assert index.search_identifiers(["get_files"]) == []
+    assert index.search_identifiers(["Get_Files_To_Process"]) == []
+
+
+def test_definitions_are_found_by_pattern_without_symbol_extractor(index: LexicalIndex) -> None:
+    hits = index.search_identifiers(["WebServer"])
+
+    assert [hit["id"] for hit in hits] == ["script"]
+    assert hits[0]["score"] == DEFINITION_SCORE + 1
+
+
+def test_bm25_matches_the_parts_of_identifiers(index: LexicalIndex) -> None:
+    hits = index.search_bm25("files to process")
+
+    assert set(hit["id"] for hit in hits) == {"definition", "use"}
+    assert all(hit["score"] > 0 for hit in hits)
+
+
+def test_bm25_only_returns_chunks_with_a_term(index: LexicalIndex) -> None:
+    hits = index.search_bm25("question llm")
+
+    assert [hit["id"] for hit in hits] == ["unrelated"]
+
+
+def test_bm25_without_matching_terms(index: LexicalIndex) -> None:
+    assert index.search_bm25("nothing matches here") == []
+    assert index.search_bm25("?") == []
+
+
+def test_replace_files_replaces_all_chunks_of_a_file(index: LexicalIndex) -> None:
+    index.replace_files([indexed_chunk("new", "pkg/walker.py", "def walk_tree():\n    pass", ["walk_tree"],
+                                       file_id="walker-v2")])
+
+    assert index.search_identifiers(["get_files_to_process"])[0]["id"] == "use"
+    assert [hit["id"] for hit in index.search_identifiers(["walk_tree"])] == ["new"]
+    assert "walker-v2" in index.file_ids()
+    assert "pkg/walker.py" not in index.file_ids()
+
+
+def test_remove_files_and_paths(index: LexicalIndex) -> None:
+    index.remove_files(["pkg/walker.py"])
+    index.remove_paths(["pkg/indexer.py"])
+
+    assert index.search_identifiers(["get_files_to_process"]) == []
+    assert index.file_ids() == {"pkg/chat.py", "lib/server.rb"}
+
+
+def test_index_is_persisted(index: LexicalIndex) -> None:
+    reopened = LexicalIndex("test", index_path=index.index_path)
+
+    assert [hit["id"] for hit in reopened.search_identifiers(["answer"])] == ["unrelated"]
+
+
+def test_reciprocal_rank_fusion() -> None:
+    # b is second in both rankings, which beats being first in one of them
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["d", "b"]]) == ["b", "a", "d", "c"]
@@ -0,0 +1,57 @@
+import os
+import subprocess
+
+from server.repository_sync import RepositorySync
+
+
+class FakeRepository:
+    def __init__(self, documents: int) -> None:
+        self.documents = documents
+        self.generation = 0
+
+    def name(self) -> str:
+        return "fake"
+
+    def count(self) -> int:
+        return self.documents
+
+    def bump_generation(self) -> None:
+        self.generation += 1
+
+
+def git(base_folder: str, *args: str) -> None:
+    subprocess.run(["git", "-C", base_folder, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   check=True, capture_output=True)
+
+
+def test_changes_since_the_last_complete_run(tmp_path, monkeypatch) -> None:
+    base_folder = os.path.join(tmp_path, "repo")
+    os.makedirs(base_folder)
+    with open(os.path.join(base_folder, "main.py"), "w") as file:
+        file.write("print('hello')\n")
+    git(base_folder, "init", "-q")
+    git(base_folder, "add", "main.py")
+    git(base_folder, "commit", "-q", "-m", "Initial commit")
+    monkeypatch.setenv("BASE_FOLDER", base_folder)
+    monkeypatch.setenv("CACHE_FOLDER", os.path.join(tmp_path, "cache"))
+    repo = FakeRepository(documents=0)
+
+    # The first run walks the full tree
+    first_run = RepositorySync(repo, "test")  # type: ignore[arg-type]
+    assert first_run.git_changes is None
+    repo.documents = 1
+    assert "1 documents, 1 added" in first_run.finish(changed=True)
+    assert repo.generation == 1
+
+    with open(os.path.join(base_folder, "util.py"), "w") as file:
+        file.write("def util():\n    pass\n")
+    second_run = RepositorySync(repo, "test")  # type: ignore[arg-type]
+    assert second_run.git_changes is not None
+    assert second_run.git_changes["changed"] == [os.path.join(base_folder, "util.py")]
+    # An incomplete run leaves the state, so the next run gets the same changes
+    second_run.finish(changed=False, complete=False)
+    assert repo.generation == 1
+
+    third_run = RepositorySync(repo, "test", full=True)  # type: ignore[arg-type]
+    assert third_run.git_changes is None
+    assert RepositorySync(repo, "test").git_changes == second_run.git_changes  # type: ignore[arg-type]
@@ -0,0 +1,19 @@
+from server.benchmarks.startup_benchmark import LAZY_MODULES, measure_startup
+
+# Well above the measured import time (0.35 to 0.85s), so slow CI machines do not fail, while importing
+# LangChain or Chroma again (about 2.5s) does
+MAX_IMPORT_SECONDS = 2.0
+
+
+def test_startup_does_not_import_heavy_dependencies() -> None:
+    result = measure_startup()
+
+    assert result["status"] == 200
+    assert [module for module in LAZY_MODULES if module in result["modules"]] == []
+
+
+def test_import_time_is_below_threshold() -> None:
+    # The best of three, so a single slow start on a busy machine does not fail the test
+    import_time = min(measure_startup()["import"] for _ in range(3))
+
+    assert import_time < MAX_IMPORT_SECONDS
@@ -0,0 +1,86 @@
+from server.symbols import extract_symbols
+
+PYTHON_CODE = '''def first(a):
+    return a + 1
+
+
+class Greeter:
+    def greet(self, name):
+        return f"Hello {name}"
+
+    async def agreet(self):
+        pass
+'''
+
+TYPESCRIPT_CODE = '''export interface Props {
+  name: string;
+}
+
+export class Service {
+  async load(id: string): Promise<void> {
+    // function commented() {}
+    const text = "function quoted() {}";
+  }
+}
+
+export function helper(x: number): number {
+  return x;
+}
+
+export const arrow = (a: string) => a;
+'''
+
+
+def test_python_symbols() -> None:
+    symbols = extract_symbols("pkg/module.py", PYTHON_CODE)
+
+    assert [(symbol["name"], symbol["kind"], symbol["parent"], symbol["start_line"], symbol["end_line"])
+            for symbol in symbols] == [
+        ("first", "function", None, 1, 2),
+        ("Greeter", "class", None, 5, 10),
+        ("greet", "method", "Greeter", 6, 7),
+        ("agreet", "method", "Greeter", 9, 10),
+    ]
+    assert symbols[0]["signature"] == "def first(a)"
+    assert symbols[3]["signature"] == "async def agreet(self)"
+
+
+def test_typescript_symbols_skip_comments_and_strings() -> None:
+    symbols = extract_symbols("web/app.ts", TYPESCRIPT_CODE)
+
+    assert [(symbol["name"], symbol["kind"], symbol["parent"]) for symbol in symbols] == [
+        ("Props", "interface", None),
+        ("Service", "class", None),
+        ("load", "method", "Service"),
+        ("helper", "function", None),
+        ("arrow", "function", None),
+    ]
+    assert symbols[3]["signature"] == "export function helper(x: number): number"
+    assert (symbols[3]["start_line"], symbols[3]["end_line"]) == (12, 14)
+
+
+def test_markdown_headings_are_sections() -> None:
+    symbols = extract_symbols("README.md", "# Title\n\nText\n\n## Install ##\n\nMore\n")
+
+    assert [(symbol["name"], symbol["signature"], symbol["start_line"], symbol["end_line"])
+            for symbol in symbols] == [("Title", "# Title", 1, 7), ("Install", "## Install", 5, 7)]
+
+
+def test_other_files_and_invalid_python_have_no_symbols() -> None:
+    assert extract_symbols("data.json", '{"def": "x"}') == []
+    assert extract_symbols("broken.py", "def broken(:\n") == []
+
+
+def test_language_is_guessed_without_a_path() -> None:
+    assert [symbol["name"] for symbol in extract_symbols(None, PYTHON_CODE)][:2] == ["first", "Greeter"]
+    assert [symbol["name"] for symbol in extract_symbols(None, TYPESCRIPT_CODE)][:2] == ["Props", "Service"]
+
+
+def test_typescript_spans_of_type_aliases_and_arrow_functions() -> None:
+    code = ("type Shape =\n  | Circle\n  & Named;\n\nconst draw = (shape: Shape) =>\n  {\n    return shape;\n  };\n\n"
+            "const area = (shape: Shape) => 0;\n")
+
+    symbols = extract_symbols("web/shapes.ts", code)
+
+    assert [(symbol["name"], symbol["start_line"], symbol["end_line"]) for symbol in symbols] == [
+        ("Shape", 1, 3), ("draw", 5, 8), ("area", 10, 10)]